@@ -0,0 +1,157 @@
+"""在未安装AstrBot的环境中加载插件所需的最小替身模块
+
+仅供 benchmarks 目录下的脚本使用：若已安装真实的 astrbot 则不做任何事。
+"""
+import logging
+import os
+import sys
+import types
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class _PermissionType:
+    ADMIN = "admin"
+    MEMBER = "member"
+
+
+class _Filter:
+    """filter.command 等装饰器的替身，原样返回被装饰的函数"""
+
+    PermissionType = _PermissionType
+
+    @staticmethod
+    def permission_type(permission_type, **kwargs):
+        def decorator(func):
+            func._permission = permission_type
+            return func
+        return decorator
+
+    @staticmethod
+    def command(name, alias=None, **kwargs):
+        def decorator(func):
+            func._command = (name, set(alias or ()))
+            return func
+        return decorator
+
+
+class Star:
+    def __init__(self, context):
+        self.context = context
+
+    async def html_render(self, tmpl, data, return_url=True, options=None):
+        raise NotImplementedError("html_render 需要由调用方替换")
+
+
+class MessageChain:
+    """MessageChain 替身，只保存文本"""
+
+    def __init__(self):
+        self.text = ""
+
+    def message(self, text):
+        self.text += text
+        return self
+
+
+def register(*args, **kwargs):
+    def decorator(cls):
+        return cls
+    return decorator
+
+
+def install():
+    """安装 astrbot 替身模块（如可导入真实模块则跳过）"""
+    try:
+        import astrbot.api  # noqa: F401
+        return
+    except ImportError:
+        pass
+
+    astrbot = types.ModuleType("astrbot")
+    api = types.ModuleType("astrbot.api")
+    api_all = types.ModuleType("astrbot.api.all")
+    api_event = types.ModuleType("astrbot.api.event")
+    api_star = types.ModuleType("astrbot.api.star")
+
+    api.logger = logging.getLogger("astrbot")
+    api.AstrBotConfig = dict
+    for name in ("AstrMessageEvent", "CommandResult", "Context", "Plain"):
+        setattr(api_all, name, type(name, (), {}))
+    api_event.filter = _Filter()
+    api_event.MessageChain = MessageChain
+    api_star.Star = Star
+    api_star.Context = api_all.Context
+    api_star.register = register
+
+    astrbot.api = api
+    api.all = api_all
+    api.event = api_event
+    api.star = api_star
+    sys.modules.update({
+        "astrbot": astrbot,
+        "astrbot.api": api,
+        "astrbot.api.all": api_all,
+        "astrbot.api.event": api_event,
+        "astrbot.api.star": api_star,
+    })
+
+
+class FakeResult:
+    """event.plain_result / image_result 的返回值替身"""
+
+    def __init__(self, kind, content):
+        self.kind = kind
+        self.content = content
+
+    def use_t2i(self, enabled):
+        return self
+
+
+class FakeEvent:
+    """AstrMessageEvent 替身，只实现插件用到的属性与方法"""
+
+    def __init__(self, user_id, sender_name, message_str, group_id=""):
+        self.message_str = message_str
+        self.message_obj = types.SimpleNamespace(
+            sender=types.SimpleNamespace(user_id=user_id, nickname=sender_name),
+            group_id=group_id,
+        )
+        self._sender_name = sender_name
+        self._group_id = group_id
+        self.unified_msg_origin = f"fake:{'GroupMessage' if group_id else 'FriendMessage'}:{group_id or user_id}"
+
+    def get_sender_name(self):
+        return self._sender_name
+
+    def get_sender_id(self):
+        return str(self.message_obj.sender.user_id)
+
+    def get_group_id(self):
+        return self._group_id
+
+    def plain_result(self, text):
+        return FakeResult("plain", text)
+
+    def image_result(self, url_or_path):
+        return FakeResult("image", url_or_path)
+
+
+class FakeContext:
+    """插件上下文替身，主动发送的消息记录在 sent 中"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, session, message_chain):
+        self.sent.append((session, message_chain.text))
+        return True
+
+
+def load_plugin():
+    """安装替身后导入插件的 main 模块"""
+    install()
+    if PLUGIN_DIR not in sys.path:
+        sys.path.insert(0, PLUGIN_DIR)
+    import main
+    return main
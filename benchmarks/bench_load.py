@@ -0,0 +1,164 @@
+"""离线压测：本地替身API + 模拟AstrBot事件，以 N 个并发用户驱动插件的指令处理函数
+
+报告每个指令的调用次数、失败数、p50/p99 耗时以及整体吞吐量，用于在部署前发现性能回退。
+
+用法：
+    python benchmarks/bench_load.py --users 100 --rounds 5 --scenario mixed
+    python benchmarks/bench_load.py --scenario burst --latency 80 --error-rate 0.05
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from astrbot_shim import FakeContext, FakeEvent, load_plugin
+from mock_api import MockApiServer
+
+main = load_plugin()
+
+# 指令标签 -> (处理函数名, 生成消息文本的函数(用户序号, 用户总数))
+COMMANDS = {
+    "帮助": ("help", lambda i, n: "帮助"),
+    "状态": ("status", lambda i, n: "状态"),
+    "个人信息": ("personal_info", lambda i, n: "个人信息"),
+    "排行榜": ("ranking", lambda i, n: "排行榜"),
+    "道友": ("friends", lambda i, n: "道友"),
+    "日志": ("log", lambda i, n: "日志"),
+    "打坐": ("meditate", lambda i, n: "打坐"),
+    "突破": ("breakthrough", lambda i, n: "突破"),
+    "签到": ("sign_in", lambda i, n: "签到"),
+    "切磋": ("duel", lambda i, n: f"切磋 @{user_name((i + 1) % n)}"),
+    "赠送": ("give", lambda i, n: f"赠送 @{user_name((i + 1) % n)} 灵石x1"),
+    "丹方": ("recipe", lambda i, n: "丹方" if i % 2 else "丹方 回气丹"),
+    "学习功法": ("learn_skill", lambda i, n: "学习功法 焚决"),
+    "技能": ("skills", lambda i, n: "技能"),
+    "宗门": ("sect", lambda i, n: f"宗门 创建 宗门{i}"),
+    "宗门信息": ("sect", lambda i, n: "宗门 信息"),
+    "宗门任务": ("sect_task", lambda i, n: "宗门任务"),
+    "上架": ("auction", lambda i, n: "拍卖行 上架 回气丹"),
+    "拍卖搜索": ("auction", lambda i, n: "拍卖行 搜索 回气丹"),
+}
+
+SCENARIOS = {
+    "read": ["状态", "个人信息", "排行榜", "道友", "日志", "帮助"],
+    "write": ["打坐", "突破", "签到", "切磋", "赠送"],
+    "mixed": ["状态", "打坐", "个人信息", "排行榜", "切磋", "道友", "突破", "赠送", "日志", "帮助", "签到"],
+    # 群活动：所有人同时打坐，随后查看状态
+    "burst": ["打坐", "状态"],
+    # 丹方、功法、宗门、拍卖行（接口为插件假定的格式，见 main.py）；每轮所有用户发送相同指令，先创建宗门、上架再查询
+    "catalogue": ["宗门", "上架", "丹方", "学习功法", "技能", "宗门信息", "宗门任务", "拍卖搜索"],
+}
+
+
+def user_name(index):
+    return f"u{index}"
+
+
+class BenchBot(main.LiteraryBattleQiBot):
+    """用固定耗时写出小文件的方式模拟浏览器渲染"""
+
+    render_ms = 300.0
+    render_calls = 0
+
+    async def html_render(self, tmpl, data, return_url=True, options=None):
+        type(self).render_calls += 1
+        await asyncio.sleep(self.render_ms / 1000)
+        fd, path = tempfile.mkstemp(suffix=".jpg", dir=".")
+        with os.fdopen(fd, "wb") as f:
+            f.write(tmpl.encode("utf-8")[:4096])
+        return os.path.abspath(path)
+
+
+async def drive(bot, label, user_index, users, latencies, failures):
+    handler_name, build_message = COMMANDS[label]
+    event = FakeEvent(10000 + user_index, user_name(user_index), build_message(user_index, users))
+    start = time.perf_counter()
+    results = [result async for result in getattr(bot, handler_name)(event)]
+    latencies.setdefault(label, []).append((time.perf_counter() - start) * 1000)
+    if any(r.kind == "plain" and str(r.content).startswith("❌") for r in results):
+        failures[label] = failures.get(label, 0) + 1
+
+
+def pick_command(scenario, commands, user_index, round_index):
+    """burst 场景每轮所有用户发送相同指令，其余场景按用户错开"""
+    if scenario in ("burst", "catalogue"):
+        return commands[round_index % len(commands)]
+    return commands[(user_index + round_index) % len(commands)]
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+async def run(args):
+    server = MockApiServer(
+        latency_ms=args.latency, jitter_ms=args.jitter,
+        error_rate=args.error_rate, drop_rate=args.drop_rate,
+        enforce_cooldowns=not args.no_cooldowns,
+    ).start()
+    main.API_URL = server.url
+    BenchBot.render_ms = args.render_ms
+    config = json.loads(args.config) if args.config else {}
+    config.setdefault("http", {}).setdefault("max_connections", max(100, args.users))
+    bot = BenchBot(FakeContext(), config)
+
+    # 注册所有用户（不计入统计）
+    for i in range(args.users):
+        async for _ in bot.create_character(FakeEvent(10000 + i, user_name(i), "创建角色")):
+            pass
+    server.request_count = 0
+    server.action_counts.clear()
+    BenchBot.render_calls = 0
+
+    commands = SCENARIOS[args.scenario]
+    latencies, failures = {}, {}
+    start = time.perf_counter()
+    for round_index in range(args.rounds):
+        await asyncio.gather(*(
+            drive(bot, pick_command(args.scenario, commands, i, round_index), i, args.users, latencies, failures)
+            for i in range(args.users)
+        ))
+    elapsed = time.perf_counter() - start
+
+    await bot.terminate()
+    server.stop()
+
+    total = sum(len(values) for values in latencies.values())
+    print(f"场景：{args.scenario}  用户：{args.users}  轮数：{args.rounds}  "
+          f"上游延迟：{args.latency}±{args.jitter}ms  渲染：{args.render_ms}ms")
+    print(f"{'指令':<8}{'次数':>6}{'失败':>6}{'p50(ms)':>10}{'p99(ms)':>10}{'平均(ms)':>10}")
+    for label in commands:
+        values = latencies.get(label)
+        if not values:
+            continue
+        print(f"{label:<8}{len(values):>6}{failures.get(label, 0):>6}"
+              f"{percentile(values, 50):>10.1f}{percentile(values, 99):>10.1f}{statistics.mean(values):>10.1f}")
+    print(f"\n总计 {total} 条指令，用时 {elapsed:.2f}s，吞吐量 {total / elapsed:.1f} 条/秒")
+    print(f"上游请求 {server.request_count} 次，浏览器渲染 {BenchBot.render_calls} 次")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="文字斗气插件离线压测")
+    parser.add_argument("--users", type=int, default=50, help="并发用户数")
+    parser.add_argument("--rounds", type=int, default=3, help="每个用户发送的指令数")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="mixed")
+    parser.add_argument("--latency", type=float, default=30, help="上游固定延迟（毫秒）")
+    parser.add_argument("--jitter", type=float, default=20, help="上游随机抖动（毫秒）")
+    parser.add_argument("--error-rate", type=float, default=0, help="上游返回503的概率")
+    parser.add_argument("--drop-rate", type=float, default=0, help="上游直接断开连接的概率")
+    parser.add_argument("--render-ms", type=float, default=300, help="模拟的单次渲染耗时（毫秒）")
+    parser.add_argument("--no-cooldowns", action="store_true", help="替身服务器不校验冷却时间")
+    parser.add_argument("--config", help="插件配置（JSON字符串）")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    with tempfile.TemporaryDirectory() as workdir:
+        # 插件的缓存文件写入临时目录，不污染仓库
+        os.chdir(workdir)
+        asyncio.run(run(arguments))
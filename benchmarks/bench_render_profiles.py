@@ -0,0 +1,84 @@
+"""各模板在不同渲染参数下的图片大小与截图耗时
+
+使用 Playwright Chromium 模拟 AstrBot 的 html_render，需要先安装：
+    pip install playwright && python -m playwright install chromium
+
+用法：python benchmarks/bench_render_profiles.py [--repeat 5] [--dpr 2]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from astrbot_shim import load_plugin
+from sample_data import PERSONAL_INFO_DATA, RANKING_DATA, STATUS_DATA
+
+main = load_plugin()
+
+# 参与对比的渲染参数，第一项为改造前所有模板共用的参数
+PROFILES = {
+    "原始 jpeg q95": {"type": "jpeg", "quality": 95, "full_page": True},
+    "默认 jpeg q85": main.DEFAULT_RENDER_PROFILE,
+    "jpeg q70": {**main.DEFAULT_RENDER_PROFILE, "quality": 70},
+    "jpeg q85 css": {**main.DEFAULT_RENDER_PROFILE, "scale": "css"},
+    "png": {**main.DEFAULT_RENDER_PROFILE, "type": "png"},
+}
+
+
+class _CaptureBot(main.LiteraryBattleQiBot):
+    """截获交给渲染器的HTML，不实际渲染"""
+
+    async def _schedule_render(self, tmpl, data, return_url, options, priority=main.RENDER_PRIORITY_USER):
+        self.captured = tmpl
+        return None
+
+
+async def collect_pages():
+    bot = _CaptureBot(None)
+    pages = {}
+    for name, render in (
+        ("menu", lambda: bot.text_to_image_menu_style(main.HELP_TEXT)),
+        ("personal_info", lambda: bot.render_personal_info_image(PERSONAL_INFO_DATA)),
+        ("status", lambda: bot.render_status_image(STATUS_DATA)),
+        ("ranking", lambda: bot.render_ranking_image(RANKING_DATA)),
+    ):
+        await render()
+        pages[name] = bot.captured
+    await bot.client.aclose()
+    return pages
+
+
+async def run(repeat, dpr):
+    try:
+        from playwright.async_api import async_playwright
+    except ImportError:
+        raise SystemExit("未安装 playwright：pip install playwright && python -m playwright install chromium")
+
+    pages = await collect_pages()
+    async with async_playwright() as playwright:
+        browser = await playwright.chromium.launch()
+        context = await browser.new_context(device_scale_factor=dpr)
+        page = await context.new_page()
+
+        print(f"{'模板':<14}{'参数':<16}{'大小(KB)':>10}{'截图(ms)':>10}")
+        for name, html in pages.items():
+            await page.set_content(html)
+            for label, profile in PROFILES.items():
+                options = main.build_render_options(profile)
+                durations = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    image = await page.screenshot(**options)
+                    durations.append((time.perf_counter() - start) * 1000)
+                print(f"{name:<14}{label:<16}{len(image) / 1024:>10.1f}{statistics.median(durations):>10.1f}")
+            print()
+
+        await browser.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="每种参数的截图次数，取中位数")
+    parser.add_argument("--dpr", type=float, default=2, help="渲染环境的设备像素比")
+    args = parser.parse_args()
+    asyncio.run(run(args.repeat, args.dpr))
@@ -0,0 +1,121 @@
+"""模板填充的微基准：旧的链式 str.replace 与预编译模板的单次渲染耗时对比
+
+用法：python benchmarks/bench_templates.py [次数]
+"""
+import sys
+import timeit
+
+from astrbot_shim import load_plugin
+from sample_data import CURRENT_TIME, PERSONAL_INFO_DATA, STATUS_DATA
+
+main = load_plugin()
+
+
+def legacy_status(data):
+    """改造前 render_status_image 的模板填充方式"""
+    html_content = main.STATUS_TEMPLATE
+    html_content = html_content.replace("{{username}}", data.get('用户名', ''))
+    html_content = html_content.replace("{{level}}", str(data.get('等级', 0)))
+    html_content = html_content.replace("{{cultivation}}", str(data.get('修为', 0)))
+    html_content = html_content.replace("{{realm}}", data.get('境界', ''))
+    html_content = html_content.replace("{{experience}}", str(data.get('经验', 0)))
+    html_content = html_content.replace("{{battle_qi}}", str(data.get('斗气值', 0)))
+    html_content = html_content.replace("{{health}}", str(data.get('生命值', 0)))
+    html_content = html_content.replace("{{mana}}", str(data.get('灵力值', 0)))
+    html_content = html_content.replace("{{stamina}}", str(data.get('体力值', 0)))
+    html_content = html_content.replace("{{gold}}", str(data.get('金币', 0)))
+    html_content = html_content.replace("{{spirit_stone}}", str(data.get('灵石', 0)))
+    html_content = html_content.replace("{{query_time}}", f"查询时间：{CURRENT_TIME} | ")
+    return html_content
+
+
+def legacy_personal_info(data):
+    """改造前 render_personal_info_image 的模板填充方式"""
+    basic = data.get("基本信息", {})
+    battle_qi = data.get("斗气状态", {})
+    attributes = data.get("属性", {})
+    wealth = data.get("财富", {})
+    cooldowns = data.get("修炼冷却", {})
+    breakthrough = data.get("突破信息", {})
+    friends = data.get("道友列表", [])
+    battle = data.get("切磋战绩", {})
+    skills = data.get("技能", [])
+    items = data.get("物品", [])
+
+    html_content = main.PERSONAL_INFO_TEMPLATE
+    html_content = html_content.replace("{{username}}", basic.get('用户名', ''))
+    html_content = html_content.replace("{{create_time}}", basic.get('创建时间', ''))
+    html_content = html_content.replace("{{level}}", str(battle_qi.get('等级', 0)))
+    html_content = html_content.replace("{{cultivation}}", str(battle_qi.get('修为', 0)))
+    html_content = html_content.replace("{{realm}}", battle_qi.get('境界', ''))
+    html_content = html_content.replace("{{experience}}", str(battle_qi.get('经验值', 0)))
+    html_content = html_content.replace("{{battle_qi}}", str(battle_qi.get('斗气值', 0)))
+    html_content = html_content.replace("{{health}}", str(attributes.get('生命值', 0)))
+    html_content = html_content.replace("{{mana}}", str(attributes.get('灵力值', 0)))
+    html_content = html_content.replace("{{stamina}}", str(attributes.get('体力值', 0)))
+    html_content = html_content.replace("{{gold}}", str(wealth.get('金币', 0)))
+    html_content = html_content.replace("{{spirit_stone}}", str(wealth.get('灵石', 0)))
+    html_content = html_content.replace("{{next_realm}}", breakthrough.get('下一境界', ''))
+    html_content = html_content.replace("{{required_battle_qi}}", str(breakthrough.get('所需斗气', 0)))
+    html_content = html_content.replace("{{current_battle_qi}}", str(breakthrough.get('当前斗气', 0)))
+    html_content = html_content.replace("{{breakthrough_rate}}", str(breakthrough.get('突破成功率', 0)))
+    html_content = html_content.replace("{{breakthrough_requirement}}", breakthrough.get('突破需求', ''))
+    html_content = html_content.replace("{{cd_meditate}}", cooldowns.get('打坐', ''))
+    html_content = html_content.replace("{{cd_breakthrough}}", cooldowns.get('突破', ''))
+    html_content = html_content.replace("{{cd_recover}}", cooldowns.get('调息', ''))
+    html_content = html_content.replace("{{cd_seclusion}}", cooldowns.get('闭关', ''))
+    html_content = html_content.replace("{{cd_duel}}", cooldowns.get('切磋', ''))
+    html_content = html_content.replace("{{cd_give}}", cooldowns.get('赠送', ''))
+    html_content = html_content.replace("{{battle_wins}}", str(battle.get('胜利', 0)))
+    html_content = html_content.replace("{{battle_losses}}", str(battle.get('失败', 0)))
+    html_content = html_content.replace("{{query_time}}", f"查询时间：{CURRENT_TIME} | ")
+
+    friends_html = '\n'.join([f'<div class="list-item">{friend}</div>' for friend in friends]) if friends else '<div class="list-empty">暂无道友</div>'
+    skills_html = '\n'.join([f'<div class="list-item">{skill}</div>' for skill in skills]) if skills else '<div class="list-empty">暂无技能</div>'
+    items_html = '\n'.join([f'<div class="list-item">{item}</div>' for item in items]) if items else '<div class="list-empty">暂无物品</div>'
+
+    html_content = html_content.replace("{% if friends %}\n                    {% for friend in friends %}\n                        <div class=\"list-item\">{{friend}}</div>\n                    {% endfor %}\n                {% else %}\n                    <div class=\"list-empty\">暂无道友</div>\n                {% endif %}", friends_html)
+    html_content = html_content.replace("{% if skills %}\n                    {% for skill in skills %}\n                        <div class=\"list-item\">{{skill}}</div>\n                    {% endfor %}\n                {% else %}\n                    <div class=\"list-empty\">暂无技能</div>\n                {% endif %}", skills_html)
+    html_content = html_content.replace("{% if items %}\n                    {% for item in items %}\n                        <div class=\"list-item\">{{item}}</div>\n                    {% endfor %}\n                {% else %}\n                    <div class=\"list-empty\">暂无物品</div>\n                {% endif %}", items_html)
+    return html_content
+
+
+class _CaptureBot(main.LiteraryBattleQiBot):
+    """截获 _render_cached 的模板与变量，只测量模板填充本身"""
+
+    async def _render_cached(self, kind, template, context, options):
+        return template, context
+
+
+def compiled_inputs(bot, coro_func, data):
+    coro = coro_func(bot, data)
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+
+
+def bench(label, func, number):
+    per_call = min(timeit.repeat(func, number=number, repeat=5)) / number
+    print(f"{label:<32}{per_call * 1e6:>10.2f} µs/次")
+    return per_call
+
+
+def main_bench(number):
+    bot = _CaptureBot(None)
+    for name, legacy, render_func, data in (
+        ("状态", legacy_status, main.LiteraryBattleQiBot.render_status_image, STATUS_DATA),
+        ("个人信息", legacy_personal_info, main.LiteraryBattleQiBot.render_personal_info_image, PERSONAL_INFO_DATA),
+    ):
+        template = compiled_inputs(bot, render_func, data)[0]
+        before = bench(f"{name} 链式 str.replace", lambda: legacy(data), number)
+        after = bench(
+            f"{name} 预编译模板",
+            lambda: template.render({**compiled_inputs(bot, render_func, data)[1], "query_time": f"查询时间：{CURRENT_TIME} | "}),
+            number,
+        )
+        print(f"{name} 提速：{before / after:.1f}x\n")
+
+
+if __name__ == "__main__":
+    main_bench(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
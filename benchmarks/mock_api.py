@@ -0,0 +1,471 @@
+"""文字斗气API的本地替身服务器
+
+按 DEPLOYMENT.md 中的接口与响应格式实现各指令，支持注入延迟与错误，用于离线压测。
+丹方、功法、宗门、拍卖行等 DEPLOYMENT.md 未记录的指令按插件假定的格式实现。
+也可单独运行：python benchmarks/mock_api.py --port 8080 --latency 50
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+# 境界、突破所需斗气与成功率（DEPLOYMENT.md 6.1）
+REALMS = ["凡人"] + [f"斗之气{i}段" for i in range(1, 10)]
+REQUIRED_QI = [0] + [200 + 20 * i for i in range(9)]
+SUCCESS_RATE = [100] + [100 - 5 * i for i in range(9)]
+
+# 丹方、功法、宗门、拍卖行不在 DEPLOYMENT.md 中，以下数据与响应格式按插件假定的格式实现（见 main.py 中的说明）
+RECIPES = {
+    "回气丹": {"丹药名称": "回气丹", "品阶": "一品", "所需材料": {"灵草": 2, "凝血草": 1}, "成功率": "80%", "功效": "恢复50点斗气"},
+    "聚气散": {"丹药名称": "聚气散", "品阶": "一品", "所需材料": {"灵草": 3}, "成功率": "90%", "功效": "打坐获得的斗气翻倍"},
+    "筑基灵液": {"丹药名称": "筑基灵液", "品阶": "二品", "所需材料": {"紫叶兰草": 1, "灵草": 5}, "成功率": "60%", "功效": "提升突破成功率10%"},
+}
+SKILLS = {"焚决": "功法", "八极崩": "斗技", "吸掌": "斗技"}
+SKILL_COST = 10
+
+COOLDOWNS = {"打坐": 600, "调息": 1800, "闭关": 7200, "切磋": 300, "赠送": 600, "签到": 86400}
+
+
+def _ok(data, message="成功"):
+    return {"code": 200, "message": message, "data": data}
+
+
+def _error(code, message):
+    return {"code": code, "message": message, "data": None}
+
+
+class MockGameState:
+    """内存中的玩家数据，所有指令在同一把锁内执行"""
+
+    def __init__(self, enforce_cooldowns=False):
+        self.enforce_cooldowns = enforce_cooldowns
+        self.players = {}
+        self.sects = {}  # 宗门名称 -> {"宗主", "成员": {用户名: 贡献}}
+        self.auctions = []  # [{"编号", "物品", "数量", "价格", "卖家"}]
+        self.next_auction_id = 1
+        self.lock = threading.Lock()
+
+    def handle(self, action, params):
+        with self.lock:
+            if action == "创建角色":
+                return self._create(params)
+            if action == "排行榜":
+                return self._ranking()
+            handler = self.HANDLERS.get(action)
+            if handler is None:
+                return _error(400, f"未知指令：{action}")
+            player = self.players.get(params.get("username", ""))
+            if player is None:
+                return _error(404, "角色不存在，请先创建角色")
+            if player["password"] != params.get("password"):
+                return _error(401, "密码错误")
+            if self.enforce_cooldowns and action in COOLDOWNS:
+                remaining = player["cooldowns"].get(action, 0) - time.time()
+                if remaining > 0:
+                    return _error(400, f"{action}冷却中，还需{int(remaining // 60) + 1}分钟")
+            response = handler(self, player, params)
+            if response["code"] == 200 and action in COOLDOWNS:
+                player["cooldowns"][action] = time.time() + COOLDOWNS[action]
+                player["logs"].append({"时间": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "类型": action, "内容": response["message"]})
+            return response
+
+    def _create(self, params):
+        username = params.get("username", "")
+        if not username or len(username) > 12:
+            return _error(400, "用户名不能为空且不能超过12位")
+        if username in self.players:
+            return _error(400, "用户名已存在")
+        self.players[username] = {
+            "username": username, "password": params.get("password"), "realm": 0, "level": 1, "qi": 0, "experience": 0,
+            "health": 100, "mana": 50, "stamina": 100, "gold": 100, "spirit_stone": 0,
+            "friends": [], "wins": 0, "losses": 0, "skills": [], "skill_levels": {}, "items": {"灵石": 100},
+            "logs": [], "cooldowns": {}, "sign_days": 0,
+            "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        return _ok({"username": username}, "角色创建成功！")
+
+    def _ranking(self):
+        ordered = sorted(self.players.values(), key=lambda p: (p["realm"], p["qi"]), reverse=True)[:10]
+        return _ok({
+            "排行榜": [
+                {"排名": i, "用户名": p["username"], "境界": REALMS[p["realm"]], "修为值": p["qi"], "等级": p["level"]}
+                for i, p in enumerate(ordered, 1)
+            ],
+            "更新时间": datetime.now().strftime("%Y-%m-%d %H:%M:00"),
+        })
+
+    def _status(self, player, params):
+        return _ok({
+            "用户名": player["username"], "等级": player["level"], "修为": REALMS[player["realm"]],
+            "境界": REALMS[player["realm"]], "经验": player["experience"], "生命值": player["health"],
+            "灵力值": player["mana"], "斗气值": player["qi"], "体力值": player["stamina"],
+            "灵石": player["spirit_stone"], "金币": player["gold"],
+        })
+
+    def _info(self, player, params):
+        now = time.time()
+
+        def cooldown(action):
+            remaining = player["cooldowns"].get(action, 0) - now
+            return f"剩余{int(remaining // 60) + 1}分钟" if remaining > 0 else "可用"
+
+        next_realm = min(player["realm"] + 1, len(REALMS) - 1)
+        return _ok({
+            "基本信息": {"用户名": player["username"], "创建时间": player["created_at"]},
+            "斗气状态": {"等级": player["level"], "修为": REALMS[player["realm"]], "境界": REALMS[player["realm"]],
+                        "经验值": player["experience"], "斗气值": player["qi"]},
+            "属性": {"生命值": player["health"], "灵力值": player["mana"], "体力值": player["stamina"]},
+            "财富": {"金币": player["gold"], "灵石": player["spirit_stone"]},
+            "修炼冷却": {action: cooldown(action) for action in ("打坐", "调息", "闭关", "切磋", "赠送")} | {"突破": "无冷却"},
+            "突破信息": {"下一境界": REALMS[next_realm], "所需斗气": REQUIRED_QI[next_realm], "当前斗气": player["qi"],
+                        "突破成功率": f"{SUCCESS_RATE[next_realm]}%", "突破需求": "无"},
+            "道友列表": player["friends"] or ["暂无道友"],
+            "切磋战绩": {"胜利": player["wins"], "失败": player["losses"]},
+            "技能": player["skills"] or ["暂无技能"],
+            "物品": [f"{name}x{count}" for name, count in player["items"].items()] or ["暂无物品"],
+        })
+
+    def _meditate(self, player, params):
+        player["qi"] += 20
+        return _ok({"当前斗气": player["qi"], "境界": REALMS[player["realm"]], "剩余体力": player["stamina"]},
+                   "打坐修炼成功！获得20点斗气")
+
+    def _breakthrough(self, player, params):
+        if player["realm"] >= len(REALMS) - 1:
+            return _error(400, "已达到最高境界")
+        target = player["realm"] + 1
+        if player["qi"] < REQUIRED_QI[target]:
+            return _error(400, f"突破需要{REQUIRED_QI[target]}点斗气，当前只有{player['qi']}点")
+        if player["stamina"] < 20:
+            return _error(400, "体力不足")
+        player["stamina"] -= 20
+        if random.randint(1, 100) > SUCCESS_RATE[target]:
+            player["qi"] -= REQUIRED_QI[target] * 3 // 10
+            return _error(400, "突破失败，损失部分斗气")
+        player["qi"] -= REQUIRED_QI[target]
+        player["realm"] = target
+        return _ok({"当前境界": REALMS[target], "剩余斗气": player["qi"], "等级": player["level"],
+                    "突破成功率": f"{SUCCESS_RATE[target]}%", "消耗体力": 20, "剩余体力": player["stamina"]},
+                   f"突破成功！恭喜你进入{REALMS[target]}！")
+
+    def _recover(self, player, params):
+        player["health"], player["mana"] = 100, 50
+        return _ok({"生命值": player["health"], "灵力值": player["mana"]}, "调息完成，生命和灵力已恢复")
+
+    def _seclusion(self, player, params):
+        if player["realm"] < 1:
+            return _error(400, "需要斗之气1段以上才能闭关")
+        if player["stamina"] < 50:
+            return _error(400, "体力不足")
+        minutes = min(480, int(params.get("duration") or 480))
+        player["qi"] += minutes
+        player["stamina"] -= 50
+        return _ok({"当前斗气": player["qi"], "境界": REALMS[player["realm"]], "闭关时长": f"{minutes}分钟",
+                    "消耗体力": 50, "剩余体力": player["stamina"]},
+                   f"闭关修炼成功！{minutes}分钟获得了{minutes}点斗气")
+
+    def _friends(self, player, params):
+        friends = [self.players[name] for name in player["friends"] if name in self.players]
+        return _ok({"道友数量": len(friends), "道友列表": [
+            {"用户名": f["username"], "境界": REALMS[f["realm"]], "等级": f["level"], "修为值": f["qi"]} for f in friends
+        ]})
+
+    def _target(self, params):
+        return self.players.get(params.get("target", "").lstrip("@"))
+
+    def _duel(self, player, params):
+        target = self._target(params)
+        if target is None:
+            return _error(404, "切磋对象不存在")
+        mine = player["qi"] + random.randint(0, 100)
+        theirs = target["qi"] + random.randint(0, 100)
+        won = mine >= theirs
+        player["wins" if won else "losses"] += 1
+        if target["username"] not in player["friends"]:
+            player["friends"].append(target["username"])
+        winner, loser = (player, target) if won else (target, player)
+        return _ok({
+            "切磋双方": {"挑战者": player["username"], "应战者": target["username"]},
+            "胜负结果": "胜利" if won else "失败",
+            "战斗详情": {"你的修为": player["qi"], "对手修为": target["qi"], "战斗值": {"你的战斗值": mine, "对手战斗值": theirs}},
+            "当前战绩": {"胜利": player["wins"], "失败": player["losses"]},
+        }, f"切磋结束！{winner['username']} 战胜了 {loser['username']}！")
+
+    def _give(self, player, params):
+        target = self._target(params)
+        if target is None:
+            return _error(404, "赠送对象不存在")
+        name, _, count = params.get("item", "").partition("x")
+        count = int(count or 1)
+        if player["items"].get(name, 0) < count:
+            return _error(400, f"{name}数量不足")
+        player["items"][name] -= count
+        target["items"][name] = target["items"].get(name, 0) + count
+        return _ok({"赠送对象": target["username"], "赠送物品": name, "赠送数量": count,
+                    "你的剩余": player["items"][name], "对方获得": target["items"][name]},
+                   f"赠送成功！你给{target['username']}赠送了{count}个{name}")
+
+    def _sign_in(self, player, params):
+        player["sign_days"] += 1
+        player["qi"] += 10
+        player["items"]["灵石"] = player["items"].get("灵石", 0) + 10
+        return _ok({"签到日期": datetime.now().strftime("%Y-%m-%d"), "连续签到天数": player["sign_days"],
+                    "获得奖励": {"斗气": 10, "灵石": 10, "经验": 5}}, "签到成功")
+
+    def _log(self, player, params):
+        logs = player["logs"][-50:]
+        return _ok({"日志数量": len(logs), "日志列表": list(reversed(logs))})
+
+    def _backpack(self, player, params):
+        return _ok({"物品数量": len(player["items"]), "背包物品": dict(player["items"])})
+
+    def _task(self, player, params):
+        return _ok({"任务列表": [
+            {"name": "每日修炼", "description": "打坐3次", "reward": {"斗气": 30, "灵石": 5, "经验": 10}},
+        ]})
+
+    def _recipe(self, player, params):
+        pill = params.get("pill")
+        if not pill:
+            return _ok({"丹方数量": len(RECIPES), "丹方列表": list(RECIPES.values())})
+        if pill not in RECIPES:
+            return _error(404, f"未知丹方：{pill}")
+        return _ok(dict(RECIPES[pill]))
+
+    def _skill_change(self, player, params, upgrade):
+        skill = params.get("skill", "")
+        if skill not in SKILLS:
+            return _error(404, f"未知功法：{skill}")
+        levels = player["skill_levels"]
+        if upgrade != (skill in levels):
+            return _error(400, "尚未学习该功法" if upgrade else "已经学会该功法")
+        stones = player["items"].get("灵石", 0)
+        if stones < SKILL_COST:
+            return _error(400, "灵石不足")
+        player["items"]["灵石"] = stones - SKILL_COST
+        levels[skill] = levels.get(skill, 0) + 1
+        if not upgrade:
+            player["skills"].append(skill)
+        return _ok({"功法名称": skill, "功法等级": levels[skill], "消耗灵石": SKILL_COST,
+                    "剩余灵石": player["items"]["灵石"]}, "升级成功" if upgrade else "学习成功")
+
+    def _learn_skill(self, player, params):
+        return self._skill_change(player, params, upgrade=False)
+
+    def _upgrade_skill(self, player, params):
+        return self._skill_change(player, params, upgrade=True)
+
+    def _skills(self, player, params):
+        return _ok({"技能数量": len(player["skill_levels"]), "技能列表": [
+            {"名称": name, "等级": level, "类型": SKILLS[name], "描述": f"{name}的修炼法门"}
+            for name, level in player["skill_levels"].items()
+        ]})
+
+    def _player_sect(self, username):
+        return next((name for name, sect in self.sects.items() if username in sect["成员"]), None)
+
+    def _sect(self, player, params):
+        username, action_type = player["username"], params.get("action_type", "信息")
+        current = self._player_sect(username)
+        name = params.get("sect_name", "")
+        if action_type == "创建" or action_type == "加入":
+            if current:
+                return _error(400, f"你已加入宗门：{current}")
+            if not name:
+                return _error(400, "请输入宗门名称")
+            if action_type == "创建":
+                if name in self.sects:
+                    return _error(400, "宗门已存在")
+                self.sects[name] = {"宗主": username, "成员": {}}
+            elif name not in self.sects:
+                return _error(404, "宗门不存在")
+            self.sects[name]["成员"][username] = 0
+            return _ok({"宗门名称": name}, f"已{action_type}宗门：{name}")
+        if action_type == "退出":
+            if not current:
+                return _error(400, "你还没有加入宗门")
+            del self.sects[current]["成员"][username]
+            return _ok({"宗门名称": current}, f"已退出宗门：{current}")
+        name = name or current
+        if name not in self.sects:
+            return _error(404, "宗门不存在" if name else "你还没有加入宗门")
+        sect = self.sects[name]
+        return _ok({"宗门名称": name, "宗主": sect["宗主"], "宗门等级": 1, "成员数量": len(sect["成员"]), "成员列表": [
+            {"用户名": member, "职位": "宗主" if member == sect["宗主"] else "弟子", "贡献": contribution}
+            for member, contribution in sect["成员"].items()
+        ]})
+
+    def _sect_task(self, player, params):
+        sect = self._player_sect(player["username"])
+        if not sect:
+            return _error(400, "你还没有加入宗门")
+        action_type = params.get("action_type", "列表")
+        if action_type == "列表":
+            return _ok({"任务列表": [
+                {"name": "守护山门", "description": "击退来犯魔兽", "reward": {"贡献": 10, "灵石": 5}},
+            ]})
+        if action_type == "完成":
+            self.sects[sect]["成员"][player["username"]] += 10
+        return _ok({"任务编号": params.get("task_id")}, f"宗门任务{action_type}成功")
+
+    def _auction(self, player, params):
+        action_type, item = params.get("action_type", "搜索"), params.get("item", "")
+        if action_type == "搜索":
+            found = [listing for listing in self.auctions if item in listing["物品"]]
+            return _ok({"拍卖数量": len(found), "拍卖列表": found})
+        if action_type == "上架":
+            if not item:
+                return _error(400, "请输入上架物品")
+            self.auctions.append({"编号": self.next_auction_id, "物品": item, "数量": 1, "价格": 10,
+                                  "卖家": player["username"]})
+            self.next_auction_id += 1
+            return _ok({"编号": self.next_auction_id - 1}, f"{item} 已上架")
+        if action_type == "购买":
+            listing = next((l for l in self.auctions if str(l["编号"]) == item), None)
+            if listing is None:
+                return _error(404, "拍卖物品不存在")
+            self.auctions.remove(listing)
+            return _ok({"物品": listing["物品"]}, f"购买成功：{listing['物品']}")
+        return _error(400, f"未知操作：{action_type}")
+
+    HANDLERS = {
+        "状态": _status,
+        "个人信息": _info,
+        "打坐": _meditate,
+        "突破": _breakthrough,
+        "调息": _recover,
+        "闭关": _seclusion,
+        "道友": _friends,
+        "切磋": _duel,
+        "赠送": _give,
+        "签到": _sign_in,
+        "日志": _log,
+        "背包": _backpack,
+        "任务": _task,
+        "丹方": _recipe,
+        "学习功法": _learn_skill,
+        "升级功法": _upgrade_skill,
+        "技能": _skills,
+        "宗门": _sect,
+        "宗门任务": _sect_task,
+        "拍卖行": _auction,
+    }
+
+
+def _reward_handler(key, label, stamina):
+    """探索、副本、采集、炼制共用的简化处理：消耗体力，获得少量灵石"""
+    def handler(state, player, params):
+        if player["stamina"] < stamina:
+            return _error(400, "体力不足")
+        player["stamina"] -= stamina
+        player["items"]["灵石"] = player["items"].get("灵石", 0) + 5
+        return _ok({label: params.get(key, ""), "获得奖励": {"灵石": 5}, "获得数量": 1,
+                    "消耗体力": stamina, "剩余体力": player["stamina"]}, "成功")
+    return handler
+
+
+MockGameState.HANDLERS.update({
+    "探索": _reward_handler("location", "探索地点", 10),
+    "副本": _reward_handler("dungeon", "副本名称", 20),
+    "采集": _reward_handler("herb", "采集药材", 5),
+    "炼制": _reward_handler("pill", "丹药名称", 10),
+})
+
+
+class _Server(ThreadingHTTPServer):
+    # 默认的监听队列只有5，并发建立连接时会丢弃 SYN，客户端要等1秒重传
+    request_queue_size = 256
+    daemon_threads = True
+
+
+class MockApiServer:
+    """在后台线程运行的替身服务器
+
+    latency_ms/jitter_ms：每个请求的固定延迟与随机抖动
+    error_rate：返回 HTTP 503 的概率；drop_rate：不返回响应直接断开连接的概率
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency_ms=0.0, jitter_ms=0.0,
+                 error_rate=0.0, drop_rate=0.0, enforce_cooldowns=False):
+        self.state = MockGameState(enforce_cooldowns)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.request_count = 0
+        self.action_counts = {}
+        self._server = _Server((host, port), self._make_handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/index.php"
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # 与真实服务器一样保持长连接，插件的连接池才能复用连接
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                params = dict(parse_qsl(urlsplit(self.path).query))
+                action = params.pop("action", "")
+                server.request_count += 1
+                server.action_counts[action] = server.action_counts.get(action, 0) + 1
+
+                delay = server.latency_ms + random.uniform(0, server.jitter_ms)
+                if delay > 0:
+                    time.sleep(delay / 1000)
+                roll = random.random()
+                if roll < server.drop_rate:
+                    self.close_connection = True
+                    return
+                if roll < server.drop_rate + server.error_rate:
+                    self.send_error(503)
+                    return
+
+                body = json.dumps(server.state.handle(action, params), ensure_ascii=False).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="文字斗气API本地替身服务器")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0, help="固定延迟（毫秒）")
+    parser.add_argument("--jitter", type=float, default=0, help="随机抖动（毫秒）")
+    parser.add_argument("--error-rate", type=float, default=0, help="返回503的概率")
+    parser.add_argument("--drop-rate", type=float, default=0, help="直接断开连接的概率")
+    parser.add_argument("--cooldowns", action="store_true", help="按真实规则校验冷却时间")
+    args = parser.parse_args()
+    mock = MockApiServer(port=args.port, latency_ms=args.latency, jitter_ms=args.jitter,
+                         error_rate=args.error_rate, drop_rate=args.drop_rate,
+                         enforce_cooldowns=args.cooldowns)
+    print(f"替身服务器已启动：{mock.url}")
+    try:
+        mock._server.serve_forever()
+    except KeyboardInterrupt:
+        mock.stop()
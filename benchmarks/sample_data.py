@@ -0,0 +1,29 @@
+"""基准脚本共用的示例数据（结构与 DEPLOYMENT.md 中的响应示例一致）"""
+
+STATUS_DATA = {
+    "用户名": "123456", "等级": 1, "修为": "凡人", "境界": "凡人", "经验": 0,
+    "生命值": 100, "灵力值": 50, "斗气值": 0, "体力值": 100, "灵石": 0, "金币": 100,
+}
+
+PERSONAL_INFO_DATA = {
+    "基本信息": {"用户名": "123456", "创建时间": "2026-01-07 04:12:36"},
+    "斗气状态": {"等级": 1, "修为": "凡人", "境界": "凡人", "经验值": 0, "斗气值": 0},
+    "属性": {"生命值": 100, "灵力值": 50, "体力值": 100},
+    "财富": {"金币": 100, "灵石": 0},
+    "修炼冷却": {"打坐": "可用", "突破": "无冷却", "调息": "可用", "闭关": "可用", "切磋": "可用", "赠送": "可用"},
+    "突破信息": {"下一境界": "斗之气1段", "所需斗气": 200, "当前斗气": 0, "突破成功率": "100%", "突破需求": "无"},
+    "道友列表": [f"道友{i}" for i in range(20)],
+    "切磋战绩": {"胜利": 0, "失败": 0},
+    "技能": [f"技能{i}" for i in range(10)],
+    "物品": [f"物品{i}" for i in range(30)],
+}
+
+CURRENT_TIME = "2026-01-07 04:12:36"
+
+RANKING_DATA = {
+    "排行榜": [
+        {"排名": i, "用户名": f"{100000 + i}", "境界": "斗之气1段", "修为值": 1000 - i * 10, "等级": 1}
+        for i in range(1, 11)
+    ],
+    "更新时间": "2026-01-07 04:12:36",
+}
@@ -1,11 +1,110 @@
 from astrbot.api.all import AstrMessageEvent, CommandResult, Context, Plain
-from astrbot.api.event import filter
+from astrbot.api.event import MessageChain, filter
 from astrbot.api.star import Star, register
 from astrbot.api import logger
+import asyncio
+import bisect
+import contextvars
+import difflib
+import functools
+import hashlib
+import heapq
+import json
+import os
+import random
+import re
+import shutil
+import sqlite3
+import time
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 import httpx
 
 API_URL = "http://api.tinyaii.top/index.php"
 
+# 插件数据目录（相对于AstrBot工作目录），用于持久化缓存
+PLUGIN_DATA_DIR = os.path.join("data", "plugin_data", "literary_battle_qi")
+
+# 只读查询类指令，重复请求不会改变角色数据，失败时可安全重试
+IDEMPOTENT_ACTIONS = frozenset({"状态", "个人信息", "排行榜", "道友", "日志", "丹方", "技能"})
+
+# 上游对各指令的固定冷却时间（秒）
+ACTION_COOLDOWNS = {
+    "打坐": 10 * 60,
+    "调息": 30 * 60,
+    "闭关": 2 * 60 * 60,
+    "切磋": 5 * 60,
+    "赠送": 10 * 60,
+    "签到": 24 * 60 * 60,
+}
+
+# 排行榜为全服共享数据，缓存有效期（秒）：按上游的更新时间推算下次更新，最长不超过该值
+RANKING_CACHE_TTL = 60
+# 按更新时间推算的下次更新已过去时（上游尚未更新），至少间隔多久再请求（秒）
+RANKING_MIN_REFRESH = 10
+
+# 境界由低到高（DEPLOYMENT.md 6.1），用于本地计算名次
+REALM_ORDER = {realm: i for i, realm in enumerate(["凡人"] + [f"斗之气{i}段" for i in range(1, 10)])}
+
+# 丹方、拍卖行等各用户共享的目录数据缓存时间（秒）与条目上限
+CATALOGUE_CACHE_TTL = 30
+CATALOGUE_CACHE_MAX_ENTRIES = 256
+# 每位玩家最近查看的分页列表的缓存时间（秒）与玩家数上限，翻页时在此时间内不再请求上游
+LISTING_CACHE_TTL = 120
+LISTING_CACHE_MAX_ENTRIES = 1024
+# 图鉴索引（丹方、药材、地点、副本名称）的刷新间隔与刷新失败后的重试间隔（秒）
+CATALOGUE_REFRESH_INTERVAL = 6 * 3600
+CATALOGUE_RETRY_DELAY = 300
+
+# 保存本地快照的只读指令，上游不可用时用最近一次的结果回复
+SNAPSHOT_ACTIONS = frozenset({"状态", "个人信息", "道友"})
+
+# 上游较慢时先用快照回复、后台刷新的指令
+STALE_WHILE_REVALIDATE_ACTIONS = frozenset({"状态", "个人信息"})
+# 修改玩家数据的指令成功后按返回的字段更新快照：{返回字段: [(快照类型, 字段路径)]}
+_QI_FIELDS = [("状态", ("斗气值",)), ("个人信息", ("斗气状态", "斗气值"))]
+_REALM_FIELDS = [("状态", ("境界",)), ("个人信息", ("斗气状态", "境界"))]
+SNAPSHOT_PATCH_FIELDS = {
+    "当前斗气": _QI_FIELDS,
+    "剩余斗气": _QI_FIELDS,
+    "境界": _REALM_FIELDS,
+    "当前境界": _REALM_FIELDS,
+    "等级": [("状态", ("等级",)), ("个人信息", ("斗气状态", "等级"))],
+    "剩余体力": [("状态", ("体力值",)), ("个人信息", ("属性", "体力值"))],
+    "当前战绩": [("个人信息", ("切磋战绩",))],
+}
+SNAPSHOT_PATCH_ACTIONS = frozenset({"打坐", "突破", "闭关", "切磋"})
+# 返回数据无法对应到快照字段的指令，成功后删除快照
+SNAPSHOT_INVALIDATE_ACTIONS = frozenset({"赠送", "签到", "调息"})
+SNAPSHOT_MUTATING_ACTIONS = SNAPSHOT_PATCH_ACTIONS | SNAPSHOT_INVALIDATE_ACTIONS
+
+# 可以登记为定时自动执行的指令
+SCHEDULABLE_ACTIONS = ("打坐", "调息", "签到")
+# 定时任务连续失败多少次后自动取消
+SCHEDULE_MAX_FAILURES = 5
+
+# 渲染任务优先级（数值越小越优先）：帮助菜单、排行榜等共享图片优先于个人图片
+RENDER_PRIORITY_SHARED = 0
+RENDER_PRIORITY_USER = 1
+
+# 各模板的默认渲染参数，可在插件配置 render_profiles 中按模板覆盖
+# type 仅支持 jpeg / png（浏览器截图不支持 WebP）；clip_width、clip_height 均大于0时只截取左上角固定区域
+RENDER_PROFILE_NAMES = ("menu", "personal_info", "status", "ranking")
+DEFAULT_RENDER_PROFILE = {
+    "type": "jpeg",
+    "quality": 85,
+    "full_page": True,
+    "scale": "device",
+    "clip_width": 0,
+    "clip_height": 0,
+}
+
+# 图片缓存的默认条目数与字节上限，字节上限可通过 render.cache_mb 配置
+RENDER_CACHE_MAX_ENTRIES = 2048
+RENDER_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
 # 菜单样式的HTML模板（参考工具箱插件样式）
 MENU_TEMPLATE = '''
 <!DOCTYPE html>
@@ -420,7 +519,7 @@ PERSONAL_INFO_TEMPLATE = '''
         </div>
         
         <div class="footer">
-            查询时间：{{current_time}} | 文字斗气系统
+            {{query_time}}文字斗气系统
         </div>
     </div>
 </body>
@@ -555,7 +654,7 @@ STATUS_TEMPLATE = '''
             </div>
         </div>
         <div class="footer">
-            查询时间：{{current_time}} | 文字斗气系统
+            {{query_time}}文字斗气系统
         </div>
     </div>
 </body>
@@ -678,422 +777,3196 @@ RANKING_TEMPLATE = '''
 </head>
 <body>
     <div class="container">
-        <h1 class="title">📊 斗气排行榜 📊</h1>
-        <div class="update-time">更新时间：{{update_time}}</div>
+        <h1 class="title">{{title}}</h1>
+        <div class="update-time">{{update_time}}</div>
         <div class="rankings">
             {{rankings_content}}
         </div>
         <div class="footer">
-            查询时间：{{current_time}} | 文字斗气系统
+            {{query_time}}文字斗气系统
         </div>
     </div>
 </body>
 </html>
 '''
 
-@register("literary_battle_qi", "author", "文字斗气机器人插件", "1.0.0")
-class LiteraryBattleQiBot(Star):
-    def __init__(self, context):
-        super().__init__(context)
-        self.client = httpx.AsyncClient(timeout=10.0)
+# 帮助菜单文本（静态内容，菜单图片据此缓存）
+HELP_TEXT = (
+    "🔹 **斗破帮助**   - 查看所有指令说明\n" +
+    "🔹 **创建角色**   - 创建斗气角色（自动使用你的QQ号，无需额外参数）\n" +
+    "🔹 **绑定角色**   - 修改QQ昵称后找回原来的角色（格式：绑定角色 [原用户名]）\n" +
+    "🔹 **状态**       - 查看自己的斗气状态\n" +
+    "🔹 **个人信息**   - 查看详细角色信息\n" +
+    "🔹 **打坐**       - 基础修炼获得斗气（冷却10分钟）\n" +
+    "🔹 **突破**       - 消耗斗气突破境界\n" +
+    "🔹 **调息**       - 恢复生命和灵力（冷却30分钟）\n" +
+    "🔹 **闭关**       - 深度修炼获得更多斗气（格式：闭关 [时长]，冷却2小时）\n" +
+    "🔹 **排行榜**     - 查看斗气排行榜\n" +
+    "🔹 **我的排名**   - 查看自己的排名及较昨日的变化\n" +
+    "🔹 **全群状态**   - 查看本群成员的境界与斗气\n" +
+    "🔹 **道友**       - 查看好友/道友列表\n" +
+    "🔹 **切磋**       - 与道友切磋（格式：切磋 @目标QQ号）\n" +
+    "🔹 **赠送**       - 赠送物品给道友（格式：赠送 @目标QQ号 物品x数量）\n" +
+    "🔹 **任务**       - 任务系统（格式：任务 [列表/领取/完成]）\n" +
+    "🔹 **背包**       - 查看或管理背包物品（格式：背包 [查看/整理/使用 物品名]）\n" +
+    "🔹 **签到**       - 每日签到，领取基础资源（冷却24小时）\n" +
+    "🔹 **日志**       - 查看近期修炼和战斗记录（末尾加页码翻页，如：日志 2）\n" +
+    "🔹 **探索**       - 探索地点获取资源（格式：探索 [地点]）\n" +
+    "🔹 **副本**       - 挑战副本获得奖励（格式：副本 [副本名称]）\n" +
+    "🔹 **逃跑**       - 脱离战斗\n" +
+    "🔹 **采集**       - 采集药材（格式：采集 [药材名称]）\n" +
+    "🔹 **炼制**       - 炼制丹药（格式：炼制 [丹药名称]）\n" +
+    "🔹 **丹方**       - 查看丹药配方（格式：丹方 [丹药名称]）\n" +
+    "🔹 **学习功法**   - 学习新的功法（格式：学习功法 [功法名称]）\n" +
+    "🔹 **升级功法**   - 升级已有功法（格式：升级功法 [功法名称]）\n" +
+    "🔹 **技能**       - 查看技能列表\n" +
+    "🔹 **宗门**       - 宗门系统（格式：宗门 [创建/加入/退出/信息]）\n" +
+    "🔹 **宗门任务**   - 宗门任务系统（格式：宗门任务 [领取/完成]）\n" +
+    "🔹 **拍卖行**     - 拍卖行系统（格式：拍卖行 [搜索/购买/上架]）\n" +
+    "🔹 **自动**       - 冷却结束时自动执行（格式：自动 [打坐/调息/签到/取消/列表]）\n" +
+    ""
+)
+
+def build_render_options(profile):
+    """将渲染配置转换为 html_render 的截图参数
     
-    async def _call_api(self, action, params):
-        """调用API的通用方法"""
-        try:
-            response = await self.client.get(API_URL, params={"action": action, **params})
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPError as e:
-            logger.error(f"API请求失败: {e}")
-            return {"code": 500, "message": "服务器连接失败，请稍后重试"}
-        except Exception as e:
-            logger.error(f"API处理失败: {e}")
-            return {"code": 500, "message": "服务器内部错误，请稍后重试"}
+    html_render 只接受截图参数，视口与设备像素比由 AstrBot 的文转图服务决定，因此只能通过 scale 与 clip 控制输出尺寸。
+    """
+    image_type = str(profile.get("type") or "jpeg").lower()
+    if image_type == "jpg":
+        image_type = "jpeg"
+    if image_type not in ("jpeg", "png"):
+        logger.warning(f"不支持的图片格式 {image_type}，已改用 jpeg")
+        image_type = "jpeg"
     
-    def _format_response(self, response):
-        """格式化API响应"""
-        code = response.get("code")
-        message = response.get("message", "未知错误")
-        data = response.get("data")
-        
-        if code != 200:
-            return f"❌ {message}"
-        
-        return message
+    options = {"full_page": bool(profile.get("full_page", True)), "type": image_type}
+    if image_type == "jpeg":
+        options["quality"] = max(1, min(100, int(profile.get("quality") or 85)))
+    if profile.get("scale") in ("css", "device"):
+        options["scale"] = profile["scale"]
     
-    async def text_to_image_menu_style(self, text, *args, **kwargs):
-        """使用菜单样式的HTML模板生成图片"""
-        try:
-            # 将文本内容转换为结构化HTML
-            lines = text.split('\n')
-            html_parts = []
-            
-            # 添加分类标题
-            html_parts.append('<div class="category-title">📚 斗气修炼指令</div>')
-            
-            # 处理指令列表
-            for line in lines:
-                line = line.strip()
-                if not line or line.startswith('📚') or line.startswith('💡'):
-                    continue
-                
-                # 解析指令行
-                if ' - ' in line:
-                    command_part, desc_part = line.split(' - ', 1)
-                    # 提取指令名称（去除🔹 **和**）
-                    command_name = command_part.replace('🔹 **', '').replace('**', '').strip()
-                    command_desc = desc_part.strip()
-                    
-                    # 生成HTML
-                    html_parts.append(f'<div class="menu-item">')
-                    html_parts.append(f'<span class="command-format">{command_name}</span>')
-                    html_parts.append(f'<span class="command-desc"> - {command_desc}</span>')
-                    html_parts.append(f'</div>')
-            
-            # 组装最终HTML内容
-            formatted_html = '\n'.join(html_parts)
-            
-            # 渲染HTML模板
-            html_content = MENU_TEMPLATE.replace("{{content}}", formatted_html)
-            
-            # 使用html_render函数生成图片
-            options = {
-                "full_page": True,
-                "type": "jpeg",
-                "quality": 95,
-            }
+    clip_width = int(profile.get("clip_width") or 0)
+    clip_height = int(profile.get("clip_height") or 0)
+    if clip_width > 0 and clip_height > 0:
+        options["clip"] = {"x": 0, "y": 0, "width": clip_width, "height": clip_height}
+    return options
+
+class CompiledTemplate:
+    """导入时预编译的HTML模板
+    
+    模板被解析为片段列表，渲染时只做一次线性拼接，不再对整个模板反复 str.replace。
+    支持 {{变量}}、{% if 变量 %}...{% else %}...{% endif %} 与 {% for 项 in 列表 %}...{% endfor %}。
+    """
+    
+    _TOKEN_RE = re.compile(r"{{\s*(\w+)\s*}}|{%\s*(.+?)\s*%}")
+    
+    def __init__(self, source):
+        self.source = source
+        self.variables = set()
+        self._nodes = self._compile(source)
+    
+    def _compile(self, source):
+        root = []
+        # 栈元素：(块类型, 当前写入的片段列表, 块节点)
+        stack = [("root", root, None)]
+        pos = 0
+        for match in self._TOKEN_RE.finditer(source):
+            if match.start() > pos:
+                stack[-1][1].append(source[pos:match.start()])
+            pos = match.end()
             
-            # 调用AstrBot的html_render方法
-            image_url = await self.html_render(
-                html_content,  # 渲染后的HTML内容
-                {},  # 空数据字典
-                True,  # 返回URL
-                options  # 图片生成选项
-            )
+            if match.group(1):
+                self.variables.add(match.group(1))
+                stack[-1][1].append(("var", match.group(1)))
+                continue
             
-            return image_url
-        except Exception as e:
-            logger.error(f"菜单样式图片生成失败：{e}")
-            # 回退到默认的纯文本输出
+            parts = match.group(2).split()
+            tag = parts[0]
+            if tag == "if" and len(parts) == 2:
+                node = ("if", parts[1], [], [])
+                stack[-1][1].append(node)
+                stack.append(("if", node[2], node))
+            elif tag == "else" and stack[-1][0] == "if":
+                node = stack.pop()[2]
+                stack.append(("else", node[3], node))
+            elif tag == "endif" and stack[-1][0] in ("if", "else"):
+                stack.pop()
+            elif tag == "for" and len(parts) == 4 and parts[2] == "in":
+                node = ("for", parts[1], parts[3], [])
+                stack[-1][1].append(node)
+                stack.append(("for", node[3], node))
+            elif tag == "endfor" and stack[-1][0] == "for":
+                stack.pop()
+            else:
+                raise ValueError(f"不支持的模板语法：{match.group(0)}")
+        
+        if pos < len(source):
+            stack[-1][1].append(source[pos:])
+        if len(stack) != 1:
+            raise ValueError(f"模板块未闭合：{stack[-1][0]}")
+        return root
+    
+    def render(self, context):
+        """使用 context 渲染模板，缺失的变量输出为空字符串"""
+        out = []
+        self._render_nodes(self._nodes, dict(context), out)
+        return "".join(out)
+    
+    def _render_nodes(self, nodes, scope, out):
+        append = out.append
+        for node in nodes:
+            if node.__class__ is str:
+                append(node)
+            elif node[0] == "var":
+                value = scope.get(node[1], "")
+                append(value if value.__class__ is str else str(value))
+            elif node[0] == "if":
+                self._render_nodes(node[2] if scope.get(node[1]) else node[3], scope, out)
+            else:
+                _, item_name, list_name, body = node
+                for item in scope.get(list_name) or ():
+                    scope[item_name] = item
+                    self._render_nodes(body, scope, out)
+
+# 预编译所有模板
+MENU_TPL = CompiledTemplate(MENU_TEMPLATE)
+PERSONAL_INFO_TPL = CompiledTemplate(PERSONAL_INFO_TEMPLATE)
+STATUS_TPL = CompiledTemplate(STATUS_TEMPLATE)
+RANKING_TPL = CompiledTemplate(RANKING_TEMPLATE)
+
+class RenderCache:
+    """渲染图片的磁盘缓存
+    
+    图片按内容哈希命名保存在插件数据目录中，索引文件记录每张图片的大小与使用情况，重启后继续复用；
+    总字节数或条目数超出上限时按 LRU（最久未使用）或 LFU（使用次数最少）淘汰，文件读写在线程中进行。
+    """
+    
+    INDEX_FILE = "index.json"
+    
+    def __init__(self, directory, max_entries=RENDER_CACHE_MAX_ENTRIES, max_bytes=RENDER_CACHE_MAX_BYTES, policy="lru"):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.total_bytes = 0
+        self.evicted = 0
+        self._entries = OrderedDict()  # key -> [文件名, 字节数, 使用次数, 最近使用时间]，按最近使用排序
+        self._storing = {}  # 正在写入的 key -> Future，同一图片并发写入时只写一次
+        self._save_lock = asyncio.Lock()
+    
+    @staticmethod
+    def make_key(kind, content):
+        """生成缓存键，content 中不应包含查询时间等每次都会变化的内容"""
+        return hashlib.sha256(f"{kind}\0{content}".encode("utf-8")).hexdigest()
+    
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        path = os.path.join(self.directory, entry[0])
+        if not os.path.isfile(path):
+            # 图片文件已被外部清理
+            self._remove(key)
             return None
+        entry[2] += 1
+        entry[3] = time.time()
+        self._entries.move_to_end(key)
+        return path
     
-    async def render_personal_info_image(self, data):
-        """使用个人信息模板生成图片"""
+    async def put(self, key, source):
+        """把渲染出的图片移入缓存目录，返回缓存中的路径；文件过大或写入失败时返回原路径"""
+        pending = self._storing.get(key)
+        if pending is None and key in self._entries:
+            path = self.get(key)
+            if path:
+                await asyncio.to_thread(self._delete, [source])
+                return path
+        if pending is not None:
+            # 同一图片正在写入，等待其完成后使用同一文件
+            path = await asyncio.shield(pending)
+            await asyncio.to_thread(self._delete, [source])
+            return path
+        
+        future = asyncio.get_running_loop().create_future()
+        self._storing[key] = future
         try:
-            # 提取数据
-            basic = data.get("基本信息", {})
-            battle_qi = data.get("斗气状态", {})
-            attributes = data.get("属性", {})
-            wealth = data.get("财富", {})
-            cooldowns = data.get("修炼冷却", {})
-            breakthrough = data.get("突破信息", {})
-            friends = data.get("道友列表", [])
-            battle = data.get("切磋战绩", {})
-            skills = data.get("技能", [])
-            items = data.get("物品", [])
-            
-            # 格式化当前时间
-            from datetime import datetime
-            current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            
-            # 替换模板变量
-            html_content = PERSONAL_INFO_TEMPLATE
-            html_content = html_content.replace("{{username}}", basic.get('用户名', ''))
-            html_content = html_content.replace("{{create_time}}", basic.get('创建时间', ''))
-            html_content = html_content.replace("{{level}}", str(battle_qi.get('等级', 0)))
-            html_content = html_content.replace("{{cultivation}}", str(battle_qi.get('修为', 0)))
-            html_content = html_content.replace("{{realm}}", battle_qi.get('境界', ''))
-            html_content = html_content.replace("{{experience}}", str(battle_qi.get('经验值', 0)))
-            html_content = html_content.replace("{{battle_qi}}", str(battle_qi.get('斗气值', 0)))
-            html_content = html_content.replace("{{health}}", str(attributes.get('生命值', 0)))
-            html_content = html_content.replace("{{mana}}", str(attributes.get('灵力值', 0)))
-            html_content = html_content.replace("{{stamina}}", str(attributes.get('体力值', 0)))
-            html_content = html_content.replace("{{gold}}", str(wealth.get('金币', 0)))
-            html_content = html_content.replace("{{spirit_stone}}", str(wealth.get('灵石', 0)))
-            html_content = html_content.replace("{{next_realm}}", breakthrough.get('下一境界', ''))
-            html_content = html_content.replace("{{required_battle_qi}}", str(breakthrough.get('所需斗气', 0)))
-            html_content = html_content.replace("{{current_battle_qi}}", str(breakthrough.get('当前斗气', 0)))
-            html_content = html_content.replace("{{breakthrough_rate}}", str(breakthrough.get('突破成功率', 0)))
-            html_content = html_content.replace("{{breakthrough_requirement}}", breakthrough.get('突破需求', ''))
-            html_content = html_content.replace("{{cd_meditate}}", cooldowns.get('打坐', ''))
-            html_content = html_content.replace("{{cd_breakthrough}}", cooldowns.get('突破', ''))
-            html_content = html_content.replace("{{cd_recover}}", cooldowns.get('调息', ''))
-            html_content = html_content.replace("{{cd_seclusion}}", cooldowns.get('闭关', ''))
-            html_content = html_content.replace("{{cd_duel}}", cooldowns.get('切磋', ''))
-            html_content = html_content.replace("{{cd_give}}", cooldowns.get('赠送', ''))
-            html_content = html_content.replace("{{battle_wins}}", str(battle.get('胜利', 0)))
-            html_content = html_content.replace("{{battle_losses}}", str(battle.get('失败', 0)))
-            html_content = html_content.replace("{{current_time}}", current_time)
-            
-            # 处理列表数据
-            friends_html = '\n'.join([f'<div class="list-item">{friend}</div>' for friend in friends]) if friends else '<div class="list-empty">暂无道友</div>'
-            skills_html = '\n'.join([f'<div class="list-item">{skill}</div>' for skill in skills]) if skills else '<div class="list-empty">暂无技能</div>'
-            items_html = '\n'.join([f'<div class="list-item">{item}</div>' for item in items]) if items else '<div class="list-empty">暂无物品</div>'
-            
-            # 替换列表变量
-            html_content = html_content.replace("{% if friends %}\n                    {% for friend in friends %}\n                        <div class=\"list-item\">{{friend}}</div>\n                    {% endfor %}\n                {% else %}\n                    <div class=\"list-empty\">暂无道友</div>\n                {% endif %}", friends_html)
-            html_content = html_content.replace("{% if skills %}\n                    {% for skill in skills %}\n                        <div class=\"list-item\">{{skill}}</div>\n                    {% endfor %}\n                {% else %}\n                    <div class=\"list-empty\">暂无技能</div>\n                {% endif %}", skills_html)
-            html_content = html_content.replace("{% if items %}\n                    {% for item in items %}\n                        <div class=\"list-item\">{{item}}</div>\n                    {% endfor %}\n                {% else %}\n                    <div class=\"list-empty\">暂无物品</div>\n                {% endif %}", items_html)
-            
-            # 使用html_render函数生成图片
-            options = {
-                "full_page": True,
-                "type": "jpeg",
-                "quality": 95,
-            }
-            
-            # 调用AstrBot的html_render方法
-            image_url = await self.html_render(
-                html_content,  # 渲染后的HTML内容
-                {},  # 空数据字典
-                True,  # 返回URL
-                options  # 图片生成选项
-            )
-            
-            return image_url
+            path = await self._insert(key, source)
+            future.set_result(path)
+            return path
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
         except Exception as e:
-            logger.error(f"个人信息图片生成失败：{e}")
-            # 回退到默认的纯文本输出
-            return None
+            future.set_exception(e)
+            # 没有其他等待者时避免“异常未被获取”的警告
+            future.exception()
+            raise
+        finally:
+            del self._storing[key]
     
-    async def render_status_image(self, data):
-        """使用状态模板生成图片"""
+    async def _insert(self, key, source):
+        filename = key[:32] + (os.path.splitext(source)[1] or ".jpg")
         try:
-            # 格式化当前时间
-            from datetime import datetime
-            current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            
-            # 替换模板变量
-            html_content = STATUS_TEMPLATE
-            html_content = html_content.replace("{{username}}", data.get('用户名', ''))
-            html_content = html_content.replace("{{level}}", str(data.get('等级', 0)))
-            html_content = html_content.replace("{{cultivation}}", str(data.get('修为', 0)))
-            html_content = html_content.replace("{{realm}}", data.get('境界', ''))
-            html_content = html_content.replace("{{experience}}", str(data.get('经验', 0)))
-            html_content = html_content.replace("{{battle_qi}}", str(data.get('斗气值', 0)))
-            html_content = html_content.replace("{{health}}", str(data.get('生命值', 0)))
-            html_content = html_content.replace("{{mana}}", str(data.get('灵力值', 0)))
-            html_content = html_content.replace("{{stamina}}", str(data.get('体力值', 0)))
-            html_content = html_content.replace("{{gold}}", str(data.get('金币', 0)))
-            html_content = html_content.replace("{{spirit_stone}}", str(data.get('灵石', 0)))
-            html_content = html_content.replace("{{current_time}}", current_time)
-            
-            # 使用html_render函数生成图片
-            options = {
-                "full_page": True,
-                "type": "jpeg",
-                "quality": 95,
-            }
-            
-            # 调用AstrBot的html_render方法
-            image_url = await self.html_render(
-                html_content,  # 渲染后的HTML内容
-                {},  # 空数据字典
-                True,  # 返回URL
-                options  # 图片生成选项
-            )
-            
-            return image_url
-        except Exception as e:
-            logger.error(f"状态图片生成失败：{e}")
-            # 回退到默认的纯文本输出
-            return None
+            size = await asyncio.to_thread(self._store, source, filename)
+        except OSError as e:
+            logger.error(f"图片缓存写入失败：{e}")
+            return source
+        path = os.path.join(self.directory, filename)
+        if size > self.max_bytes:
+            # 超过容量上限的图片不计入缓存，下次启动时清理
+            return path
+        self._entries[key] = [filename, size, 1, time.time()]
+        self.total_bytes += size
+        evicted = []
+        while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+            # 刚写入的图片即将发送，不参与淘汰
+            victim = self._victim(exclude=key)
+            if victim is None:
+                break
+            evicted.append(self._remove(victim))
+        self.evicted += len(evicted)
+        await asyncio.to_thread(self._delete, [os.path.join(self.directory, name) for name in evicted])
+        await self.save()
+        return path
     
-    async def render_ranking_image(self, data):
-        """使用排行榜模板生成图片"""
+    def _victim(self, exclude=None):
+        candidates = (key for key in self._entries if key != exclude)
+        if self.policy == "lfu":
+            return min(candidates, key=lambda key: (self._entries[key][2], self._entries[key][3]), default=None)
+        return next(candidates, None)
+    
+    def _remove(self, key):
+        filename, size, _, _ = self._entries.pop(key)
+        self.total_bytes -= size
+        return filename
+    
+    def _store(self, source, filename):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, filename)
+        shutil.move(source, path)
+        return os.path.getsize(path)
+    
+    @staticmethod
+    def _delete(paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    
+    def load(self):
+        """读取索引文件，丢弃文件已不存在的条目并删除索引之外的图片"""
         try:
-            # 提取数据
-            ranking_list = data.get("排行榜", [])
-            update_time = data.get("更新时间", "")
-            
-            # 格式化当前时间
-            from datetime import datetime
-            current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            
-            # 生成排行榜内容
-            ranking_html = []
-            if ranking_list:
-                for rank, player in enumerate(ranking_list, 1):
-                    # 确定排名样式
-                    rank_class = ""
-                    if rank == 1:
-                        rank_class = " gold"
-                    elif rank == 2:
-                        rank_class = " silver"
-                    elif rank == 3:
-                        rank_class = " bronze"
-                    
-                    ranking_html.append(f'<div class="rank-item">')
-                    ranking_html.append(f'    <div class="rank-number{rank_class}">{rank}</div>')
-                    ranking_html.append(f'    <div class="player-info">')
-                    ranking_html.append(f'        <div class="player-name">{player.get("用户名", "")}</div>')
-                    ranking_html.append(f'        <div class="player-stats">')
-                    ranking_html.append(f'            <div class="stat-item">')
-                    ranking_html.append(f'                <span class="stat-label">境界：</span>')
-                    ranking_html.append(f'                <span class="stat-value">{player.get("境界", "")}</span>')
-                    ranking_html.append(f'            </div>')
-                    ranking_html.append(f'            <div class="stat-item">')
-                    ranking_html.append(f'                <span class="stat-label">修为：</span>')
-                    ranking_html.append(f'                <span class="stat-value">{player.get("修为值", 0)}</span>')
-                    ranking_html.append(f'            </div>')
-                    ranking_html.append(f'            <div class="stat-item">')
-                    ranking_html.append(f'                <span class="stat-label">等级：</span>')
-                    ranking_html.append(f'                <span class="stat-value">{player.get("等级", 0)}</span>')
-                    ranking_html.append(f'            </div>')
-                    ranking_html.append(f'        </div>')
-                    ranking_html.append(f'    </div>')
-                    ranking_html.append(f'</div>')
+            with open(os.path.join(self.directory, self.INDEX_FILE), "r", encoding="utf-8") as f:
+                entries = json.load(f).get("entries", [])
+        except FileNotFoundError:
+            entries = []
+        except (OSError, ValueError) as e:
+            logger.warning(f"图片缓存索引读取失败，将重新建立：{e}")
+            entries = []
+        
+        for key, filename, size, hits, last_used in entries:
+            if os.path.isfile(os.path.join(self.directory, filename)):
+                self._entries[key] = [filename, size, hits, last_used]
+                self.total_bytes += size
+        
+        known = {entry[0] for entry in self._entries.values()} | {self.INDEX_FILE}
+        try:
+            orphans = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name not in known]
+        except OSError:
+            orphans = []
+        self._delete(orphans)
+        while self._entries and (len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            self._delete([os.path.join(self.directory, self._remove(self._victim()))])
+    
+    async def save(self):
+        """在线程中写入索引文件，使用情况随之保存"""
+        payload = json.dumps({"entries": [[key, *entry] for key, entry in self._entries.items()]})
+        async with self._save_lock:
+            try:
+                await asyncio.to_thread(self._write_index, payload)
+            except OSError as e:
+                logger.error(f"图片缓存索引写入失败：{e}")
+    
+    def _write_index(self, payload):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, self.INDEX_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+    
+    def __len__(self):
+        return len(self._entries)
+
+class CircuitBreaker:
+    """上游熔断器：连续失败达到阈值后在冷却时间内直接拒绝请求，冷却结束后放行一个探测请求"""
+    
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        # 探测请求的发出时间，探测超时未返回（如协程被取消）时允许重新探测
+        self._probe_started = None
+    
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+    
+    def allow(self):
+        """判断是否允许发出请求"""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open":
+            now = time.monotonic()
+            if self._probe_started is None or now - self._probe_started >= self.reset_timeout:
+                self._probe_started = now
+                return True
+        return False
+    
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probe_started = None
+    
+    def record_failure(self):
+        self.failures += 1
+        probing = self._probe_started is not None
+        if probing or self.failures >= self.failure_threshold:
+            if self.opened_at is None or probing:
+                logger.warning(f"上游API连续失败{self.failures}次，熔断{self.reset_timeout}秒")
+            self.opened_at = time.monotonic()
+        self._probe_started = None
+
+class CooldownTracker:
+    """本地冷却记录，冷却期内的指令无需请求上游即可直接拒绝
+    
+    每个玩家只占用一个定长 array，依次存放各指令冷却结束的时间戳，数万玩家也只占用很少内存
+    """
+    
+    ACTIONS = tuple(ACTION_COOLDOWNS)
+    _INDEX = dict(zip(ACTIONS, range(len(ACTIONS))))
+    _DURATION_RE = re.compile(r"(\d+)\s*(小时|分钟|分|秒)")
+    _UNIT_SECONDS = {"小时": 3600, "分钟": 60, "分": 60, "秒": 1}
+    # 记录超过该数量时清理已全部过期的玩家
+    PURGE_THRESHOLD = 50000
+    
+    def __init__(self):
+        self._expires = {}
+    
+    def remaining(self, user, action):
+        """返回剩余冷却秒数，无冷却时为0"""
+        expires = self._expires.get(user)
+        if expires is None or action not in self._INDEX:
+            return 0
+        return max(0.0, expires[self._INDEX[action]] - time.time())
+    
+    def start(self, user, action, seconds=None):
+        """记录冷却开始，seconds 为空时使用指令的固定冷却时间"""
+        if action not in self._INDEX:
+            return
+        if seconds is None:
+            seconds = ACTION_COOLDOWNS[action]
+        self.track(user)
+        self._expires[user][self._INDEX[action]] = time.time() + seconds
+    
+    def clear(self, user, action):
+        expires = self._expires.get(user)
+        if expires is not None and action in self._INDEX:
+            expires[self._INDEX[action]] = 0.0
+    
+    def update_from_info(self, user, cooldowns, elapsed=0.0):
+        """根据个人信息中的修炼冷却校准本地记录，elapsed 为这份信息距今的秒数"""
+        self.track(user)
+        for action, text in (cooldowns or {}).items():
+            if action not in self._INDEX:
+                continue
+            seconds = self.parse_duration(str(text))
+            if seconds and seconds > elapsed:
+                self.start(user, action, seconds - elapsed)
             else:
-                ranking_html.append('<div class="empty-rank">排行榜为空！</div>')
-            
-            rankings_content = '\n'.join(ranking_html)
-            
-            # 替换模板变量
-            html_content = RANKING_TEMPLATE
-            html_content = html_content.replace("{{update_time}}", update_time)
-            html_content = html_content.replace("{{rankings_content}}", rankings_content)
-            html_content = html_content.replace("{{current_time}}", current_time)
-            
-            # 使用html_render函数生成图片
-            options = {
-                "full_page": True,
-                "type": "jpeg",
-                "quality": 95,
-            }
-            
-            # 调用AstrBot的html_render方法
-            image_url = await self.html_render(
-                html_content,  # 渲染后的HTML内容
-                {},  # 空数据字典
-                True,  # 返回URL
-                options  # 图片生成选项
-            )
-            
-            return image_url
-        except Exception as e:
-            logger.error(f"排行榜图片生成失败：{e}")
-            # 回退到默认的纯文本输出
+                self.clear(user, action)
+    
+    def track(self, user):
+        """为玩家建立冷却记录（全部冷却结束），之后 user in tracker 为真"""
+        if user not in self._expires:
+            if len(self._expires) >= self.PURGE_THRESHOLD:
+                self.purge()
+            self._expires[user] = array("d", bytes(8 * len(self.ACTIONS)))
+    
+    @classmethod
+    def parse_duration(cls, text):
+        """从“1小时20分钟”“剩余5分钟”等文本中解析秒数，无法解析时返回None"""
+        matches = cls._DURATION_RE.findall(text)
+        if not matches:
             return None
+        return sum(int(value) * cls._UNIT_SECONDS[unit] for value, unit in matches)
     
-    @filter.command("斗破帮助", alias={"帮助", "斗破指令", "斗气帮助", "斗气指令"})
-    async def help(self, event):
-        """查看所有指令说明"""
-        help_text = (
-                     "🔹 **斗破帮助**   - 查看所有指令说明\n" +
-                     "🔹 **创建角色**   - 创建斗气角色（自动使用你的QQ号，无需额外参数）\n" +
-                     "🔹 **状态**       - 查看自己的斗气状态\n" +
-                     "🔹 **个人信息**   - 查看详细角色信息\n" +
-                     "🔹 **打坐**       - 基础修炼获得斗气（冷却10分钟）\n" +
-                     "🔹 **突破**       - 消耗斗气突破境界\n" +
-                     "🔹 **调息**       - 恢复生命和灵力（冷却30分钟）\n" +
-                     "🔹 **闭关**       - 深度修炼获得更多斗气（格式：闭关 [时长]，冷却2小时）\n" +
-                     "🔹 **排行榜**     - 查看斗气排行榜\n" +
-                     "🔹 **道友**       - 查看好友/道友列表\n" +
-                     "🔹 **切磋**       - 与道友切磋（格式：切磋 @目标QQ号）\n" +
-                     "🔹 **赠送**       - 赠送物品给道友（格式：赠送 @目标QQ号 物品x数量）\n" +
-                     "🔹 **任务**       - 任务系统（格式：任务 [列表/领取/完成]）\n" +
-                     "🔹 **背包**       - 查看或管理背包物品（格式：背包 [查看/整理/使用 物品名]）\n" +
-                     "🔹 **签到**       - 每日签到，领取基础资源（冷却24小时）\n" +
-                     "🔹 **日志**       - 查看近期修炼和战斗记录\n" +
-                     "🔹 **探索**       - 探索地点获取资源（格式：探索 [地点]）\n" +
-                     "🔹 **副本**       - 挑战副本获得奖励（格式：副本 [副本名称]）\n" +
-                     "🔹 **逃跑**       - 脱离战斗\n" +
-                     "🔹 **采集**       - 采集药材（格式：采集 [药材名称]）\n" +
-                     "🔹 **炼制**       - 炼制丹药（格式：炼制 [丹药名称]）\n" +
-                     "🔹 **丹方**       - 查看丹药配方（格式：丹方 [丹药名称]）\n" +
-                     "🔹 **学习功法**   - 学习新的功法（格式：学习功法 [功法名称]）\n" +
-                     "🔹 **升级功法**   - 升级已有功法（格式：升级功法 [功法名称]）\n" +
-                     "🔹 **技能**       - 查看技能列表\n" +
-                     "🔹 **宗门**       - 宗门系统（格式：宗门 [创建/加入/退出/信息]）\n" +
-                     "🔹 **宗门任务**   - 宗门任务系统（格式：宗门任务 [领取/完成]）\n" +
-                     "🔹 **拍卖行**     - 拍卖行系统（格式：拍卖行 [搜索/购买/上架]）\n" +
-                     ""
-                     )
-        
-        # 尝试生成图片
-        image_url = await self.text_to_image_menu_style(help_text)
-        
-        if image_url:
-            # 如果生成图片成功，发送图片
-            yield event.image_result(image_url).use_t2i(False)
-        else:
-            # 否则发送纯文本
-            yield event.plain_result(help_text)
+    @staticmethod
+    def format_remaining(seconds):
+        minutes = max(1, int((seconds + 59) // 60))
+        if minutes >= 60:
+            hours, minutes = divmod(minutes, 60)
+            return f"{hours}小时{minutes}分钟" if minutes else f"{hours}小时"
+        return f"{minutes}分钟"
     
-    @filter.command("创建角色", alias={"注册", "开始斗气"})
-    async def create_character(self, event):
-        """创建斗气角色"""
-        # 按照用户要求：用户名用QQ名，密码用QQ号
-        username = event.get_sender_name()  # 获取QQ名作为用户名
-        username = username[:12]  # 确保不超过12位
-        password = str(event.message_obj.sender.user_id)  # 使用QQ号作为密码
-        
-        response = await self._call_api("创建角色", {"username": username, "password": password})
-        yield event.plain_result(self._format_response(response))
+    def purge(self):
+        """清理所有冷却均已结束的玩家"""
+        now = time.time()
+        expired = [user for user, expires in self._expires.items() if max(expires) <= now]
+        for user in expired:
+            del self._expires[user]
     
-    @filter.command("状态", alias={"我的状态", "查看状态"})
-    async def status(self, event):
-        """查看自己的斗气状态"""
-        # 自动获取用户的QQ名作为用户名，QQ号作为密码
-        username = event.get_sender_name()  # 获取QQ名作为用户名
-        username = username[:12]  # 确保不超过12位
-        password = str(event.message_obj.sender.user_id)  # 使用QQ号作为密码
-        
-        response = await self._call_api("状态", {"username": username, "password": password})
+    def __contains__(self, user):
+        return user in self._expires
+    
+    def __len__(self):
+        return len(self._expires)
+
+class IdentityMap:
+    """QQ号到已注册用户名的映射，持久化到JSON文件
+    
+    用户名取自注册时的QQ昵称；之后昵称变化时仍用注册时的用户名登录，不会被当成另一个账号。
+    插件启用前已注册的玩家在第一次成功执行指令时记录。
+    """
+    
+    SAVE_DELAY = 1.0
+    
+    def __init__(self, path):
+        self.path = path
+        self._names = {}  # QQ号 -> 用户名
+        self._save_handle = None
+    
+    def get(self, user_id):
+        return self._names.get(user_id)
+    
+    def record(self, user_id, username, replace=False):
+        """记录QQ号对应的用户名，replace 为 False 时不覆盖已有的记录
         
-        if response.get("code") != 200:
-            yield event.plain_result(self._format_response(response))
+        只能在上游以该QQ号与用户名登录成功后调用；replace 只用于创建角色与绑定角色。
+        """
+        current = self._names.get(user_id)
+        if current == username or (current is not None and not replace):
             return
-        
-        data = response.get("data", {})
-        
-        # 尝试生成图片
-        image_url = await self.render_status_image(data)
-        
-        if image_url:
-            # 如果生成图片成功，发送图片
-            yield event.image_result(image_url).use_t2i(False)
-        else:
-            # 否则发送纯文本
-            status_text = f"""🌟 {data.get('用户名')} 的状态信息：
+        self._names[user_id] = username
+        if self._save_handle is None:
+            # 短时间内的多次变化合并为一次写入
+            self._save_handle = asyncio.get_running_loop().call_later(self.SAVE_DELAY, self.save)
+    
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._names = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.error(f"玩家身份记录读取失败：{e}")
+    
+    def save(self):
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            self._save_handle = None
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._names, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"玩家身份记录写入失败：{e}")
+    
+    @property
+    def dirty(self):
+        return self._save_handle is not None
+    
+    def __len__(self):
+        return len(self._names)
 
-📊 等级：{data.get('等级')}
-🛡️ 修为：{data.get('修为')}
-✨ 境界：{data.get('境界')}
-📈 经验：{data.get('经验')}
-❤️ 生命值：{data.get('生命值')}
-💧 灵力值：{data.get('灵力值')}
-💫 斗气值：{data.get('斗气值')}
-⚡ 体力值：{data.get('体力值')}
-💰 金币：{data.get('金币')}
-💎 灵石：{data.get('灵石')}
-"""
-            yield event.plain_result(status_text)
+class CatalogueIndex:
+    """丹药、药材、探索地点、副本名称的本地索引，用于在请求上游前校验并纠正名称
     
-    @filter.command("个人信息", alias={"信息", "我的信息"})
-    async def personal_info(self, event):
-        """查看详细角色信息"""
-        # 自动获取用户的QQ名作为用户名，QQ号作为密码
-        username = event.get_sender_name()  # 获取QQ名作为用户名
-        username = username[:12]  # 确保不超过12位
-        password = str(event.message_obj.sender.user_id)  # 使用QQ号作为密码
+    丹药与药材来自丹方列表，地点与副本从成功的探索、副本结果中收集。
+    只有丹药名称来自完整的丹方列表，因此只有丹药会直接拒绝未知名称，其余类别仅在能唯一匹配时纠正。
+    上游接受过的名称单独保存，可信度低于丹方列表：只在丹方列表中没有匹配时使用，不会挡住对丹方名称的纠正，
+    丹方列表刷新后丢弃其中的丹药名称。
+    """
+    
+    KINDS = ("pill", "herb", "location", "dungeon")
+    LABELS = {"pill": "丹药", "herb": "药材", "location": "探索地点", "dungeon": "副本"}
+    FUZZY_CUTOFF = 0.6
+    
+    def __init__(self):
+        self.recipes = {}
+        self.fetched_at = 0.0
+        # 来自丹方列表的名称
+        self._names = {kind: [] for kind in self.KINDS}
+        # 上游接受过的名称
+        self._learned = {kind: [] for kind in self.KINDS}
+    
+    @property
+    def ready(self):
+        return bool(self.recipes)
+    
+    def is_authoritative(self, kind):
+        return kind == "pill" and self.ready
+    
+    def update_recipes(self, recipes):
+        """用丹方列表重建丹药与药材索引"""
+        self.recipes = {recipe["丹药名称"]: recipe for recipe in recipes if recipe.get("丹药名称")}
+        self._names["pill"] = sorted(self.recipes)
+        self._names["herb"] = sorted({herb for recipe in self.recipes.values() for herb in recipe.get("所需材料", {})})
+        self._learned["pill"] = []
+        self.fetched_at = time.time()
+    
+    def learn(self, kind, name):
+        """记录一个上游接受过的名称，返回是否为新名称"""
+        if self._contains(self._names[kind], name):
+            return False
+        names = self._learned[kind]
+        i = bisect.bisect_left(names, name)
+        if i < len(names) and names[i] == name:
+            return False
+        names.insert(i, name)
+        return True
+    
+    @staticmethod
+    def _contains(names, name):
+        i = bisect.bisect_left(names, name)
+        return i < len(names) and names[i] == name
+    
+    def resolve(self, kind, text):
+        """返回 (匹配的名称, 候选名称)，先在丹方列表的名称中匹配，没有结果时再用上游接受过的名称"""
+        name, candidates = self._match(self._names[kind], text)
+        if name is None and self._contains(self._learned[kind], text):
+            return text, []
+        if name is None and not candidates:
+            name, candidates = self._match(self._learned[kind], text)
+        return name, candidates
+    
+    def _match(self, names, text):
+        """精确匹配、唯一前缀匹配、唯一近似匹配依次尝试"""
+        i = bisect.bisect_left(names, text)
+        if i < len(names) and names[i] == text:
+            return text, []
         
-        response = await self._call_api("个人信息", {"username": username, "password": password})
+        prefixed = []
+        while i < len(names) and names[i].startswith(text) and len(prefixed) < 4:
+            prefixed.append(names[i])
+            i += 1
+        if len(prefixed) == 1:
+            return prefixed[0], []
         
-        if response.get("code") != 200:
-            yield event.plain_result(self._format_response(response))
+        candidates = prefixed or difflib.get_close_matches(text, names, n=3, cutoff=self.FUZZY_CUTOFF)
+        if len(candidates) == 1:
+            return candidates[0], []
+        return None, candidates[:3]
+    
+    def load(self, path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.error(f"图鉴索引读取失败：{e}")
             return
         
-        data = response.get("data", {})
-        
-        # 尝试生成图片
-        image_url = await self.render_personal_info_image(data)
+        self.update_recipes(saved.get("recipes", []))
+        self.fetched_at = saved.get("fetched_at", 0.0)
+        for kind in self.KINDS:
+            for name in saved.get("learned", {}).get(kind, []):
+                self.learn(kind, name)
+    
+    def save(self, path):
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({
+                    "fetched_at": self.fetched_at,
+                    "recipes": list(self.recipes.values()),
+                    "learned": self._learned,
+                }, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"图鉴索引写入失败：{e}")
+
+class ActionScheduler:
+    """定时指令调度器：所有玩家的定时任务共用一个最小堆和一个后台协程
+    
+    任务按下次执行时间排序，每轮取出所有到期任务（至多 batch_size 个）以有限并发执行，
+    runner 返回下次执行前的等待秒数，返回 None 时移除任务。
+    任务被修改或取消时旧的堆条目不会立即删除，出堆时与任务当前的执行时间比对后丢弃。
+    任务按 (QQ号, 指令) 登记，只有登记任务的QQ号能查看和取消；任务定期写入磁盘，重启后继续执行。
+    """
+    
+    FLUSH_INTERVAL = 30
+    # runner 抛出异常后的重试间隔（秒）
+    ERROR_DELAY = 60
+    
+    def __init__(self, runner, path, concurrency=8, batch_size=200, max_jobs=50000):
+        self._runner = runner
+        self._path = path
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.batch_size = batch_size
+        self.max_jobs = max_jobs
+        # {(QQ号, 指令): 任务}
+        self.jobs = {}
+        self._heap = []
+        self._seq = 0
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._stopping = False
+        self._dirty = False
+        self._last_flush = time.monotonic()
+    
+    def add(self, user_id, username, action, delay=0.0, origin=None):
+        """登记或更新一个定时任务，origin 为发起会话，用于回报执行结果；任务数已达上限时返回False"""
+        key = (user_id, action)
+        if key not in self.jobs and len(self.jobs) >= self.max_jobs:
+            return False
         
-        if image_url:
+        job = self.jobs.get(key) or {
+            "user_id": user_id, "action": action, "last_run": None, "last_result": None, "failures": 0,
+        }
+        job["username"] = username
+        job["origin"] = origin
+        job["next_run"] = time.time() + delay
+        self.jobs[key] = job
+        self._push(job)
+        self._dirty = True
+        return True
+    
+    def remove(self, user_id, actions):
+        """取消指定QQ号的定时任务，返回实际取消的数量"""
+        removed = sum(self.jobs.pop((user_id, action), None) is not None for action in actions)
+        if removed:
+            self._dirty = True
+        return removed
+    
+    def get(self, user_id, action):
+        return self.jobs.get((user_id, action))
+    
+    def _push(self, job):
+        self._seq += 1
+        entry = (job["next_run"], self._seq, (job["user_id"], job["action"]))
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry:
+            # 新任务早于当前等待的任务，唤醒调度协程重新计算等待时间
+            self._wakeup.set()
+    
+    def start(self):
+        """在事件循环中启动调度协程，尚无运行中的事件循环时不做任何事"""
+        if self._task is not None:
+            return
+        self._stopping = False
+        try:
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+        except RuntimeError:
+            pass
+    
+    async def stop(self):
+        if self._task is not None:
+            # wait_for 等待的事件恰好在取消时完成会吞掉取消，同时设置标志保证循环退出
+            self._stopping = True
+            self._wakeup.set()
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._dirty:
+            self._write(self._snapshot())
+    
+    async def _loop(self):
+        while not self._stopping:
+            if self._dirty and time.monotonic() - self._last_flush >= self.FLUSH_INTERVAL:
+                await self.flush()
+            
+            now = time.time()
+            due = []
+            while self._heap and self._heap[0][0] <= now and len(due) < self.batch_size:
+                run_at, _, key = heapq.heappop(self._heap)
+                job = self.jobs.get(key)
+                if job is not None and job["next_run"] == run_at:
+                    due.append(job)
+            if due:
+                await asyncio.gather(*(self._run(job) for job in due))
+                continue
+            
+            timeout = self._heap[0][0] - now if self._heap else self.FLUSH_INTERVAL
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), min(timeout, self.FLUSH_INTERVAL))
+            except asyncio.TimeoutError:
+                pass
+    
+    async def _run(self, job):
+        async with self._semaphore:
+            try:
+                delay = await self._runner(job)
+            except Exception as e:
+                logger.error(f"定时任务执行失败 {job['username']} {job['action']}: {e}")
+                delay = self.ERROR_DELAY
+        
+        key = (job["user_id"], job["action"])
+        if self.jobs.get(key) is not job:
+            # 执行期间任务已被取消
+            return
+        if delay is None:
+            del self.jobs[key]
+        else:
+            job["next_run"] = time.time() + delay
+            self._push(job)
+        self._dirty = True
+    
+    def _snapshot(self):
+        return [dict(job) for job in self.jobs.values()]
+    
+    async def flush(self):
+        """在线程中写入任务列表，避免数万任务序列化时阻塞事件循环"""
+        self._dirty = False
+        self._last_flush = time.monotonic()
+        await asyncio.to_thread(self._write, self._snapshot())
+    
+    def _write(self, jobs):
+        try:
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            tmp_path = self._path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(jobs, f, ensure_ascii=False)
+            os.replace(tmp_path, self._path)
+        except OSError as e:
+            self._dirty = True
+            logger.error(f"定时任务写入失败：{e}")
+    
+    async def load(self):
+        """在线程中读取任务列表，再在事件循环中登记"""
+        try:
+            jobs = await asyncio.get_running_loop().run_in_executor(None, self._read)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.error(f"定时任务读取失败：{e}")
+            return
+        
+        for job in jobs:
+            self.jobs[(job["user_id"], job["action"])] = job
+            self._push(job)
+    
+    def _read(self):
+        with open(self._path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    
+    def __len__(self):
+        return len(self.jobs)
+
+class SnapshotStore:
+    """玩家最近一次查询结果（状态、个人信息、道友）的本地快照，保存在 SQLite（WAL 模式）中
+    
+    快照按 (QQ号, 类型) 保存，只在上游以该QQ号登录成功后写入，读取时还需用户名一致，
+    昵称相同的其他QQ号读不到别人的快照。
+    写入先在内存中按 (QQ号, 类型) 合并，定时在专用线程中批量提交，不阻塞事件循环；
+    所有数据库操作都在同一个线程中执行。数据库超过容量上限时删除最久未更新的快照。
+    同时记录各群中使用过指令的成员，供全群状态使用。
+    """
+    
+    # 超过容量上限时在超出部分之外额外删除的快照比例，避免每次写入都触发清理
+    EVICT_RATIO = 0.1
+    # 群成员的最近活跃时间每隔多久更新一次（秒）
+    MEMBER_TOUCH_INTERVAL = 3600
+    
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, flush_interval=1.0, batch_size=500):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="literary_battle_qi_store")
+        self._conn = None
+        # {(QQ号, 类型): (用户名, JSON, 更新时间)}
+        self._pending = {}
+        # {(群号, QQ号): (用户名, 活跃时间)}，已写入或待写入的群成员
+        self._members = {}
+        self._pending_members = {}
+        self._flush_task = None
+        self.written = 0
+        self.evicted = 0
+    
+    def put(self, user_id, username, kind, data):
+        self._pending[(user_id, kind)] = (username, json.dumps(data, ensure_ascii=False), time.time())
+        if len(self._pending) >= self.batch_size:
+            asyncio.ensure_future(self.flush())
+        elif self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+    
+    def touch_member(self, group_id, user_id, username):
+        """记录群成员，同一成员一小时内只写入一次"""
+        key = (group_id, user_id)
+        known = self._members.get(key)
+        now = time.time()
+        if known and known[0] == username and now - known[1] < self.MEMBER_TOUCH_INTERVAL:
+            return
+        self._members[key] = self._pending_members[key] = (username, now)
+        if self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+    
+    async def members(self, group_id, limit):
+        """最近活跃的群成员 [(用户名, QQ号)]"""
+        await self.flush()
+        return await self._execute(self._read_members, group_id, limit)
+    
+    async def get(self, user_id, username, kind):
+        """返回该QQ号以该用户名登录时保存的 (数据, 更新时间)，没有快照时返回 None"""
+        pending = self._pending.get((user_id, kind))
+        if pending is None:
+            try:
+                pending = await self._execute(self._read, user_id, kind)
+            except sqlite3.Error as e:
+                logger.error(f"快照读取失败：{e}")
+                return None
+            if pending is None:
+                return None
+        if pending[0] != username:
+            # 该QQ号已改为登录另一个角色，旧角色的快照不再使用
+            return None
+        return json.loads(pending[1]), pending[2]
+    
+    async def delete(self, user_id, kinds):
+        for kind in kinds:
+            self._pending.pop((user_id, kind), None)
+        try:
+            await self._execute(self._delete, user_id, tuple(kinds))
+        except sqlite3.Error as e:
+            logger.error(f"快照删除失败：{e}")
+    
+    async def flush(self):
+        if self._pending_members:
+            members = [(group_id, user_id, username, seen_at)
+                       for (group_id, user_id), (username, seen_at) in self._pending_members.items()]
+            self._pending_members = {}
+            try:
+                await self._execute(self._write_members, members)
+            except sqlite3.Error as e:
+                logger.error(f"群成员写入失败：{e}")
+        
+        if not self._pending:
+            return
+        rows = [(user_id, kind, username, data, updated_at)
+                for (user_id, kind), (username, data, updated_at) in self._pending.items()]
+        self._pending = {}
+        try:
+            await self._execute(self._write, rows)
+        except sqlite3.Error as e:
+            logger.error(f"快照写入失败：{e}")
+    
+    async def scan(self, kind):
+        """读取某一类型的全部快照，返回 [(玩家, 数据)]"""
+        rows = await self._execute(self._scan, kind)
+        pending = {user_id: (username, json.loads(data))
+                   for (user_id, pending_kind), (username, data, _) in self._pending.items() if pending_kind == kind}
+        return [pending.pop(user_id, (username, data)) for user_id, username, data in rows] + list(pending.values())
+    
+    async def stats(self):
+        return await self._execute(self._stats)
+    
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        await self.flush()
+        await self._execute(self._close)
+        self._executor.shutdown(wait=False)
+    
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+        finally:
+            self._flush_task = None
+    
+    async def _execute(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+    
+    # 以下方法只在存储线程中执行
+    
+    def _open(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            # auto_vacuum 只对新建的数据库生效，删除快照后可以归还磁盘空间
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS snapshots ("
+                "user_id TEXT NOT NULL, kind TEXT NOT NULL, username TEXT NOT NULL, data TEXT NOT NULL, "
+                "updated_at REAL NOT NULL, PRIMARY KEY (user_id, kind))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS snapshots_updated_at ON snapshots (updated_at)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS group_members ("
+                "group_id TEXT NOT NULL, user_id TEXT NOT NULL, username TEXT NOT NULL, seen_at REAL NOT NULL, "
+                "PRIMARY KEY (group_id, user_id))"
+            )
+            self._conn = conn
+        return self._conn
+    
+    def _read(self, user_id, kind):
+        return self._open().execute(
+            "SELECT username, data, updated_at FROM snapshots WHERE user_id = ? AND kind = ?", (user_id, kind)
+        ).fetchone()
+    
+    def _read_members(self, group_id, limit):
+        return self._open().execute(
+            "SELECT username, user_id FROM group_members WHERE group_id = ? ORDER BY seen_at DESC LIMIT ?",
+            (group_id, limit),
+        ).fetchall()
+    
+    def _write_members(self, members):
+        conn = self._open()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany("INSERT OR REPLACE INTO group_members VALUES (?, ?, ?, ?)", members)
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+    
+    def _scan(self, kind):
+        rows = self._open().execute("SELECT user_id, username, data FROM snapshots WHERE kind = ?", (kind,))
+        return [(user_id, username, json.loads(data)) for user_id, username, data in rows]
+    
+    def _delete(self, user_id, kinds):
+        self._open().executemany(
+            "DELETE FROM snapshots WHERE user_id = ? AND kind = ?", [(user_id, kind) for kind in kinds]
+        )
+    
+    def _write(self, rows):
+        conn = self._open()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany("INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?)", rows)
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        self.written += len(rows)
+        
+        # WAL 文件大小由自动检查点限制（约4MB），容量上限只针对数据库本身
+        usage = self._database_size(conn)
+        if usage > self.max_bytes:
+            count = conn.execute("SELECT COUNT(*) FROM snapshots").fetchone()[0]
+            evict = min(count, int(count * (1 - self.max_bytes / usage + self.EVICT_RATIO)) + 1)
+            conn.execute(
+                "DELETE FROM snapshots WHERE rowid IN (SELECT rowid FROM snapshots ORDER BY updated_at LIMIT ?)",
+                (evict,),
+            )
+            # execute 只会执行 incremental_vacuum 的第一步（释放一页），executescript 才会执行完
+            conn.executescript("PRAGMA incremental_vacuum;")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self.evicted += evict
+    
+    def _database_size(self, conn):
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        return page_count * page_size
+    
+    def _disk_usage(self, conn):
+        try:
+            wal_size = os.path.getsize(self.path + "-wal")
+        except OSError:
+            wal_size = 0
+        return self._database_size(conn) + wal_size
+    
+    def _stats(self):
+        conn = self._open()
+        rows, players = conn.execute("SELECT COUNT(*), COUNT(DISTINCT user_id) FROM snapshots").fetchone()
+        try:
+            realms = conn.execute(
+                "SELECT json_extract(data, '$.境界'), COUNT(*) FROM snapshots WHERE kind = '状态' "
+                "GROUP BY 1 ORDER BY 2 DESC LIMIT 10"
+            ).fetchall()
+        except sqlite3.OperationalError:
+            # SQLite 未编译 JSON 扩展
+            realms = []
+        return {
+            "rows": rows,
+            "players": players,
+            "disk_bytes": self._disk_usage(conn),
+            "pending": len(self._pending),
+            "written": self.written,
+            "evicted": self.evicted,
+            "realms": realms,
+        }
+    
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+class RankIndex:
+    """按 (境界, 修为值) 排序的玩家名次索引
+    
+    有序列表中保存 (-境界序号, -修为值, 用户名)，更新一个玩家只需二分查找删除旧位置再插入，
+    查询名次为一次二分查找，无需每次重新排序。
+    修为值只来自排行榜与道友列表；状态、个人信息只更新境界，尚无修为值的玩家按0计。
+    """
+    
+    def __init__(self):
+        self._keys = []
+        self._by_user = {}
+        # 已知修为值的玩家
+        self._valued = set()
+    
+    @staticmethod
+    def make_key(username, realm, value):
+        try:
+            value = int(value or 0)
+        except (TypeError, ValueError):
+            value = 0
+        return (-REALM_ORDER.get(realm, 0), -value, username)
+    
+    def update(self, username, realm, value=None):
+        """更新玩家的境界与修为值，value 为 None 时保留已知的修为值"""
+        old = self._by_user.get(username)
+        if value is None:
+            key = (-REALM_ORDER.get(realm, 0), old[1] if old else 0, username)
+        else:
+            key = self.make_key(username, realm, value)
+            self._valued.add(username)
+        if old == key:
+            return
+        if old is not None:
+            del self._keys[bisect.bisect_left(self._keys, old)]
+        bisect.insort(self._keys, key)
+        self._by_user[username] = key
+    
+    def rank(self, username):
+        """返回名次（境界与修为值相同的玩家名次相同），未收录的玩家返回 None"""
+        key = self._by_user.get(username)
+        if key is None:
+            return None
+        return bisect.bisect_left(self._keys, key[:2]) + 1
+    
+    def ranks(self):
+        """所有玩家的名次 {用户名: 名次}"""
+        ranks = {}
+        previous, rank = None, 0
+        for i, key in enumerate(self._keys, 1):
+            if key[:2] != previous:
+                previous, rank = key[:2], i
+            ranks[key[2]] = rank
+        return ranks
+    
+    def has_value(self, username):
+        return username in self._valued
+    
+    @property
+    def valued_count(self):
+        return len(self._valued)
+    
+    def __contains__(self, username):
+        return username in self._by_user
+    
+    def __len__(self):
+        return len(self._keys)
+
+class RenderScheduler:
+    """渲染调度器：限制同时进行的浏览器渲染数量，其余任务按优先级排队
+    
+    队列已满或任务超时时返回 None，由调用方回退到纯文本输出。命中缓存的请求不经过调度器。
+    """
+    
+    # 触发降级判断所需的最少渲染样本数
+    MIN_DEGRADE_SAMPLES = 5
+    
+    def __init__(self, concurrency=2, max_queue=20, timeout=20.0,
+                 degrade_latency=0.0, degrade_queue_depth=0, degrade_window=60.0):
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max_queue
+        self.timeout = timeout
+        # 自适应降级：近期渲染 p95 耗时或排队深度超过阈值时直接输出文字（0 表示不启用该项）
+        self.degrade_latency = degrade_latency
+        self.degrade_queue_depth = degrade_queue_depth
+        self.degrade_window = degrade_window
+        self.degraded = False
+        self.degraded_skips = 0
+        # 降级窗口内的 (完成时间, 渲染耗时)，超时按 timeout 计入、失败按实际耗时计入
+        self._recent = deque()
+        self.running = 0
+        self._queue = []  # (优先级, 序号, future)
+        self._seq = 0
+        # 统计信息
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.failed = 0
+        self._wait_times = deque(maxlen=500)
+        self._render_times = deque(maxlen=500)
+    
+    @property
+    def queued(self):
+        return sum(1 for _, _, future in self._queue if not future.done())
+    
+    async def run(self, factory, priority=RENDER_PRIORITY_USER):
+        """在并发限制内执行 factory()，等待与执行总时长不超过 timeout"""
+        if self.under_pressure():
+            self.degraded_skips += 1
+            return None
+        
+        start = time.monotonic()
+        if self.running >= self.concurrency:
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                logger.warning("渲染队列已满，本次回退为文字输出")
+                return None
+            
+            future = asyncio.get_running_loop().create_future()
+            self._seq += 1
+            heapq.heappush(self._queue, (priority, self._seq, future))
+            try:
+                await asyncio.wait_for(future, self.timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if future.done() and not future.cancelled():
+                    # 超时的同时恰好轮到该任务，把名额交还给下一个任务
+                    self._release()
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                self.timeouts += 1
+                self._recent.append((time.monotonic(), self.timeout))
+                logger.warning(f"渲染排队超过{self.timeout}秒，本次回退为文字输出")
+                return None
+        else:
+            self.running += 1
+        
+        started = time.monotonic()
+        self._wait_times.append(started - start)
+        try:
+            result = await asyncio.wait_for(factory(), max(0.0, self.timeout - (started - start)))
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            # 超时的渲染正是最慢的情况，必须计入降级判断
+            self._recent.append((time.monotonic(), self.timeout))
+            logger.warning(f"渲染超过{self.timeout}秒，本次回退为文字输出")
+            return None
+        except Exception:
+            self.failed += 1
+            finished = time.monotonic()
+            self._recent.append((finished, finished - started))
+            raise
+        finally:
+            self._release()
+        
+        finished = time.monotonic()
+        self.completed += 1
+        self._render_times.append(finished - started)
+        self._recent.append((finished, finished - started))
+        return result
+    
+    def _release(self):
+        """释放一个渲染名额，直接交给优先级最高的等待任务"""
+        while self._queue:
+            _, _, future = heapq.heappop(self._queue)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.running -= 1
+    
+    def under_pressure(self):
+        """判断是否应降级为文字输出
+        
+        近期渲染 p95 耗时或排队深度超过阈值时进入降级；两者都回落到阈值一半以下时恢复。
+        降级期间没有新的渲染样本，窗口内样本过期后即自动恢复尝试渲染。
+        """
+        cutoff = time.monotonic() - self.degrade_window
+        while self._recent and self._recent[0][0] < cutoff:
+            self._recent.popleft()
+        
+        latency = 0.0
+        if len(self._recent) >= self.MIN_DEGRADE_SAMPLES:
+            latency = self._percentile([duration for _, duration in self._recent], 95)
+        queued = self.queued
+        
+        # 进入与恢复使用不同阈值，避免在临界点反复切换
+        factor = 0.5 if self.degraded else 1.0
+        pressure = (
+            (self.degrade_latency > 0 and latency > self.degrade_latency * factor)
+            or (self.degrade_queue_depth > 0 and queued >= self.degrade_queue_depth * factor)
+        )
+        if pressure != self.degraded:
+            self.degraded = pressure
+            if pressure:
+                logger.warning(f"渲染压力过大（p95 {latency * 1000:.0f}ms，排队 {queued}），暂时改为文字输出")
+            else:
+                logger.info("渲染压力已回落，恢复图片输出")
+        return self.degraded
+    
+    @staticmethod
+    def _percentile(values, percent):
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+    
+    def stats(self):
+        """当前队列深度、排队与渲染耗时（毫秒）等统计"""
+        return {
+            "running": self.running,
+            "queued": self.queued,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "failed": self.failed,
+            "degraded": self.degraded,
+            "degraded_skips": self.degraded_skips,
+            "wait_p50_ms": self._percentile(self._wait_times, 50) * 1000,
+            "wait_p95_ms": self._percentile(self._wait_times, 95) * 1000,
+            "render_p50_ms": self._percentile(self._render_times, 50) * 1000,
+            "render_p95_ms": self._percentile(self._render_times, 95) * 1000,
+        }
+
+# 当前正在处理的指令名，用于把各阶段耗时归属到对应指令
+_current_command = contextvars.ContextVar("literary_battle_qi_command", default="-")
+
+class LatencyHistogram:
+    """固定分桶的耗时直方图（毫秒），记录开销与样本数无关"""
+    
+    BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+    __slots__ = ("buckets", "count", "total", "max")
+    
+    def __init__(self):
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+    
+    def observe(self, ms):
+        self.buckets[bisect.bisect_left(self.BOUNDS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+    
+    def percentile(self, percent):
+        """按分桶上界估算百分位耗时"""
+        if not self.count:
+            return 0.0
+        threshold = self.count * percent / 100
+        seen = 0
+        for index, bucket in enumerate(self.buckets):
+            seen += bucket
+            if seen >= threshold:
+                return float(self.BOUNDS[index]) if index < len(self.BOUNDS) else self.max
+        return self.max
+    
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "avg_ms": self.total / self.count if self.count else 0.0,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+            "max_ms": self.max,
+        }
+
+class _NullStage:
+    """统计关闭时使用的空计时器"""
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+class _Stage:
+    __slots__ = ("metrics", "stage", "start")
+    
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc):
+        self.metrics.observe(self.stage, (time.perf_counter() - self.start) * 1000)
+        return False
+
+class Metrics:
+    """按指令、阶段统计耗时与次数
+    
+    阶段包括 total（指令整体）、http（上游请求）、json（响应解析）、template（模板填充）、
+    render（排队+渲染）、send（发送消息）。关闭时所有记录方法立即返回。
+    """
+    
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.started_at = time.time()
+        self.histograms = {}  # (指令, 阶段) -> LatencyHistogram
+        self.counters = {}  # (指令, 事件) -> 次数
+    
+    def stage(self, stage):
+        """计时上下文管理器：with metrics.stage("http"): ..."""
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, stage)
+    
+    def observe(self, stage, ms, command=None):
+        if not self.enabled:
+            return
+        key = (command or _current_command.get(), stage)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = LatencyHistogram()
+        histogram.observe(ms)
+    
+    def incr(self, event, command=None):
+        if not self.enabled:
+            return
+        key = (command or _current_command.get(), event)
+        self.counters[key] = self.counters.get(key, 0) + 1
+    
+    def reset(self):
+        self.started_at = time.time()
+        self.histograms.clear()
+        self.counters.clear()
+    
+    def snapshot(self):
+        """按指令汇总的统计数据"""
+        commands = {}
+        for (command, stage), histogram in self.histograms.items():
+            commands.setdefault(command, {"stages": {}, "events": {}})["stages"][stage] = histogram.to_dict()
+        for (command, event), count in self.counters.items():
+            commands.setdefault(command, {"stages": {}, "events": {}})["events"][event] = count
+        return {"started_at": self.started_at, "enabled": self.enabled, "commands": commands}
+    
+    def dump(self, path):
+        """将统计数据写入JSON文件"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+        return path
+
+def instrumented(handler):
+    """记录指令处理耗时的装饰器，需放在 @filter.command 之下
+    
+    等待 yield 返回的时间即框架发送消息的时间，记为 send 阶段。执行指令前先等待插件数据载入完成。
+    """
+    @functools.wraps(handler)
+    async def wrapper(self, event, *args, **kwargs):
+        await self._ensure_loaded()
+        metrics = self._metrics
+        if not metrics.enabled:
+            async for result in handler(self, event, *args, **kwargs):
+                yield result
+            return
+        
+        command = handler.__name__
+        token = _current_command.set(command)
+        metrics.incr("calls", command)
+        start = time.perf_counter()
+        send_ms = 0.0
+        try:
+            async for result in handler(self, event, *args, **kwargs):
+                yielded = time.perf_counter()
+                yield result
+                send_ms += (time.perf_counter() - yielded) * 1000
+        except Exception:
+            metrics.incr("exceptions", command)
+            raise
+        finally:
+            total_ms = (time.perf_counter() - start) * 1000
+            metrics.observe("total", total_ms - send_ms, command)
+            if send_ms:
+                metrics.observe("send", send_ms, command)
+            try:
+                _current_command.reset(token)
+            except ValueError:
+                # 生成器在其他上下文中被关闭
+                pass
+    
+    return wrapper
+
+class Param:
+    """指令参数定义
+    
+    mode 为 "token" 时取下一个空格分隔的参数，为 "rest" 时取剩余全部文本；
+    prefix 不为空时参数必须以该前缀开头。missing/invalid 为缺少参数和格式错误时的提示，
+    missing 为空时按指令的 usage 提示完整格式。index 为 CatalogueIndex 中的类别，执行前按图鉴校验名称。
+    """
+    
+    __slots__ = ("name", "mode", "required", "default", "prefix", "missing", "invalid", "index")
+    
+    def __init__(self, name, mode="token", required=False, default=None, prefix=None, missing=None, invalid=None,
+                 index=None):
+        self.name = name
+        self.mode = mode
+        self.required = required
+        self.default = default
+        self.prefix = prefix
+        self.missing = missing
+        self.invalid = invalid
+        self.index = index
+
+class Listing:
+    """格式化函数返回的列表结果，由执行流程按页码截取后输出"""
+    
+    __slots__ = ("title", "entries", "empty", "command")
+    
+    def __init__(self, title, entries, empty, command):
+        self.title = title
+        self.entries = entries
+        self.empty = empty
+        self.command = command
+    
+    def page(self, page, page_size):
+        if not self.entries:
+            return f"{self.title}\n\n{self.empty}"
+        
+        total_pages = (len(self.entries) + page_size - 1) // page_size
+        page = min(max(page, 1), total_pages)
+        start = (page - 1) * page_size
+        text = f"{self.title}\n\n" + "".join(self.entries[start:start + page_size]).rstrip("\n")
+        if total_pages > 1:
+            text += f"\n\n📄 第{page}/{total_pages}页"
+            if page < total_pages:
+                text += f"，发送“{self.command} 第{page + 1}页”查看下一页"
+        return text
+
+class CommandSpec:
+    """声明式指令定义：指令名、别名、参数与响应格式化函数
+    
+    aliases 为 {别名: 隐含参数}，如“领取任务”隐含参数“领取”。
+    每条指令预编译一个正则，一次匹配即可去掉消息开头的指令名或别名。
+    formatter 为 None 时直接输出上游返回的 message，返回 Listing 时分页输出。
+    paged 与 catalogue 为 True 或第一个参数（操作类型）的取值集合：
+    paged 命中时末尾的“第N页”或“pN”作为页码；末尾的纯数字只在不会被当作自由文本参数时才作为页码，
+    如“日志 2”“背包 3”“拍卖行 搜索 回气丹 2”，而“拍卖行 搜索 100”搜索的是“100”。
+    catalogue 命中时结果为各用户共享的目录数据。
+    local 为 (图鉴索引, 参数) -> 响应 的函数，返回 None 以外的值时不请求上游。
+    """
+    
+    _PAGE_RE = re.compile(r"第(\d+)页|[pP](\d+)")
+    
+    def __init__(self, name, aliases=None, params=(), formatter=None, usage=None, paged=None, catalogue=None,
+                 local=None):
+        self.name = name
+        self.aliases = dict(aliases or {})
+        self.params = tuple(params)
+        self.formatter = formatter
+        self.usage = usage
+        self.paged = paged
+        self.catalogue = catalogue
+        self.local = local
+        self.indexed = tuple(param for param in self.params if param.index)
+        names = sorted([name, *self.aliases], key=len, reverse=True)
+        self._pattern = re.compile(r"\s*(" + "|".join(map(re.escape, names)) + r")\s*")
+        # 自由文本参数之前的参数个数，末尾数字前至少要有这么多词才不会被自由文本参数吸收
+        self._rest_index = next((i for i, param in enumerate(self.params) if param.mode == "rest"), None)
+    
+    def parse(self, message):
+        """解析消息中的参数，返回 (参数字典, 错误提示)"""
+        match = self._pattern.match(message or "")
+        if match:
+            implied = self.aliases.get(match.group(1), "")
+            rest = message[match.end():].strip()
+            rest = f"{implied} {rest}".strip() if implied else rest
+        else:
+            rest = (message or "").strip()
+        
+        params = {}
+        if self.paged:
+            tokens = rest.split()
+            page = self._page_number(tokens)
+            if page is not None and self._selects(self.paged, tokens[:-1]):
+                params["page"] = page
+                rest = " ".join(tokens[:-1])
+        
+        for param in self.params:
+            if param.mode == "rest":
+                value, rest = rest, ""
+            else:
+                value, _, rest = rest.partition(" ")
+                rest = rest.strip()
+            value = value or param.default
+            if not value:
+                if param.required:
+                    return None, param.missing or f"请输入完整参数！格式：{self.usage}"
+                continue
+            if param.prefix and not value.startswith(param.prefix):
+                return None, param.invalid
+            params[param.name] = value
+        return params, None
+    
+    def _page_number(self, tokens):
+        if not tokens:
+            return None
+        match = self._PAGE_RE.fullmatch(tokens[-1])
+        if match:
+            return int(match.group(1) or match.group(2))
+        if not tokens[-1].isdigit():
+            return None
+        if self._rest_index is None or len(tokens) - 1 > self._rest_index:
+            return int(tokens[-1])
+        # 只有一个数字时，有默认值的操作类型（如“背包 3”中的查看）不会是数字，数字即页码
+        first = self.params[0]
+        if len(tokens) == 1 and first.mode == "token" and first.default:
+            return int(tokens[-1])
+        return None
+    
+    def is_catalogue(self, params):
+        """判断本次请求的结果是否为各用户共享的目录数据"""
+        first = self.params[0].name if self.params else None
+        return self._selects(self.catalogue, [params[first]] if first in params else [])
+    
+    def _selects(self, selector, tokens):
+        """判断 paged/catalogue 是否适用于以 tokens 开头的参数"""
+        if selector is True:
+            return True
+        if not selector:
+            return False
+        action_type = tokens[0] if tokens else self.params[0].default
+        return action_type in selector
+
+def _format_meditate(response, data, params):
+    return f"""🧘‍♀️ 打坐修炼成功！
+
+获得斗气：20点
+当前斗气：{data.get('当前斗气')}
+当前境界：{data.get('境界')}
+剩余体力：{data.get('剩余体力')}
+
+⏰ 冷却时间：10分钟"""
+
+def _format_breakthrough(response, data, params):
+    return f"""🚀 突破成功！
+
+当前境界：{data.get('当前境界')}
+剩余斗气：{data.get('剩余斗气')}
+当前等级：{data.get('等级')}
+突破成功率：{data.get('突破成功率')}
+消耗体力：{data.get('消耗体力')}
+剩余体力：{data.get('剩余体力')}
+"""
+
+def _format_seclusion(response, data, params):
+    return f"""🏯 闭关修炼成功！
+
+闭关时长：{data.get('闭关时长')}
+获得斗气：{data.get('当前斗气', 0) - (data.get('当前斗气', 0) - int(data.get('闭关时长', '0分钟').split('分钟')[0]))}
+当前斗气：{data.get('当前斗气')}
+当前境界：{data.get('境界')}
+消耗体力：{data.get('消耗体力')}
+剩余体力：{data.get('剩余体力')}
+
+⏰ 冷却时间：2小时"""
+
+def _format_friends(response, data, params):
+    entries = [
+        f"- {friend.get('用户名')}\n"
+        f"  境界：{friend.get('境界')}\n"
+        f"  等级：{friend.get('等级')}\n"
+        f"  修为值：{friend.get('修为值')}\n\n"
+        for friend in data.get("道友列表", [])
+    ]
+    return Listing(f"👥 道友列表（共{data.get('道友数量', len(entries))}人）", entries, "暂无道友", "道友")
+
+def _format_duel(response, data, params):
+    return f"""⚔️ 切磋结果
+
+{response.get('message')}
+
+=== 切磋双方 ===
+挑战者：{data.get('切磋双方', {}).get('挑战者')}
+应战者：{data.get('切磋双方', {}).get('应战者')}
+
+=== 胜负结果 ===
+{data.get('胜负结果')}
+
+=== 战斗详情 ===
+你的修为：{data.get('战斗详情', {}).get('你的修为')}
+对手修为：{data.get('战斗详情', {}).get('对手修为')}
+
+战斗值：
+你的战斗值：{data.get('战斗详情', {}).get('战斗值', {}).get('你的战斗值')}
+对手战斗值：{data.get('战斗详情', {}).get('战斗值', {}).get('对手战斗值')}
+
+=== 当前战绩 ===
+胜利：{data.get('当前战绩', {}).get('胜利')}
+失败：{data.get('当前战绩', {}).get('失败')}
+
+⏰ 冷却时间：5分钟"""
+
+def _format_give(response, data, params):
+    return f"""🎁 赠送成功！
+
+{response.get('message')}
+
+赠送对象：{data.get('赠送对象')}
+赠送物品：{data.get('赠送物品')}
+赠送数量：{data.get('赠送数量')}
+你的剩余：{data.get('你的剩余')}
+对方获得：{data.get('对方获得')}
+
+⏰ 冷却时间：10分钟"""
+
+def _format_task(response, data, params):
+    if params.get("action_type") != "列表":
+        return response.get('message', '操作成功')
+    
+    # 生成任务列表文本
+    task_list = data.get("任务列表", [])
+    task_text = f"""📋 任务列表
+
+{response.get('message')}
+
+"""
+    for task in task_list:
+        task_text += f"🎯 {task.get('name')}\n"
+        task_text += f"   描述：{task.get('description')}\n"
+        task_text += f"   奖励：斗气{task.get('reward', {}).get('斗气', 0)}，灵石{task.get('reward', {}).get('灵石', 0)}，经验{task.get('reward', {}).get('经验', 0)}\n\n"
+    return task_text
+
+def _format_backpack(response, data, params):
+    if params.get("action_type") != "查看":
+        return response.get('message', '操作成功')
+    
+    # 生成背包物品列表
+    entries = [f"- {item}: {count}\n" for item, count in data.get("背包物品", {}).items()]
+    title = f"🎒 背包物品\n\n{response.get('message')}\n\n物品数量：{data.get('物品数量', 0)}"
+    return Listing(title, entries, "背包中暂无物品", "背包")
+
+def _format_sign_in(response, data, params):
+    return f"""📅 签到成功！
+
+{response.get('message')}
+
+签到日期：{data.get('签到日期')}
+连续签到天数：{data.get('连续签到天数')}天
+
+=== 获得奖励 ===
+斗气：{data.get('获得奖励', {}).get('斗气', 0)}
+灵石：{data.get('获得奖励', {}).get('灵石', 0)}
+经验：{data.get('获得奖励', {}).get('经验', 0)}
+
+⏰ 冷却时间：24小时"""
+
+def _format_log(response, data, params):
+    entries = [
+        f"⏰ {log.get('时间')} - {log.get('类型')}\n"
+        f"   {log.get('内容')}\n\n"
+        for log in data.get("日志列表", [])
+    ]
+    title = f"📋 修炼日志\n\n{response.get('message')}\n\n日志数量：{data.get('日志数量', 0)}"
+    return Listing(title, entries, "暂无日志", "日志")
+
+def _format_rewards(title, name_label):
+    """探索、副本共用的奖励格式"""
+    def formatter(response, data, params):
+        text = f"""{title}
+
+{response.get('message')}
+
+{name_label}：{data.get(name_label)}
+
+=== 获得奖励 ===
+"""
+        # 处理获得的奖励
+        rewards = data.get('获得奖励', {})
+        for reward_type, amount in rewards.items():
+            text += f"{reward_type}：{amount}\n"
+        
+        text += f"\n消耗体力：{data.get('消耗体力')}\n"
+        text += f"剩余体力：{data.get('剩余体力')}"
+        return text
+    return formatter
+
+def _format_escape(response, data, params):
+    return f"""🏃 逃跑结果
+
+{response.get('message')}
+
+逃跑成功率：{data.get('逃跑成功率')}
+结果：{data.get('结果')}"""
+
+def _format_collect(response, data, params):
+    return f"""🌿 采集成功！
+
+{response.get('message')}
+
+采集药材：{data.get('采集药材')}
+获得数量：{data.get('获得数量')}株
+
+消耗体力：{data.get('消耗体力')}
+剩余体力：{data.get('剩余体力')}"""
+
+def _format_refine(response, data, params):
+    refine_text = f"""⚗️ 炼制结果
+
+{response.get('message')}
+
+丹药名称：{data.get('丹药名称')}
+炼制结果：{data.get('炼制结果')}
+获得数量：{data.get('获得数量')}
+
+=== 消耗材料 ===
+"""
+    
+    # 处理消耗的材料
+    consumed = data.get('消耗材料', {})
+    for material, amount in consumed.items():
+        refine_text += f"{material}：{amount}\n"
+    
+    refine_text += f"\n消耗体力：{data.get('消耗体力')}\n"
+    refine_text += f"剩余体力：{data.get('剩余体力')}"
+    return refine_text
+
+# 丹方、学习功法、升级功法、技能、宗门、宗门任务、拍卖行未在 DEPLOYMENT.md 中记录，
+# 以下请求参数与响应字段是按已有指令（任务、背包、炼制）的风格假定的，benchmarks/mock_api.py 按同样的格式实现：
+#   丹方 [pill]                    -> {丹方列表: [{丹药名称, 品阶, 所需材料: {材料: 数量}, 成功率, 功效}]}，带 pill 时为单个丹方
+#   学习功法/升级功法 skill        -> {功法名称, 功法等级, 消耗灵石, 剩余灵石}
+#   技能                           -> {技能数量, 技能列表: [{名称, 等级, 类型, 描述}]}
+#   宗门 action_type [sect_name]   -> 信息：{宗门名称, 宗主, 宗门等级, 成员数量, 成员列表: [{用户名, 职位, 贡献}]}
+#   宗门任务 action_type [task_id] -> 列表：{任务列表: [{name, description, reward}]}（与任务相同）
+#   拍卖行 action_type [item]      -> 搜索：{拍卖列表: [{编号, 物品, 数量, 价格, 卖家}]}
+# 响应中缺少假定的字段时只输出上游返回的 message。
+
+def _format_materials(materials):
+    return "，".join(f"{name}x{count}" for name, count in materials.items()) or "无"
+
+def _format_recipe(response, data, params):
+    if "丹方列表" not in data and "丹药名称" not in data:
+        return response.get('message', '操作成功')
+    if "pill" not in params:
+        entries = [
+            f"💊 {recipe.get('丹药名称')}（{recipe.get('品阶')}）\n"
+            f"   材料：{_format_materials(recipe.get('所需材料', {}))}\n\n"
+            for recipe in data.get("丹方列表", [])
+        ]
+        return Listing("📜 丹方列表", entries, "暂无丹方", "丹方")
+    
+    return f"""📜 丹方：{data.get('丹药名称')}
+
+品阶：{data.get('品阶')}
+所需材料：{_format_materials(data.get('所需材料', {}))}
+成功率：{data.get('成功率')}
+功效：{data.get('功效')}"""
+
+def _local_recipe(catalogue, params):
+    """图鉴索引就绪后丹方查询直接使用本地数据"""
+    if not catalogue.ready:
+        return None
+    if "pill" in params:
+        data = catalogue.recipes.get(params["pill"])
+        if data is None:
+            return None
+    else:
+        data = {"丹方列表": list(catalogue.recipes.values())}
+    return {"code": 200, "message": "成功", "data": data}
+
+def _format_skill_change(title):
+    """学习功法、升级功法共用的结果格式"""
+    def formatter(response, data, params):
+        if "功法名称" not in data:
+            return response.get('message', '操作成功')
+        return f"""{title}
+
+{response.get('message')}
+
+功法名称：{data.get('功法名称')}
+功法等级：{data.get('功法等级')}
+消耗灵石：{data.get('消耗灵石')}
+剩余灵石：{data.get('剩余灵石')}"""
+    return formatter
+
+def _format_skills(response, data, params):
+    if "技能列表" not in data:
+        return response.get('message', '操作成功')
+    entries = [
+        f"✨ {skill.get('名称')} Lv.{skill.get('等级')}（{skill.get('类型')}）\n"
+        f"   {skill.get('描述')}\n\n"
+        for skill in data.get("技能列表", [])
+    ]
+    return Listing(f"✨ 技能列表（共{data.get('技能数量', len(entries))}个）", entries, "暂无技能", "技能")
+
+def _format_sect(response, data, params):
+    if params.get("action_type") != "信息" or "成员列表" not in data:
+        return response.get('message', '操作成功')
+    
+    entries = [
+        f"- {member.get('用户名')}（{member.get('职位')}） 贡献：{member.get('贡献')}\n"
+        for member in data.get("成员列表", [])
+    ]
+    title = f"""🏯 {data.get('宗门名称')}
+
+宗主：{data.get('宗主')}
+宗门等级：{data.get('宗门等级')}
+成员数量：{data.get('成员数量')}
+
+=== 成员列表 ==="""
+    return Listing(title, entries, "暂无成员", "宗门 信息")
+
+def _format_sect_task(response, data, params):
+    if params.get("action_type") != "列表" or "任务列表" not in data:
+        return response.get('message', '操作成功')
+    
+    task_text = f"""📋 宗门任务
+
+{response.get('message')}
+
+"""
+    for task in data.get("任务列表", []):
+        task_text += f"🎯 {task.get('name')}\n"
+        task_text += f"   描述：{task.get('description')}\n"
+        task_text += f"   奖励：宗门贡献{task.get('reward', {}).get('贡献', 0)}，灵石{task.get('reward', {}).get('灵石', 0)}\n\n"
+    return task_text
+
+def _format_auction(response, data, params):
+    if params.get("action_type") != "搜索" or "拍卖列表" not in data:
+        return response.get('message', '操作成功')
+    
+    entries = [
+        f"🔖 [{listing.get('编号')}] {listing.get('物品')} x{listing.get('数量')}\n"
+        f"   价格：{listing.get('价格')}灵石  卖家：{listing.get('卖家')}\n\n"
+        for listing in data.get("拍卖列表", [])
+    ]
+    keyword = params.get("item")
+    command = f"拍卖行 搜索 {keyword}" if keyword else "拍卖行 搜索"
+    return Listing("🏛️ 拍卖行", entries, "暂无拍卖物品", command)
+
+def _format_schedule_time(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime("%m-%d %H:%M")
+
+# 指令注册表。带图片输出的指令（帮助、状态、个人信息、排行榜）只使用其中的别名定义
+COMMAND_SPECS = {spec.name: spec for spec in (
+    CommandSpec("斗破帮助", aliases={"帮助": "", "斗破指令": "", "斗气帮助": "", "斗气指令": ""}),
+    CommandSpec("创建角色", aliases={"注册": "", "开始斗气": ""}),
+    CommandSpec(
+        "绑定角色", aliases={"找回角色": ""},
+        params=[Param("username", required=True)], usage="绑定角色 原用户名",
+    ),
+    CommandSpec("状态", aliases={"我的状态": "", "查看状态": ""}),
+    CommandSpec("个人信息", aliases={"信息": "", "我的信息": ""}),
+    CommandSpec("排行榜", aliases={"排名": "", "榜单": ""}),
+    CommandSpec("打坐", aliases={"修炼": "", "冥想": ""}, formatter=_format_meditate),
+    CommandSpec("突破", aliases={"升级": "", "进阶": ""}, formatter=_format_breakthrough),
+    CommandSpec("调息", aliases={"恢复": "", "休息": ""}),
+    CommandSpec(
+        "闭关", aliases={"深度修炼": ""},
+        # 只取第一个参数作为时长
+        params=[Param("duration")],
+        formatter=_format_seclusion,
+    ),
+    CommandSpec("道友", aliases={"好友": "", "道友列表": ""}, formatter=_format_friends, paged=True),
+    CommandSpec(
+        "切磋", aliases={"比试": "", "挑战": ""},
+        params=[Param("target", required=True, prefix="@",
+                      invalid="切磋对象格式错误！请使用 @用户名 格式，如 @456789")],
+        formatter=_format_duel, usage="切磋 @456789",
+    ),
+    CommandSpec(
+        "赠送", aliases={"送礼": "", "给予": ""},
+        params=[
+            Param("target", required=True, prefix="@",
+                  invalid="赠送对象格式错误！请使用 @用户名 格式，如 @456789"),
+            Param("item", mode="rest", required=True),
+        ],
+        formatter=_format_give, usage="赠送 @456789 灵石x10",
+    ),
+    CommandSpec(
+        "任务", aliases={"任务列表": "列表", "领取任务": "领取", "完成任务": "完成"},
+        params=[Param("action_type", default="列表"), Param("task_id")],
+        formatter=_format_task,
+    ),
+    CommandSpec(
+        "背包", aliases={"背包查看": "查看", "背包整理": "整理", "使用物品": "使用"},
+        params=[Param("action_type", default="查看"), Param("item_name", mode="rest")],
+        formatter=_format_backpack, paged={"查看"},
+    ),
+    CommandSpec("签到", aliases={"每日签到": ""}, formatter=_format_sign_in),
+    CommandSpec("日志", aliases={"修炼日志": "", "战斗日志": ""}, formatter=_format_log, paged=True),
+    CommandSpec(
+        "探索", aliases={"探索地点": ""},
+        params=[Param("location", mode="rest", required=True, missing="请输入探索地点！格式：探索 魔兽山脉",
+                      index="location")],
+        formatter=_format_rewards("🗺️ 探索成功！", "探索地点"),
+    ),
+    CommandSpec(
+        "副本", aliases={"挑战副本": ""},
+        params=[Param("dungeon", mode="rest", required=True, missing="请输入副本名称！格式：副本 天焚炼气塔",
+                      index="dungeon")],
+        formatter=_format_rewards("🏰 副本挑战成功！", "副本名称"),
+    ),
+    CommandSpec("逃跑", aliases={"脱离战斗": ""}, formatter=_format_escape),
+    CommandSpec(
+        "采集", aliases={"采集药材": ""},
+        params=[Param("herb", mode="rest", required=True, missing="请输入要采集的药材名称！格式：采集 凝血草",
+                      index="herb")],
+        formatter=_format_collect,
+    ),
+    CommandSpec(
+        "炼制", aliases={"炼制丹药": ""},
+        params=[Param("pill", mode="rest", required=True, missing="请输入要炼制的丹药名称！格式：炼制 筑基灵液",
+                      index="pill")],
+        formatter=_format_refine,
+    ),
+    CommandSpec(
+        "丹方", aliases={"丹药配方": ""},
+        params=[Param("pill", mode="rest", index="pill")],
+        formatter=_format_recipe, paged=True, catalogue=True, local=_local_recipe,
+    ),
+    CommandSpec(
+        "学习功法",
+        params=[Param("skill", mode="rest", required=True, missing="请输入功法名称！格式：学习功法 焚决")],
+        formatter=_format_skill_change("📖 功法学习成功！"),
+    ),
+    CommandSpec(
+        "升级功法",
+        params=[Param("skill", mode="rest", required=True, missing="请输入功法名称！格式：升级功法 焚决")],
+        formatter=_format_skill_change("📈 功法升级成功！"),
+    ),
+    CommandSpec("技能", aliases={"我的技能": "", "功法列表": ""}, formatter=_format_skills, paged=True),
+    CommandSpec(
+        "宗门", aliases={"宗门信息": "信息"},
+        params=[Param("action_type", default="信息"), Param("sect_name", mode="rest")],
+        formatter=_format_sect, paged={"信息"},
+    ),
+    CommandSpec(
+        "宗门任务",
+        params=[Param("action_type", default="列表"), Param("task_id")],
+        formatter=_format_sect_task,
+    ),
+    CommandSpec(
+        "拍卖行", aliases={"拍卖": "", "拍卖搜索": "搜索"},
+        params=[Param("action_type", default="搜索"), Param("item", mode="rest")],
+        formatter=_format_auction, paged={"搜索"}, catalogue={"搜索"},
+    ),
+    CommandSpec("我的排名", aliases={"排名查询": ""}),
+    # 管理员指令
+    CommandSpec("斗气渲染状态"),
+    CommandSpec("斗气存储状态"),
+    CommandSpec("斗气性能统计", params=[Param("option")], usage="斗气性能统计 [导出/重置]"),
+    CommandSpec("全群状态", aliases={"群状态": ""}),
+    # 定时任务由插件本地管理，只使用其中的参数定义
+    CommandSpec(
+        "自动", aliases={"自动修炼": "", "取消自动": "取消"},
+        params=[Param("operation", default="列表"), Param("action")],
+    ),
+)}
+
+def command_filter(name):
+    """按注册表中的指令名与别名注册 AstrBot 指令"""
+    spec = COMMAND_SPECS[name]
+    return filter.command(name, alias=set(spec.aliases))
+
+@register("literary_battle_qi", "author", "文字斗气机器人插件", "1.0.0")
+class LiteraryBattleQiBot(Star):
+    def __init__(self, context, config=None):
+        super().__init__(context)
+        self.config = config or {}
+        # 各模板的截图参数
+        profiles = self.config.get("render_profiles") or {}
+        self._render_options = {
+            name: build_render_options({**DEFAULT_RENDER_PROFILE, **(profiles.get(name) or {})})
+            for name in RENDER_PROFILE_NAMES
+        }
+        self.client = self._create_client()
+        self._breaker = CircuitBreaker(
+            self._get_config("circuit_breaker", "failure_threshold", 5),
+            self._get_config("circuit_breaker", "reset_timeout", 30.0),
+        )
+        # 所有图片的磁盘缓存，按内容哈希命名，重启后继续复用
+        self._render_cache = RenderCache(
+            os.path.join(PLUGIN_DATA_DIR, "render_cache"),
+            max_bytes=int(self._get_config("render", "cache_mb", 64) * 1024 * 1024),
+            policy=self._get_config("render", "cache_policy", "lru"),
+        )
+        # 帮助菜单图片：内容不变时只渲染一次
+        self._menu_image = None
+        self._menu_lock = asyncio.Lock()
+        # 排行榜共享缓存：{"data", "expires_at", "render"}，render 为该份数据的渲染任务
+        self._ranking_cache = None
+        self._ranking_lock = asyncio.Lock()
+        # 每位玩家最近一次渲染的模板输入与图片：{(模板, 用户名): (模板输入, 查询时间, 图片路径)}
+        self._last_rendered = OrderedDict()
+        # 进行中的只读请求，相同请求并发时共享同一次上游调用与渲染
+        self._inflight = {}
+        # 丹方、拍卖行等共享目录数据：{(指令, 参数): (过期时间, 响应)}
+        self._catalogue_cache = {}
+        # 图鉴索引，持久化到磁盘，重启后无需等待刷新即可校验名称
+        self._catalogue_path = os.path.join(PLUGIN_DATA_DIR, "catalogue.json")
+        self._catalogue = CatalogueIndex()
+        self._catalogue_next_refresh = 0.0
+        self._catalogue_task = None
+        # 列表类指令每页条目数
+        self._page_size = max(1, int(self._get_config("display", "page_size", 10)))
+        # 每位玩家最近查看的分页列表：{用户名: (过期时间, (指令, 参数), 列表, 快照提示)}，翻页时直接截取
+        self._listing_cache = {}
+        # QQ号到注册用户名的映射，昵称变化后仍登录原账号；定时任务也由此取得登录所需的QQ号
+        self._identities = IdentityMap(os.path.join(PLUGIN_DATA_DIR, "identities.json"))
+        # 定时自动执行的打坐、调息、签到
+        self._schedule_enabled = bool(self._get_config("schedule", "enabled", True))
+        self._schedule_notify = self._get_config("schedule", "notify", "failure")
+        self._scheduler = ActionScheduler(
+            self._run_scheduled,
+            os.path.join(PLUGIN_DATA_DIR, "scheduled_jobs.json"),
+            self._get_config("schedule", "concurrency", 8),
+            self._get_config("schedule", "batch_size", 200),
+            self._get_config("schedule", "max_jobs", 50000),
+        )
+        # 玩家快照
+        self._snapshots = None
+        if self._get_config("storage", "enabled", True):
+            self._snapshots = SnapshotStore(
+                os.path.join(PLUGIN_DATA_DIR, "snapshots.db"),
+                self._get_config("storage", "max_mb", 64) * 1024 * 1024,
+                self._get_config("storage", "flush_interval", 1.0),
+            )
+        self._stale_after = self._get_config("storage", "stale_after_ms", 1500) / 1000
+        # 全群状态
+        self._group_concurrency = self._get_config("group_status", "concurrency", 5)
+        self._group_fresh_seconds = self._get_config("group_status", "fresh_seconds", 300)
+        self._group_max_members = self._get_config("group_status", "max_members", 50)
+        # 玩家名次索引，首次查询名次时载入本地快照；昨日名次用于计算名次变化
+        self._rank_index = RankIndex()
+        self._rank_index_loaded = False
+        self._rank_index_lock = asyncio.Lock()
+        self._rank_history_path = os.path.join(PLUGIN_DATA_DIR, "rank_history.json")
+        self._rank_day, self._rank_baseline = self._load_rank_history()
+        # 本地冷却记录，以及正在请求上游的 (用户名, QQ号, 指令)
+        self._cooldowns = CooldownTracker()
+        self._cooldown_pending = set()
+        # 各指令的分阶段耗时统计
+        self._metrics = Metrics(bool(self._get_config("metrics", "enabled", True)))
+        # 浏览器渲染调度
+        self._render_scheduler = RenderScheduler(
+            self._get_config("render", "concurrency", 2),
+            self._get_config("render", "max_queue", 20),
+            self._get_config("render", "timeout", 20.0),
+            self._get_config("render", "degrade_latency_ms", 8000) / 1000,
+            self._get_config("render", "degrade_queue_depth", 10),
+            self._get_config("render", "degrade_window", 60.0),
+        )
+        # 图片中查询时间的显示方式：round 按时间段取整，caption 不写入图片而随图片发送文字，exact 精确到秒
+        self._timestamp_mode = self._get_config("render", "timestamp", "round")
+        self._timestamp_round = max(1, self._get_config("render", "timestamp_round", 300))
+        # 图片缓存、图鉴、身份记录与定时任务在启动任务中载入，不在构造时阻塞事件循环
+        self._load_task = None
+    
+    async def initialize(self):
+        """AstrBot 实例化插件后调用：在后台载入磁盘上的数据"""
+        await self._ensure_loaded()
+    
+    def _ensure_loaded(self):
+        """启动载入任务（只执行一次），返回可等待其完成的对象；指令处理前都会等待载入完成"""
+        if self._load_task is None:
+            self._load_task = asyncio.ensure_future(self._load_state())
+        return asyncio.shield(self._load_task)
+    
+    async def _load_state(self):
+        loop = asyncio.get_running_loop()
+        # 扫描图片缓存目录并删除索引之外的文件
+        await loop.run_in_executor(None, self._render_cache.load)
+        await loop.run_in_executor(None, self._catalogue.load, self._catalogue_path)
+        self._catalogue_next_refresh = self._catalogue.fetched_at + CATALOGUE_REFRESH_INTERVAL
+        await loop.run_in_executor(None, self._identities.load)
+        if self._schedule_enabled:
+            await self._scheduler.load()
+            self._scheduler.start()
+    
+    def _get_config(self, section, key, default):
+        """读取插件配置项，未配置时返回默认值"""
+        value = (self.config.get(section) or {}).get(key)
+        return default if value is None else value
+    
+    def _create_client(self):
+        """根据插件配置创建共享的HTTP客户端"""
+        limits = httpx.Limits(
+            max_connections=self._get_config("http", "max_connections", 100),
+            max_keepalive_connections=self._get_config("http", "max_keepalive_connections", 20),
+            keepalive_expiry=self._get_config("http", "keepalive_expiry", 30.0),
+        )
+        timeout = httpx.Timeout(
+            connect=self._get_config("http", "connect_timeout", 5.0),
+            read=self._get_config("http", "read_timeout", 10.0),
+            write=self._get_config("http", "write_timeout", 10.0),
+            pool=self._get_config("http", "pool_timeout", 5.0),
+        )
+        http2 = bool(self._get_config("http", "http2", False))
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("未安装 h2，HTTP/2 已禁用，请执行 pip install httpx[http2]")
+                http2 = False
+        
+        return httpx.AsyncClient(limits=limits, timeout=timeout, http2=http2)
+    
+    def _backoff_delay(self, attempt):
+        """第 attempt 次重试前的等待时间（指数退避 + 全抖动）"""
+        base = self._get_config("retry", "backoff_base", 0.3)
+        cap = self._get_config("retry", "backoff_max", 3.0)
+        return random.uniform(0, min(cap, base * (2 ** attempt)))
+    
+    async def _single_flight(self, key, factory):
+        """相同 key 的调用并发进行时只执行一次 factory()，所有调用方共享结果"""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            
+            def _done(finished_task):
+                if self._inflight.get(key) is finished_task:
+                    del self._inflight[key]
+            
+            task.add_done_callback(_done)
+        # 某个调用方被取消时不影响其他等待同一结果的调用方
+        return await asyncio.shield(task)
+    
+    async def _call_api(self, action, params):
+        """调用API的通用方法，相同的只读请求并发时合并为一次上游调用"""
+        if action in SNAPSHOT_ACTIONS and self._snapshots:
+            return await self._call_snapshot_api(action, params)
+        
+        if action in IDEMPOTENT_ACTIONS:
+            key = ("api", action, tuple(sorted(params.items())))
+            response = await self._single_flight(key, lambda: self._request_api(action, params))
+        else:
+            response = await self._request_api(action, params)
+        self._metrics.incr(f"code_{response.get('code')}")
+        
+        if response.get("code") == 200 and "password" in params:
+            # 记录该QQ号实际使用的用户名，注册时以新注册的用户名为准
+            self._identities.record(params["password"], params["username"], replace=action == "创建角色")
+        if response.get("code") == 200 and self._snapshots and action in SNAPSHOT_MUTATING_ACTIONS:
+            await self._patch_snapshots(action, params["password"], params["username"], response.get("data") or {})
+        return response
+    
+    async def _call_snapshot_api(self, action, params):
+        """查询保存快照的指令
+        
+        状态、个人信息在上游耗时超过 storage.stale_after_ms 时先用快照回复，上游的结果在后台写入快照；
+        上游不可用时同样用快照回复。
+        """
+        key = ("api", action, tuple(sorted(params.items())))
+        fetch = asyncio.ensure_future(self._single_flight(key, lambda: self._fetch_snapshot(action, params)))
+        response = None
+        if action in STALE_WHILE_REVALIDATE_ACTIONS and self._stale_after > 0:
+            try:
+                response = await asyncio.wait_for(asyncio.shield(fetch), self._stale_after)
+            except asyncio.TimeoutError:
+                snapshot = await self._snapshots.get(params["password"], params["username"], action)
+                if snapshot:
+                    self._metrics.incr("snapshot_stale")
+                    return self._snapshot_response(snapshot, "slow")
+        if response is None:
+            response = await fetch
+        self._metrics.incr(f"code_{response.get('code')}")
+        
+        if response.get("code") in (500, 503):
+            # 上游不可用时用最近一次的快照回复
+            snapshot = await self._snapshots.get(params["password"], params["username"], action)
+            if snapshot:
+                self._metrics.incr("snapshot_fallback")
+                return self._snapshot_response(snapshot, "unavailable")
+        return response
+    
+    async def _fetch_snapshot(self, action, params):
+        """请求上游并保存快照；调用方已先用快照回复时仍在后台完成"""
+        response = await self._request_api(action, params)
+        if response.get("code") == 200:
+            self._identities.record(params["password"], params["username"])
+            self._snapshots.put(params["password"], params["username"], action, response.get("data"))
+            self._index_player(params["username"], action, response.get("data"))
+        return response
+    
+    @staticmethod
+    def _snapshot_response(snapshot, reason):
+        data, updated_at = snapshot
+        return {"code": 200, "message": "成功", "data": data, "snapshot_time": updated_at, "snapshot_reason": reason}
+    
+    def _snapshot_notice(self, response):
+        """回复使用的是本地快照时注明数据的时间，否则为空字符串"""
+        if "snapshot_time" not in response:
+            return ""
+        age = time.time() - response["snapshot_time"]
+        if age < 60:
+            age_text = "1分钟内"
+        elif age < 3600:
+            age_text = f"{int(age // 60)}分钟前"
+        else:
+            age_text = f"{int(age // 3600)}小时前"
+        updated = datetime.fromtimestamp(response["snapshot_time"]).strftime("%m-%d %H:%M")
+        if response.get("snapshot_reason") == "slow":
+            return f"⏳ 服务器响应较慢，以上为{age_text}（{updated}）的数据，最新数据正在后台更新"
+        return f"⚠️ 服务器暂时不可用，以上为{age_text}（{updated}）的数据"
+    
+    async def _patch_snapshots(self, action, user_id, username, data):
+        """修改玩家数据的指令成功后，用返回的字段更新快照，下次查看时无需等待上游也是最新数据"""
+        if action in SNAPSHOT_INVALIDATE_ACTIONS:
+            await self._snapshots.delete(user_id, SNAPSHOT_ACTIONS)
+            return
+        
+        for kind in ("状态", "个人信息"):
+            snapshot = await self._snapshots.get(user_id, username, kind)
+            if snapshot is None or not isinstance(snapshot[0], dict):
+                continue
+            
+            snapshot_data = snapshot[0]
+            patched = False
+            for field, targets in SNAPSHOT_PATCH_FIELDS.items():
+                if field not in data:
+                    continue
+                for target_kind, path in targets:
+                    if target_kind != kind:
+                        continue
+                    node = snapshot_data
+                    for part in path[:-1]:
+                        node = node.setdefault(part, {})
+                    node[path[-1]] = data[field]
+                    patched = True
+            if kind == "个人信息" and action in ACTION_COOLDOWNS:
+                snapshot_data.setdefault("修炼冷却", {})[action] = CooldownTracker.format_remaining(ACTION_COOLDOWNS[action])
+                patched = True
+            if patched:
+                self._snapshots.put(user_id, username, kind, snapshot_data)
+                self._index_player(username, kind, snapshot_data)
+    
+    def _index_player(self, username, kind, data):
+        """更新名次索引：状态、个人信息只提供境界，道友列表与排行榜提供各玩家的境界与修为值"""
+        if kind in ("道友", "排行榜"):
+            field = "道友列表" if kind == "道友" else "排行榜"
+            players = (data.get(field) if isinstance(data, dict) else None) or []
+            entries = [(p["用户名"], p.get("境界"), p.get("修为值")) for p in players
+                       if isinstance(p, dict) and p.get("用户名") and p.get("境界") is not None]
+        else:
+            if kind == "个人信息" and isinstance(data, dict):
+                data = data.get("斗气状态")
+            elif kind != "状态":
+                return
+            if not isinstance(data, dict) or data.get("境界") is None:
+                return
+            # 斗气值是可消耗的斗气，不能与修为值混用，这里只更新境界
+            entries = [(username, data["境界"], None)]
+        
+        if self._rank_index_loaded and entries:
+            # 先记下昨日名次再应用今天的第一次变化
+            self._roll_rank_day()
+        for name, realm, value in entries:
+            self._rank_index.update(name, realm, value)
+    
+    async def _ensure_rank_index(self):
+        """首次查询名次时载入本地保存的所有状态快照与道友列表"""
+        if self._rank_index_loaded:
+            return
+        async with self._rank_index_lock:
+            if self._rank_index_loaded:
+                return
+            if self._snapshots:
+                for username, data in await self._snapshots.scan("状态"):
+                    # 载入期间已更新的玩家以内存中的数据为准
+                    if username not in self._rank_index:
+                        self._index_player(username, "状态", data)
+                for username, data in await self._snapshots.scan("道友"):
+                    for friend in (data.get("道友列表") if isinstance(data, dict) else None) or []:
+                        if isinstance(friend, dict) and not self._rank_index.has_value(friend.get("用户名")):
+                            self._index_player(username, "道友", {"道友列表": [friend]})
+            self._rank_index_loaded = True
+    
+    def _roll_rank_day(self):
+        """跨天后把当前名次记为昨日名次"""
+        today = datetime.now().strftime("%Y-%m-%d")
+        if self._rank_day == today:
+            return
+        if self._rank_day is not None:
+            self._rank_baseline = self._rank_index.ranks()
+        self._rank_day = today
+        try:
+            os.makedirs(PLUGIN_DATA_DIR, exist_ok=True)
+            tmp_path = self._rank_history_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"day": self._rank_day, "baseline": self._rank_baseline}, f, ensure_ascii=False)
+            os.replace(tmp_path, self._rank_history_path)
+        except OSError as e:
+            logger.error(f"昨日名次写入失败：{e}")
+    
+    def _load_rank_history(self):
+        try:
+            with open(self._rank_history_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            return saved.get("day"), saved.get("baseline", {})
+        except FileNotFoundError:
+            return None, {}
+        except (OSError, ValueError) as e:
+            logger.error(f"昨日名次读取失败：{e}")
+            return None, {}
+    
+    async def _restore_cooldowns(self, user_id, username):
+        """本次运行中首次遇到的玩家，用上次保存的个人信息快照推算剩余冷却"""
+        snapshot = await self._snapshots.get(user_id, username, "个人信息") if self._snapshots else None
+        if snapshot:
+            data, updated_at = snapshot
+            self._cooldowns.update_from_info(username, data.get("修炼冷却"), time.time() - updated_at)
+        else:
+            self._cooldowns.track(username)
+    
+    async def _call_catalogue_api(self, action, params):
+        """查询各用户共享的目录数据（丹方、拍卖行列表），缓存期内所有用户复用同一份结果
+        
+        只缓存成功的结果，且只有已在上游登录成功过的玩家可以使用缓存或共享进行中的请求；
+        共享请求以发起者的凭据执行，失败原因不是上游不可用时，其余调用方用自己的凭据重新请求。
+        """
+        shared = tuple(sorted((k, v) for k, v in params.items() if k not in ("username", "password")))
+        key = (action, shared)
+        verified = self._identities.get(params.get("password")) == params.get("username")
+        cached = self._catalogue_cache.get(key)
+        if verified and cached and cached[0] > time.monotonic():
+            self._metrics.incr("catalogue_hit")
+            return cached[1]
+        
+        if verified:
+            flight_key = ("catalogue", key)
+            leader = flight_key not in self._inflight
+            response = await self._single_flight(flight_key, lambda: self._request_api(action, params))
+            if not leader and response.get("code") not in (200, 500, 503):
+                response = await self._request_api(action, params)
+        else:
+            response = await self._request_api(action, params)
+        self._metrics.incr(f"code_{response.get('code')}")
+        if response.get("code") == 200:
+            self._identities.record(params["password"], params["username"])
+            now = time.monotonic()
+            if len(self._catalogue_cache) >= CATALOGUE_CACHE_MAX_ENTRIES:
+                for stale in [k for k, (expires, _) in self._catalogue_cache.items() if expires <= now]:
+                    del self._catalogue_cache[stale]
+            if len(self._catalogue_cache) >= CATALOGUE_CACHE_MAX_ENTRIES:
+                # 仍然已满时丢弃最早写入的一项
+                del self._catalogue_cache[next(iter(self._catalogue_cache))]
+            self._catalogue_cache[key] = (now + CATALOGUE_CACHE_TTL, response)
+        return response
+    
+    async def _call_cooldown_api(self, action, params):
+        """调用有冷却时间的指令，本地记录仍在冷却时直接返回提示，不请求上游"""
+        username = params.get("username")
+        if username not in self._cooldowns:
+            await self._restore_cooldowns(params.get("password"), username)
+        remaining = self._cooldowns.remaining(username, action)
+        if remaining > 0:
+            return {
+                "code": 429,
+                "message": f"{action}冷却中，还需{CooldownTracker.format_remaining(remaining)}",
+            }
+        # 检查与请求之间有等待，先占住冷却，同一玩家并发的同一指令只有一个能请求上游；
+        # 占位包含QQ号，昵称相同的其他QQ号不会占住该玩家的指令
+        slot = (username, params.get("password"), action)
+        if slot in self._cooldown_pending:
+            return {"code": 429, "message": f"{action}正在进行中，请稍候"}
+        
+        self._cooldown_pending.add(slot)
+        try:
+            response = await self._call_api(action, params)
+        finally:
+            self._cooldown_pending.discard(slot)
+        if response.get("code") == 200:
+            self._cooldowns.start(username, action)
+        elif "冷却" in str(response.get("message", "")):
+            # 上游提示仍在冷却时，按提示中的剩余时间校准本地记录
+            seconds = CooldownTracker.parse_duration(str(response.get("message")))
+            if seconds:
+                self._cooldowns.start(username, action, seconds)
+        return response
+    
+    async def _request_api(self, action, params):
+        """向上游发送请求
+        
+        只读指令在连接失败、超时或5xx时按指数退避重试；上游持续失败时熔断，冷却期内直接返回错误
+        """
+        if not self._breaker.allow():
+            return {"code": 503, "message": "服务器暂时不可用，请稍后重试"}
+        
+        attempts = 1
+        if action in IDEMPOTENT_ACTIONS:
+            attempts += self._get_config("retry", "max_retries", 2)
+        
+        for attempt in range(attempts):
+            try:
+                with self._metrics.stage("http"):
+                    response = await self.client.get(API_URL, params={"action": action, **params})
+                response.raise_for_status()
+                with self._metrics.stage("json"):
+                    result = response.json()
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                if isinstance(e, httpx.HTTPStatusError) and e.response.status_code < 500:
+                    # 4xx说明上游在线，只是请求本身有问题，不重试
+                    self._breaker.record_success()
+                    logger.error(f"API请求失败: {e}")
+                    return {"code": 500, "message": "服务器连接失败，请稍后重试"}
+                
+                if attempt + 1 < attempts and self._breaker.state == "closed":
+                    logger.warning(f"API请求失败，准备第{attempt + 1}次重试: {e}")
+                    await asyncio.sleep(self._backoff_delay(attempt))
+                    continue
+                # 重试全部失败后才计一次失败，熔断阈值按指令次数而非请求次数计算
+                self._breaker.record_failure()
+                logger.error(f"API请求失败: {e}")
+                return {"code": 500, "message": "服务器连接失败，请稍后重试"}
+            except httpx.HTTPError as e:
+                self._breaker.record_failure()
+                logger.error(f"API请求失败: {e}")
+                return {"code": 500, "message": "服务器连接失败，请稍后重试"}
+            except Exception as e:
+                # 响应格式错误（如非JSON）说明上游工作不正常，计为失败，不能当作健康的请求重置熔断器
+                self._breaker.record_failure()
+                logger.error(f"API处理失败: {e}")
+                return {"code": 500, "message": "服务器内部错误，请稍后重试"}
+            
+            self._breaker.record_success()
+            return result
+    
+    def _credentials(self, event):
+        """用户名用注册时的QQ名（不超过12位），密码用QQ号；群聊中顺便记录群成员，供全群状态使用"""
+        password = str(event.message_obj.sender.user_id)
+        username = self._identities.get(password) or event.get_sender_name()[:12]
+        group_id = event.get_group_id()
+        if group_id and self._snapshots:
+            self._snapshots.touch_member(str(group_id), password, username)
+        return username, password
+    
+    async def _run_command(self, action, event):
+        """按注册表执行指令：解析参数、调用API并格式化响应"""
+        spec = COMMAND_SPECS[action]
+        params, error = spec.parse(event.message_str)
+        if error:
+            return f"❌ {error}"
+        
+        page = params.pop("page", None)
+        username, password = self._credentials(event)
+        notice = ""
+        if spec.indexed or spec.local:
+            self._refresh_catalogue(username, password)
+            notice, error = self._resolve_names(spec, params)
+            if error:
+                return f"❌ {error}"
+        
+        listing_key = (action, tuple(sorted(params.items())))
+        if page is not None:
+            # 翻页时使用刚才查询的列表，不再请求上游
+            cached = self._listing_cache.get(username)
+            if cached and cached[1] == listing_key and cached[0] > time.monotonic():
+                self._metrics.incr("listing_hit")
+                return notice + self._page_listing(cached[2], page, cached[3])
+        
+        params = {"username": username, "password": password, **params}
+        local = spec.local(self._catalogue, params) if spec.local else None
+        if local is not None:
+            response = local
+        elif action in ACTION_COOLDOWNS:
+            response = await self._call_cooldown_api(action, params)
+        elif spec.is_catalogue(params):
+            response = await self._call_catalogue_api(action, params)
+        else:
+            response = await self._call_api(action, params)
+        
+        if response.get("code") != 200:
+            return self._format_response(response)
+        # 指令可能改变背包、日志等内容，丢弃该玩家缓存的列表
+        self._listing_cache.pop(username, None)
+        self._learn_names(spec, params)
+        if spec.formatter is None:
+            return notice + self._format_response(response)
+        result = spec.formatter(response, response.get("data") or {}, params)
+        stale = self._snapshot_notice(response)
+        if isinstance(result, Listing):
+            self._cache_listing(username, listing_key, result, stale)
+            return notice + self._page_listing(result, page or 1, stale)
+        if stale:
+            result = f"{result.rstrip()}\n\n{stale}"
+        return notice + result
+    
+    def _page_listing(self, listing, page, stale):
+        text = listing.page(page, self._page_size)
+        return f"{text}\n\n{stale}" if stale else text
+    
+    def _cache_listing(self, username, key, listing, stale):
+        """缓存玩家最近查看的列表，已满时先清理过期项，仍然已满时丢弃最早写入的一项"""
+        now = time.monotonic()
+        if len(self._listing_cache) >= LISTING_CACHE_MAX_ENTRIES:
+            for expired in [user for user, entry in self._listing_cache.items() if entry[0] <= now]:
+                del self._listing_cache[expired]
+        if len(self._listing_cache) >= LISTING_CACHE_MAX_ENTRIES:
+            del self._listing_cache[next(iter(self._listing_cache))]
+        self._listing_cache[username] = (now + LISTING_CACHE_TTL, key, listing, stale)
+    
+    async def _run_scheduled(self, job):
+        """执行一个定时任务，返回距下次执行的秒数，返回 None 时取消任务"""
+        action = job["action"]
+        response = await self._call_cooldown_api(action, {"username": job["username"], "password": job["user_id"]})
+        job["last_run"] = time.time()
+        job["last_result"] = "成功" if response.get("code") == 200 else str(response.get("message", "未知错误"))[:40]
+        if response.get("code") == 200:
+            job["failures"] = 0
+            if self._schedule_notify == "all":
+                await self._notify_scheduled(job, f"自动{action}：{response.get('message', '成功')}")
+            return ACTION_COOLDOWNS[action]
+        
+        # 仍在冷却（包括上游提示的冷却）时等到冷却结束，不计为失败
+        remaining = self._cooldowns.remaining(job["username"], action)
+        if remaining > 0:
+            return remaining + 1
+        
+        job["failures"] += 1
+        if job["failures"] >= SCHEDULE_MAX_FAILURES:
+            logger.warning(f"定时任务连续失败，已取消：{job['username']} {action}")
+            if self._schedule_notify != "none":
+                await self._notify_scheduled(
+                    job, f"自动{action}连续失败{job['failures']}次，已取消：{job['last_result']}"
+                )
+            return None
+        if self._schedule_notify == "all":
+            await self._notify_scheduled(job, f"自动{action}失败：{job['last_result']}")
+        return min(ACTION_COOLDOWNS[action], 60 * 2 ** job["failures"])
+    
+    async def _notify_scheduled(self, job, text):
+        """向登记任务的会话发送执行结果"""
+        origin = job.get("origin")
+        if not origin:
+            return
+        try:
+            await self.context.send_message(origin, MessageChain().message(f"⏰ {job['username']} {text}"))
+        except Exception as e:
+            logger.warning(f"定时任务结果发送失败 {job['username']}: {e}")
+    
+    def _resolve_names(self, spec, params):
+        """按图鉴索引校验并纠正参数中的名称，返回 (纠正提示, 错误提示)"""
+        notices = []
+        for param in spec.indexed:
+            text = params.get(param.name)
+            if not text:
+                continue
+            
+            name, candidates = self._catalogue.resolve(param.index, text)
+            label = CatalogueIndex.LABELS[param.index]
+            if name is None:
+                # 图鉴不完整的类别交给上游判断
+                if self._catalogue.is_authoritative(param.index):
+                    hint = f"，你是不是要找：{'、'.join(candidates)}" if candidates else ""
+                    return "", f"未知的{label}：{text}{hint}"
+            elif name != text:
+                params[param.name] = name
+                notices.append(f"💡 已将“{text}”识别为{label}“{name}”\n\n")
+        return "".join(notices), None
+    
+    def _learn_names(self, spec, params):
+        """上游接受的名称加入图鉴索引"""
+        learned = False
+        for param in spec.indexed:
+            if params.get(param.name):
+                learned |= self._catalogue.learn(param.index, params[param.name])
+        if learned:
+            self._catalogue.save(self._catalogue_path)
+    
+    def _refresh_catalogue(self, username, password):
+        """图鉴索引过期时在后台用当前用户的凭据拉取丹方列表，不阻塞本次指令"""
+        if time.time() < self._catalogue_next_refresh or self._catalogue_task:
+            return
+        # 刷新失败时等待一段时间再重试
+        self._catalogue_next_refresh = time.time() + CATALOGUE_RETRY_DELAY
+        self._catalogue_task = asyncio.ensure_future(self._fetch_catalogue(username, password))
+        
+        def _done(task):
+            self._catalogue_task = None
+        
+        self._catalogue_task.add_done_callback(_done)
+    
+    async def _fetch_catalogue(self, username, password):
+        response = await self._call_catalogue_api("丹方", {"username": username, "password": password})
+        recipes = (response.get("data") or {}).get("丹方列表") if response.get("code") == 200 else None
+        if recipes is None:
+            logger.warning(f"图鉴索引刷新失败：{response.get('message')}")
+            return
+        
+        self._catalogue.update_recipes(recipes)
+        self._catalogue_next_refresh = time.time() + CATALOGUE_REFRESH_INTERVAL
+        self._catalogue.save(self._catalogue_path)
+    
+    def _format_response(self, response):
+        """格式化API响应"""
+        code = response.get("code")
+        message = response.get("message", "未知错误")
+        data = response.get("data")
+        
+        if code == 404 and "角色不存在" in message:
+            # 插件记录身份前已注册、之后又改过QQ昵称的玩家需要手动绑定原来的角色
+            return f"❌ {message}\n如修改过QQ昵称，请发送“绑定角色 原用户名”找回原来的角色"
+        if code != 200:
+            return f"❌ {message}"
+        
+        return message
+    
+    async def _schedule_render(self, tmpl, data, return_url, options, priority=RENDER_PRIORITY_USER):
+        """经渲染调度器调用AstrBot的html_render方法，排队已满或超时时返回None"""
+        with self._metrics.stage("render"):
+            result = await self._render_scheduler.run(
+                lambda: self.html_render(tmpl, data, return_url, options), priority
+            )
+        if result is None:
+            self._metrics.incr("render_skipped")
+        return result
+    
+    def _build_menu_html(self, text):
+        """将帮助文本转换为菜单样式的HTML"""
+        # 将文本内容转换为结构化HTML
+        lines = text.split('\n')
+        html_parts = []
+        
+        # 添加分类标题
+        html_parts.append('<div class="category-title">📚 斗气修炼指令</div>')
+        
+        # 处理指令列表
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('📚') or line.startswith('💡'):
+                continue
+            
+            # 解析指令行
+            if ' - ' in line:
+                command_part, desc_part = line.split(' - ', 1)
+                # 提取指令名称（去除🔹 **和**）
+                command_name = command_part.replace('🔹 **', '').replace('**', '').strip()
+                command_desc = desc_part.strip()
+                
+                # 生成HTML
+                html_parts.append(f'<div class="menu-item">')
+                html_parts.append(f'<span class="command-format">{command_name}</span>')
+                html_parts.append(f'<span class="command-desc"> - {command_desc}</span>')
+                html_parts.append(f'</div>')
+        
+        # 组装最终HTML内容
+        formatted_html = '\n'.join(html_parts)
+        
+        # 渲染HTML模板
+        return MENU_TPL.render({"content": formatted_html})
+    
+    async def text_to_image_menu_style(self, text, *args, **kwargs):
+        """使用菜单样式的HTML模板生成图片"""
+        try:
+            with self._metrics.stage("template"):
+                html_content = self._build_menu_html(text)
+            
+            # 使用html_render函数生成图片
+            options = self._render_options["menu"]
+            
+            # 经渲染调度器调用AstrBot的html_render方法，图片存入磁盘缓存
+            return await self._render_html("menu", html_content, options, RENDER_PRIORITY_SHARED)
+        except Exception as e:
+            logger.error(f"菜单样式图片生成失败：{e}")
+            # 回退到默认的纯文本输出
+            return None
+    
+    async def get_menu_image(self):
+        """获取帮助菜单图片，首次使用时渲染（或从磁盘缓存中取出），之后直接复用"""
+        if self._menu_image and os.path.isfile(self._menu_image):
+            return self._menu_image
+        
+        async with self._menu_lock:
+            # 等待锁期间可能已由其他请求完成渲染
+            if self._menu_image and os.path.isfile(self._menu_image):
+                return self._menu_image
+            
+            self._menu_image = await self.text_to_image_menu_style(HELP_TEXT)
+            return self._menu_image
+    
+    def _render_timestamp(self):
+        """图片页脚中的查询时间
+        
+        round 模式按 timestamp_round 取整，同一时间段内数据未变化时可复用图片；caption 模式不在图片中显示时间
+        """
+        if self._timestamp_mode == "caption":
+            return ""
+        if self._timestamp_mode == "exact":
+            return f"查询时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} | "
+        now = time.time()
+        rounded = datetime.fromtimestamp(now - now % self._timestamp_round)
+        return f"查询时间：{rounded.strftime('%Y-%m-%d %H:%M')} | "
+    
+    def _image_caption(self, response, image_url):
+        """随图片发送的文字：快照提示，caption 模式下另附查询时间"""
+        notice = self._snapshot_notice(response)
+        if notice or not image_url or self._timestamp_mode != "caption":
+            return notice
+        return f"🕒 查询时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+    
+    def _unchanged_render(self, owner, context, query_time):
+        """与该玩家上次渲染时的显示字段逐项比较，均未变化且图片仍在时返回上次的图片"""
+        last = self._last_rendered.get(owner)
+        if last is None or last[1] != query_time or not os.path.isfile(last[2]):
+            return None
+        changed = [field for field, value in context.items() if last[0].get(field) != value]
+        if changed:
+            logger.debug(f"{owner[1]}的{owner[0]}图片需要重新渲染，变化字段：{', '.join(changed)}")
+            return None
+        self._last_rendered.move_to_end(owner)
+        return last[2]
+    
+    async def _render_cached(self, kind, template, context, options):
+        """渲染模板，模板输入相同时复用缓存的图片
+        
+        先与该玩家上次渲染的显示字段比较，再按模板输入哈希查找共享缓存；
+        查询时间按 render.timestamp 取整或移出图片，因此玩家数据未变化时不会重复渲染
+        """
+        query_time = self._render_timestamp()
+        owner = (kind, context.get("username"))
+        image_path = self._unchanged_render(owner, context, query_time)
+        if image_path:
+            self._metrics.incr("render_unchanged")
+            return image_path
+        
+        # 截图参数也参与缓存键，修改配置后不会复用旧参数渲染的图片
+        key = RenderCache.make_key(kind, json.dumps(
+            {**context, "query_time": query_time, "options": options}, ensure_ascii=False, sort_keys=True, default=str
+        ))
+        image_path = self._render_cache.get(key)
+        if image_path:
+            self._remember_render(owner, context, query_time, image_path)
+            return image_path
+        
+        with self._metrics.stage("template"):
+            html_content = template.render({**context, "query_time": query_time})
+        
+        image_path = await self._render_into_cache(key, html_content, options)
+        if image_path:
+            self._remember_render(owner, context, query_time, image_path)
+        return image_path
+    
+    async def _render_html(self, kind, html_content, options, priority=RENDER_PRIORITY_USER):
+        """渲染完整的HTML页面，页面内容与截图参数相同时复用缓存的图片"""
+        key = RenderCache.make_key(kind, html_content + json.dumps(options, sort_keys=True))
+        image_path = self._render_cache.get(key)
+        if image_path:
+            return image_path
+        return await self._render_into_cache(key, html_content, options, priority)
+    
+    async def _render_into_cache(self, key, html_content, options, priority=RENDER_PRIORITY_USER):
+        # 经渲染调度器调用AstrBot的html_render方法，渲染为本地文件后移入图片缓存
+        image_path = await self._schedule_render(
+            html_content,  # 渲染后的HTML内容
+            {},  # 空数据字典
+            False,  # 返回本地文件路径
+            options,  # 图片生成选项
+            priority=priority,
+        )
+        if image_path:
+            image_path = await self._render_cache.put(key, image_path)
+        return image_path
+    
+    def _remember_render(self, owner, context, query_time, image_path):
+        self._last_rendered[owner] = (context, query_time, image_path)
+        self._last_rendered.move_to_end(owner)
+        while len(self._last_rendered) > RENDER_CACHE_MAX_ENTRIES:
+            self._last_rendered.popitem(last=False)
+    
+    async def render_personal_info_image(self, data):
+        """使用个人信息模板生成图片"""
+        try:
+            # 提取数据
+            basic = data.get("基本信息", {})
+            battle_qi = data.get("斗气状态", {})
+            attributes = data.get("属性", {})
+            wealth = data.get("财富", {})
+            cooldowns = data.get("修炼冷却", {})
+            breakthrough = data.get("突破信息", {})
+            friends = data.get("道友列表", [])
+            battle = data.get("切磋战绩", {})
+            skills = data.get("技能", [])
+            items = data.get("物品", [])
+            
+            # 模板变量
+            context = {
+                "username": basic.get('用户名', ''),
+                "create_time": basic.get('创建时间', ''),
+                "level": battle_qi.get('等级', 0),
+                "cultivation": battle_qi.get('修为', 0),
+                "realm": battle_qi.get('境界', ''),
+                "experience": battle_qi.get('经验值', 0),
+                "battle_qi": battle_qi.get('斗气值', 0),
+                "health": attributes.get('生命值', 0),
+                "mana": attributes.get('灵力值', 0),
+                "stamina": attributes.get('体力值', 0),
+                "gold": wealth.get('金币', 0),
+                "spirit_stone": wealth.get('灵石', 0),
+                "next_realm": breakthrough.get('下一境界', ''),
+                "required_battle_qi": breakthrough.get('所需斗气', 0),
+                "current_battle_qi": breakthrough.get('当前斗气', 0),
+                "breakthrough_rate": breakthrough.get('突破成功率', 0),
+                "breakthrough_requirement": breakthrough.get('突破需求', ''),
+                "cd_meditate": cooldowns.get('打坐', ''),
+                "cd_breakthrough": cooldowns.get('突破', ''),
+                "cd_recover": cooldowns.get('调息', ''),
+                "cd_seclusion": cooldowns.get('闭关', ''),
+                "cd_duel": cooldowns.get('切磋', ''),
+                "cd_give": cooldowns.get('赠送', ''),
+                "battle_wins": battle.get('胜利', 0),
+                "battle_losses": battle.get('失败', 0),
+                # 列表数据
+                "friends": friends,
+                "skills": skills,
+                "items": items,
+            }
+            
+            # 使用html_render函数生成图片
+            options = self._render_options["personal_info"]
+            
+            # 数据未变化时复用上次的图片
+            return await self._render_cached("personal_info", PERSONAL_INFO_TPL, context, options)
+        except Exception as e:
+            logger.error(f"个人信息图片生成失败：{e}")
+            # 回退到默认的纯文本输出
+            return None
+    
+    async def render_status_image(self, data):
+        """使用状态模板生成图片"""
+        try:
+            # 模板变量
+            context = {
+                "username": data.get('用户名', ''),
+                "level": data.get('等级', 0),
+                "cultivation": data.get('修为', 0),
+                "realm": data.get('境界', ''),
+                "experience": data.get('经验', 0),
+                "battle_qi": data.get('斗气值', 0),
+                "health": data.get('生命值', 0),
+                "mana": data.get('灵力值', 0),
+                "stamina": data.get('体力值', 0),
+                "gold": data.get('金币', 0),
+                "spirit_stone": data.get('灵石', 0),
+            }
+            
+            # 使用html_render函数生成图片
+            options = self._render_options["status"]
+            
+            # 数据未变化时复用上次的图片
+            return await self._render_cached("status", STATUS_TPL, context, options)
+        except Exception as e:
+            logger.error(f"状态图片生成失败：{e}")
+            # 回退到默认的纯文本输出
+            return None
+    
+    async def render_ranking_image(self, data):
+        """使用排行榜模板生成图片"""
+        return await self._render_rank_list(
+            "📊 斗气排行榜 📊",
+            f"更新时间：{data.get('更新时间', '')}",
+            data.get("排行榜", []),
+            "修为",
+            "修为值",
+            RENDER_PRIORITY_SHARED,
+        )
+    
+    async def _render_rank_list(self, title, subtitle, players, value_label, value_key, priority):
+        """按排行榜模板把玩家列表渲染为图片，排行榜与全群状态共用"""
+        try:
+            template_start = time.perf_counter()
+            
+            # 生成排行榜内容
+            ranking_html = []
+            if players:
+                for rank, player in enumerate(players, 1):
+                    # 确定排名样式
+                    rank_class = ""
+                    if rank == 1:
+                        rank_class = " gold"
+                    elif rank == 2:
+                        rank_class = " silver"
+                    elif rank == 3:
+                        rank_class = " bronze"
+                    
+                    ranking_html.append(f'<div class="rank-item">')
+                    ranking_html.append(f'    <div class="rank-number{rank_class}">{rank}</div>')
+                    ranking_html.append(f'    <div class="player-info">')
+                    ranking_html.append(f'        <div class="player-name">{player.get("用户名", "")}</div>')
+                    ranking_html.append(f'        <div class="player-stats">')
+                    ranking_html.append(f'            <div class="stat-item">')
+                    ranking_html.append(f'                <span class="stat-label">境界：</span>')
+                    ranking_html.append(f'                <span class="stat-value">{player.get("境界", "")}</span>')
+                    ranking_html.append(f'            </div>')
+                    ranking_html.append(f'            <div class="stat-item">')
+                    ranking_html.append(f'                <span class="stat-label">{value_label}：</span>')
+                    ranking_html.append(f'                <span class="stat-value">{player.get(value_key, 0)}</span>')
+                    ranking_html.append(f'            </div>')
+                    ranking_html.append(f'            <div class="stat-item">')
+                    ranking_html.append(f'                <span class="stat-label">等级：</span>')
+                    ranking_html.append(f'                <span class="stat-value">{player.get("等级", 0)}</span>')
+                    ranking_html.append(f'            </div>')
+                    ranking_html.append(f'        </div>')
+                    ranking_html.append(f'    </div>')
+                    ranking_html.append(f'</div>')
+            else:
+                ranking_html.append('<div class="empty-rank">排行榜为空！</div>')
+            
+            rankings_content = '\n'.join(ranking_html)
+            
+            # 渲染模板
+            html_content = RANKING_TPL.render({
+                "title": title,
+                "update_time": subtitle,
+                "rankings_content": rankings_content,
+                "query_time": self._render_timestamp(),
+            })
+            self._metrics.observe("template", (time.perf_counter() - template_start) * 1000)
+            
+            # 使用html_render函数生成图片
+            options = self._render_options["ranking"]
+            
+            # 经渲染调度器调用AstrBot的html_render方法，图片存入磁盘缓存
+            return await self._render_html("ranking", html_content, options, priority)
+        except Exception as e:
+            logger.error(f"{title}图片生成失败：{e}")
+            # 回退到默认的纯文本输出
+            return None
+    
+    async def _collect_group_status(self, group_id):
+        """汇总群成员的状态：较新的快照直接使用，其余以有限并发请求上游
+        
+        快照按成员的QQ号读取，昵称与他人相同的成员不会显示他人的状态。
+        返回按境界与斗气排序的状态列表
+        """
+        members = await self._snapshots.members(group_id, self._group_max_members)
+        semaphore = asyncio.Semaphore(self._group_concurrency)
+        
+        async def fetch(username, password):
+            snapshot = await self._snapshots.get(password, username, "状态")
+            if snapshot and time.time() - snapshot[1] < self._group_fresh_seconds:
+                return snapshot[0]
+            async with semaphore:
+                response = await self._call_api("状态", {"username": username, "password": password})
+            if response.get("code") == 200:
+                return response.get("data")
+            # 只在上游不可用时退回到该成员自己的较旧快照，密码错误等拒绝不使用快照
+            if response.get("code") in (500, 503) and snapshot:
+                return snapshot[0]
+            return None
+        
+        results = await asyncio.gather(*(fetch(username, password) for username, password in members))
+        players = []
+        for (username, _), data in zip(members, results):
+            if isinstance(data, dict):
+                players.append({**data, "用户名": data.get("用户名") or username})
+        players.sort(key=lambda player: RankIndex.make_key(player["用户名"], player.get("境界"), player.get("斗气值")))
+        return players
+    
+    async def get_group_status(self, group_id):
+        """生成全群状态，同一个群并发请求只汇总与渲染一次，返回 (状态列表, 图片)"""
+        async def build():
+            players = await self._collect_group_status(group_id)
+            image_url = None
+            if players:
+                image_url = await self._render_rank_list(
+                    "👥 全群状态 👥",
+                    f"共{len(players)}名群成员",
+                    players,
+                    "斗气",
+                    "斗气值",
+                    RENDER_PRIORITY_USER,
+                )
+            return players, image_url
+        
+        return await self._single_flight(("group_status", group_id), build)
+    
+    async def _query_with_image(self, action, params, render):
+        """查询并渲染图片，相同用户的重复请求并发时共享同一次调用与渲染
+        
+        返回 (response, image_url)，image_url 为 None 时应回退到纯文本输出
+        """
+        async def _query():
+            response = await self._call_api(action, params)
+            if response.get("code") != 200:
+                return response, None
+            return response, await render(response.get("data", {}))
+        
+        key = ("image", action, tuple(sorted(params.items())))
+        return await self._single_flight(key, _query)
+    
+    async def get_ranking(self):
+        """获取排行榜数据及图片，所有用户共享缓存，并发请求只触发一次上游调用与渲染
+        
+        返回 (response, image_url)，image_url 为 None 时应回退到纯文本输出
+        """
+        cache = self._ranking_cache
+        if cache and cache["render"].done() and time.monotonic() < cache["expires_at"]:
+            return {"code": 200, "data": cache["data"]}, cache["render"].result()
+        
+        async with self._ranking_lock:
+            # 等待锁期间其他请求可能已刷新缓存
+            cache = self._ranking_cache
+            if not cache or time.monotonic() >= cache["expires_at"]:
+                response = await self._call_api("排行榜", {})
+                if response.get("code") != 200:
+                    if not cache:
+                        return response, None
+                    # 上游失败时继续使用旧数据
+                    logger.warning(f"排行榜刷新失败，使用缓存数据：{response.get('message')}")
+                else:
+                    data = response.get("data") or {}
+                    expires_at = time.monotonic() + self._ranking_refresh_delay(data)
+                    if cache and cache["data"] == data:
+                        # 内容未变化，沿用已渲染的图片
+                        cache["expires_at"] = expires_at
+                    else:
+                        # 每份数据只渲染一次，渲染失败也不在有效期内重复尝试
+                        cache = {
+                            "data": data,
+                            "expires_at": expires_at,
+                            "render": asyncio.ensure_future(self.render_ranking_image(data)),
+                        }
+                        self._ranking_cache = cache
+                        # 与其他数据来源一样先处理跨天，今天的排行榜不会被记入昨日名次
+                        self._index_player(None, "排行榜", data)
+        
+        # 在锁外等待渲染，排行榜的刷新不必排在浏览器渲染之后
+        image_url = await asyncio.shield(cache["render"])
+        return {"code": 200, "data": cache["data"]}, image_url
+    
+    @staticmethod
+    def _ranking_refresh_delay(data):
+        """按上游的更新时间推算距下次更新的秒数，无法解析时使用固定有效期"""
+        try:
+            updated = datetime.strptime(str(data.get("更新时间")), "%Y-%m-%d %H:%M:%S").timestamp()
+        except ValueError:
+            return RANKING_CACHE_TTL
+        return min(RANKING_CACHE_TTL, max(RANKING_MIN_REFRESH, updated + RANKING_CACHE_TTL - time.time()))
+    
+    @command_filter("斗破帮助")
+    @instrumented
+    async def help(self, event):
+        """查看所有指令说明"""
+        # 尝试获取缓存的菜单图片
+        image_url = await self.get_menu_image()
+        
+        if image_url:
+            # 如果生成图片成功，发送图片
+            yield event.image_result(image_url).use_t2i(False)
+        else:
+            # 否则发送纯文本
+            self._metrics.incr("text_fallback")
+            yield event.plain_result(HELP_TEXT)
+    
+    @command_filter("创建角色")
+    @instrumented
+    async def create_character(self, event):
+        """创建斗气角色，总是使用当前的QQ昵称，成功后改为登录新角色"""
+        password = str(event.message_obj.sender.user_id)
+        username = event.get_sender_name()[:12]
+        previous = self._identities.get(password)
+        
+        response = await self._call_api("创建角色", {"username": username, "password": password})
+        text = self._format_response(response)
+        if response.get("code") == 200 and previous and previous != username:
+            text += f"\n原角色“{previous}”已解除绑定，发送“绑定角色 {previous}”可切换回去"
+        yield event.plain_result(text)
+    
+    @command_filter("绑定角色")
+    @instrumented
+    async def bind_character(self, event):
+        """修改QQ昵称后找回原来的角色：以QQ号登录指定用户名，成功后记为该QQ号的角色"""
+        params, error = COMMAND_SPECS["绑定角色"].parse(event.message_str)
+        if error:
+            yield event.plain_result(f"❌ {error}")
+            return
+        
+        username = params["username"]
+        password = str(event.message_obj.sender.user_id)
+        if len(username) > 12:
+            yield event.plain_result("❌ 用户名不超过12位，为注册时QQ昵称的前12位")
+            return
+        if self._identities.get(password) == username:
+            yield event.plain_result(f"✅ 当前已绑定角色“{username}”")
+            return
+        
+        # 直接请求上游校验，不使用缓存与快照；密码即QQ号，只能绑定自己注册的角色
+        response = await self._request_api("状态", {"username": username, "password": password})
+        if response.get("code") != 200:
+            yield event.plain_result(f"❌ 绑定失败：{response.get('message', '未知错误')}（用户名为注册时QQ昵称的前12位）")
+            return
+        self._identities.record(password, username, replace=True)
+        yield event.plain_result(f"✅ 已绑定角色“{username}”，之后的指令都使用该角色")
+    
+    @command_filter("状态")
+    @instrumented
+    async def status(self, event):
+        """查看自己的斗气状态"""
+        username, password = self._credentials(event)
+        
+        # 查询并尝试生成图片
+        response, image_url = await self._query_with_image(
+            "状态", {"username": username, "password": password}, self.render_status_image
+        )
+        
+        if response.get("code") != 200:
+            yield event.plain_result(self._format_response(response))
+            return
+        
+        data = response.get("data", {})
+        
+        if image_url:
+            # 如果生成图片成功，发送图片
+            yield event.image_result(image_url).use_t2i(False)
+        else:
+            # 否则发送纯文本
+            self._metrics.incr("text_fallback")
+            status_text = f"""🌟 {data.get('用户名')} 的状态信息：
+
+📊 等级：{data.get('等级')}
+🛡️ 修为：{data.get('修为')}
+✨ 境界：{data.get('境界')}
+📈 经验：{data.get('经验')}
+❤️ 生命值：{data.get('生命值')}
+💧 灵力值：{data.get('灵力值')}
+💫 斗气值：{data.get('斗气值')}
+⚡ 体力值：{data.get('体力值')}
+💰 金币：{data.get('金币')}
+💎 灵石：{data.get('灵石')}
+"""
+            yield event.plain_result(status_text)
+        
+        caption = self._image_caption(response, image_url)
+        if caption:
+            yield event.plain_result(caption)
+    
+    @command_filter("个人信息")
+    @instrumented
+    async def personal_info(self, event):
+        """查看详细角色信息"""
+        username, password = self._credentials(event)
+        
+        # 查询并尝试生成图片
+        response, image_url = await self._query_with_image(
+            "个人信息", {"username": username, "password": password}, self.render_personal_info_image
+        )
+        
+        if response.get("code") != 200:
+            yield event.plain_result(self._format_response(response))
+            return
+        
+        data = response.get("data", {})
+        # 用上游返回的修炼冷却校准本地冷却记录，快照中的冷却需扣除已经过去的时间
+        elapsed = time.time() - response.get("snapshot_time", time.time())
+        self._cooldowns.update_from_info(username, data.get("修炼冷却"), elapsed)
+        
+        if image_url:
             # 如果生成图片成功，发送图片
             yield event.image_result(image_url).use_t2i(False)
         else:
             # 否则发送纯文本
+            self._metrics.incr("text_fallback")
             basic = data.get("基本信息", {})
             battle_qi = data.get("斗气状态", {})
             attributes = data.get("属性", {})
@@ -1154,111 +4027,40 @@ class LiteraryBattleQiBot(Star):
 {chr(10).join(f"- {item}" for item in items) if items else "暂无物品"}
 """
             yield event.plain_result(info_text)
-    
-    @filter.command("打坐", alias={"修炼", "冥想"})
-    async def meditate(self, event):
-        """基础修炼获得斗气，每次获得20斗气"""
-        # 自动获取用户的QQ名作为用户名，QQ号作为密码
-        username = event.get_sender_name()  # 获取QQ名作为用户名
-        username = username[:12]  # 确保不超过12位
-        password = str(event.message_obj.sender.user_id)  # 使用QQ号作为密码
-        
-        response = await self._call_api("打坐", {"username": username, "password": password})
-        
-        if response.get("code") != 200:
-            yield event.plain_result(self._format_response(response))
-            return
-        
-        data = response.get("data", {})
-        meditate_text = f"""🧘‍♀️ 打坐修炼成功！
-
-获得斗气：20点
-当前斗气：{data.get('当前斗气')}
-当前境界：{data.get('境界')}
-剩余体力：{data.get('剩余体力')}
-
-⏰ 冷却时间：10分钟"""
-        yield event.plain_result(meditate_text)
-    
-    @filter.command("突破", alias={"升级", "进阶"})
-    async def breakthrough(self, event):
-        """消耗斗气突破境界，有成功率"""
-        # 自动获取用户的QQ名作为用户名，QQ号作为密码
-        username = event.get_sender_name()  # 获取QQ名作为用户名
-        username = username[:12]  # 确保不超过12位
-        password = str(event.message_obj.sender.user_id)  # 使用QQ号作为密码
-        
-        response = await self._call_api("突破", {"username": username, "password": password})
-        
-        if response.get("code") != 200:
-            yield event.plain_result(self._format_response(response))
-            return
-        
-        data = response.get("data", {})
-        breakthrough_text = f"""🚀 突破成功！
-
-当前境界：{data.get('当前境界')}
-剩余斗气：{data.get('剩余斗气')}
-当前等级：{data.get('等级')}
-突破成功率：{data.get('突破成功率')}
-消耗体力：{data.get('消耗体力')}
-剩余体力：{data.get('剩余体力')}
-"""
-        yield event.plain_result(breakthrough_text)
-    
-    @filter.command("调息", alias={"恢复", "休息"})
-    async def recover(self, event):
-        """恢复生命和灵力"""
-        # 自动获取用户的QQ名作为用户名，QQ号作为密码
-        username = event.get_sender_name()  # 获取QQ名作为用户名
-        username = username[:12]  # 确保不超过12位
-        password = str(event.message_obj.sender.user_id)  # 使用QQ号作为密码
-        
-        response = await self._call_api("调息", {"username": username, "password": password})
-        yield event.plain_result(self._format_response(response))
-    
-    @filter.command("闭关", alias={"深度修炼"})
-    async def seclusion(self, event):
-        """长时间修炼获得更多斗气，每分钟1斗气"""
-        # 自动获取用户的QQ名作为用户名，QQ号作为密码
-        username = event.get_sender_name()  # 获取QQ名作为用户名
-        username = username[:12]  # 确保不超过12位
-        password = str(event.message_obj.sender.user_id)  # 使用QQ号作为密码
-        
-        # 解析可选的时长参数
-        msg = event.message_str.replace("闭关", "").replace("深度修炼", "").strip()
-        duration = None
-        if msg:
-            # 只取第一个参数作为时长
-            duration = msg.split()[0]
         
-        params = {"username": username, "password": password}
-        if duration:
-            params["duration"] = duration
-        
-        response = await self._call_api("闭关", params)
-        
-        if response.get("code") != 200:
-            yield event.plain_result(self._format_response(response))
-            return
-        
-        data = response.get("data", {})
-        seclusion_text = f"""🏯 闭关修炼成功！
-
-闭关时长：{data.get('闭关时长')}
-获得斗气：{data.get('当前斗气', 0) - (data.get('当前斗气', 0) - int(data.get('闭关时长', '0分钟').split('分钟')[0]))}
-当前斗气：{data.get('当前斗气')}
-当前境界：{data.get('境界')}
-消耗体力：{data.get('消耗体力')}
-剩余体力：{data.get('剩余体力')}
-
-⏰ 冷却时间：2小时"""
-        yield event.plain_result(seclusion_text)
+        caption = self._image_caption(response, image_url)
+        if caption:
+            yield event.plain_result(caption)
     
-    @filter.command("排行榜", alias={"排名", "榜单"})
+    @command_filter("打坐")
+    @instrumented
+    async def meditate(self, event):
+        """基础修炼获得斗气，每次获得20斗气"""
+        yield event.plain_result(await self._run_command("打坐", event))
+    
+    @command_filter("突破")
+    @instrumented
+    async def breakthrough(self, event):
+        """消耗斗气突破境界，有成功率"""
+        yield event.plain_result(await self._run_command("突破", event))
+    
+    @command_filter("调息")
+    @instrumented
+    async def recover(self, event):
+        """恢复生命和灵力"""
+        yield event.plain_result(await self._run_command("调息", event))
+    
+    @command_filter("闭关")
+    @instrumented
+    async def seclusion(self, event):
+        """长时间修炼获得更多斗气，每分钟1斗气"""
+        yield event.plain_result(await self._run_command("闭关", event))
+    
+    @command_filter("排行榜")
+    @instrumented
     async def ranking(self, event):
         """查看斗气排行榜"""
-        response = await self._call_api("排行榜", {})
+        response, image_url = await self.get_ranking()
         
         if response.get("code") != 200:
             yield event.plain_result(self._format_response(response))
@@ -1266,14 +4068,15 @@ class LiteraryBattleQiBot(Star):
         
         data = response.get("data", {})
         
-        # 尝试生成图片
-        image_url = await self.render_ranking_image(data)
-        
         if image_url:
             # 如果生成图片成功，发送图片
             yield event.image_result(image_url).use_t2i(False)
+            caption = self._image_caption(response, image_url)
+            if caption:
+                yield event.plain_result(caption)
         else:
             # 否则发送纯文本
+            self._metrics.incr("text_fallback")
             ranking_list = data.get("排行榜", [])
             update_time = data.get("更新时间")
             
@@ -1291,472 +4094,354 @@ class LiteraryBattleQiBot(Star):
             ranking_text += f"⏰ 更新时间：{update_time}"
             yield event.plain_result(ranking_text)
     
-    @filter.command("道友", alias={"好友", "道友列表"})
-    async def friends(self, event):
-        """查看好友/道友"""
-        # 自动获取用户的QQ名作为用户名，QQ号作为密码
-        username = event.get_sender_name()  # 获取QQ名作为用户名
-        username = username[:12]  # 确保不超过12位
-        password = str(event.message_obj.sender.user_id)  # 使用QQ号作为密码
-        
-        response = await self._call_api("道友", {"username": username, "password": password})
+    @command_filter("我的排名")
+    @instrumented
+    async def my_rank(self, event):
+        """查看自己的排名及较昨日的变化"""
+        username, password = self._credentials(event)
+        await self._ensure_rank_index()
+        if username not in self._rank_index:
+            # 本地还没有该玩家的数据时查询一次状态
+            response = await self._call_api("状态", {"username": username, "password": password})
+            if response.get("code") != 200:
+                yield event.plain_result(self._format_response(response))
+                return
+            self._index_player(username, "状态", response.get("data"))
         
-        if response.get("code") != 200:
-            yield event.plain_result(self._format_response(response))
+        self._roll_rank_day()
+        rank = self._rank_index.rank(username)
+        if rank is None:
+            yield event.plain_result("❌ 暂无你的排名数据，请先查看一次状态")
             return
         
-        data = response.get("data", {})
-        friend_list = data.get("道友列表", [])
-        friend_count = data.get("道友数量", 0)
+        known = self._rank_index.valued_count
+        if self._rank_index.has_value(username):
+            value_note = f"其中{len(self._rank_index) - known}名修为值未知，按同境界最低计"
+        else:
+            value_note = "你的修为值未知，暂按同境界最低计，上榜或出现在道友列表后会更新"
         
-        friends_text = f"👥 道友列表（共{friend_count}人）\n\n"
-        for friend in friend_list:
-            friends_text += f"- {friend.get('用户名')}\n"
-            friends_text += f"  境界：{friend.get('境界')}\n"
-            friends_text += f"  等级：{friend.get('等级')}\n"
-            friends_text += f"  修为值：{friend.get('修为值')}\n\n"
+        previous = self._rank_baseline.get(username)
+        if previous is None:
+            change = "昨日暂无记录"
+        elif previous > rank:
+            change = f"较昨日上升{previous - rank}名 ⬆️"
+        elif previous < rank:
+            change = f"较昨日下降{rank - previous}名 ⬇️"
+        else:
+            change = "与昨日持平"
         
-        yield event.plain_result(friends_text)
+        yield event.plain_result(f"""🏅 {username} 的排名
+
+当前排名：第{rank}名
+名次变化：{change}
+
+（按境界与修为值统计插件已知的{len(self._rank_index)}名玩家，{value_note}）""")
     
-    @filter.command("切磋", alias={"比试", "挑战"})
-    async def duel(self, event):
-        """与道友切磋"""
-        # 自动获取用户的QQ名作为用户名，QQ号作为密码
-        username = event.get_sender_name()  # 获取QQ名作为用户名
-        username = username[:12]  # 确保不超过12位
-        password = str(event.message_obj.sender.user_id)  # 使用QQ号作为密码
-        
-        msg = event.message_str.replace("切磋", "").replace("比试", "").replace("挑战", "").strip()
-        parts = msg.split()
-        if len(parts) < 1:
-            yield event.plain_result("❌ 请输入完整参数！格式：切磋 @456789")
+    @command_filter("全群状态")
+    @instrumented
+    async def group_status(self, event):
+        """查看群内所有使用过插件的成员的境界与斗气"""
+        group_id = event.get_group_id()
+        if not group_id:
+            yield event.plain_result("❌ 请在群聊中使用全群状态")
             return
-        
-        target = parts[0]
-        
-        # 检查target格式
-        if not target.startswith("@"):
-            yield event.plain_result("❌ 切磋对象格式错误！请使用 @用户名 格式，如 @456789")
+        if not self._snapshots:
+            yield event.plain_result("❌ 全群状态需要开启玩家快照（storage.enabled）")
             return
         
-        response = await self._call_api("切磋", {"username": username, "password": password, "target": target})
+        # 记录发起人，保证其出现在列表中
+        self._credentials(event)
+        players, image_url = await self.get_group_status(str(group_id))
+        if not players:
+            yield event.plain_result("👥 暂无群成员数据，群成员使用任意指令后即会记录")
+            return
         
-        if response.get("code") != 200:
-            yield event.plain_result(self._format_response(response))
+        if image_url:
+            yield event.image_result(image_url).use_t2i(False)
+            caption = self._image_caption({}, image_url)
+            if caption:
+                yield event.plain_result(caption)
             return
         
-        data = response.get("data", {})
-        duel_text = f"""⚔️ 切磋结果
-
-{response.get('message')}
-
-=== 切磋双方 ===
-挑战者：{data.get('切磋双方', {}).get('挑战者')}
-应战者：{data.get('切磋双方', {}).get('应战者')}
-
-=== 胜负结果 ===
-{data.get('胜负结果')}
-
-=== 战斗详情 ===
-你的修为：{data.get('战斗详情', {}).get('你的修为')}
-对手修为：{data.get('战斗详情', {}).get('对手修为')}
-
-战斗值：
-你的战斗值：{data.get('战斗详情', {}).get('战斗值', {}).get('你的战斗值')}
-对手战斗值：{data.get('战斗详情', {}).get('战斗值', {}).get('对手战斗值')}
-
-=== 当前战绩 ===
-胜利：{data.get('当前战绩', {}).get('胜利')}
-失败：{data.get('当前战绩', {}).get('失败')}
-
-⏰ 冷却时间：5分钟"""
-        yield event.plain_result(duel_text)
+        self._metrics.incr("text_fallback")
+        lines = [f"👥 全群状态（共{len(players)}人）", ""]
+        for i, player in enumerate(players, 1):
+            lines.append(f"{i}. {player['用户名']}  {player.get('境界')}  斗气{player.get('斗气值')}  等级{player.get('等级')}")
+        yield event.plain_result("\n".join(lines))
+    
+    @command_filter("道友")
+    @instrumented
+    async def friends(self, event):
+        """查看好友/道友"""
+        yield event.plain_result(await self._run_command("道友", event))
     
-    @filter.command("赠送", alias={"送礼", "给予"})
+    @command_filter("切磋")
+    @instrumented
+    async def duel(self, event):
+        """与道友切磋"""
+        yield event.plain_result(await self._run_command("切磋", event))
+    
+    @command_filter("赠送")
+    @instrumented
     async def give(self, event):
         """赠送物品给道友"""
-        # 自动获取用户的QQ名作为用户名，QQ号作为密码
-        username = event.get_sender_name()  # 获取QQ名作为用户名
-        username = username[:12]  # 确保不超过12位
-        password = str(event.message_obj.sender.user_id)  # 使用QQ号作为密码
-        
-        msg = event.message_str.replace("赠送", "").replace("送礼", "").replace("给予", "").strip()
-        parts = msg.split()
-        if len(parts) < 2:
-            yield event.plain_result("❌ 请输入完整参数！格式：赠送 @456789 灵石x10")
-            return
-        
-        target = parts[0]
-        item = " ".join(parts[1:])
-        
-        # 检查target格式
-        if not target.startswith("@"):
-            yield event.plain_result("❌ 赠送对象格式错误！请使用 @用户名 格式，如 @456789")
-            return
-        
-        response = await self._call_api("赠送", {"username": username, "password": password, "target": target, "item": item})
-        
-        if response.get("code") != 200:
-            yield event.plain_result(self._format_response(response))
-            return
-        
-        data = response.get("data", {})
-        give_text = f"""🎁 赠送成功！
-
-{response.get('message')}
-
-赠送对象：{data.get('赠送对象')}
-赠送物品：{data.get('赠送物品')}
-赠送数量：{data.get('赠送数量')}
-你的剩余：{data.get('你的剩余')}
-对方获得：{data.get('对方获得')}
-
-⏰ 冷却时间：10分钟"""
-        yield event.plain_result(give_text)
+        yield event.plain_result(await self._run_command("赠送", event))
     
-    @filter.command("任务", alias={"任务列表", "领取任务", "完成任务"})
+    @command_filter("任务")
+    @instrumented
     async def task(self, event):
         """任务系统"""
-        # 自动获取用户的QQ名作为用户名，QQ号作为密码
-        username = event.get_sender_name()  # 获取QQ名作为用户名
-        username = username[:12]  # 确保不超过12位
-        password = str(event.message_obj.sender.user_id)  # 使用QQ号作为密码
-        
-        # 解析任务操作
-        msg = event.message_str.replace("任务", "").replace("任务列表", "").replace("领取任务", "").replace("完成任务", "").strip()
-        parts = msg.split()
-        
-        action_type = "列表"  # 默认查看任务列表
-        task_id = None
-        
-        if parts:
-            action_type = parts[0]
-            if len(parts) > 1:
-                task_id = parts[1]
-        
-        params = {"username": username, "password": password, "action_type": action_type}
-        if task_id:
-            params["task_id"] = task_id
-        
-        response = await self._call_api("任务", params)
-        
-        if response.get("code") != 200:
-            yield event.plain_result(self._format_response(response))
-            return
-        
-        data = response.get("data", {})
-        if action_type == "列表":
-            # 生成任务列表文本
-            task_list = data.get("任务列表", [])
-            task_text = f"""📋 任务列表
-
-{response.get('message')}
-
-"""
-            for task in task_list:
-                task_text += f"🎯 {task.get('name')}\n"
-                task_text += f"   描述：{task.get('description')}\n"
-                task_text += f"   奖励：斗气{task.get('reward', {}).get('斗气', 0)}，灵石{task.get('reward', {}).get('灵石', 0)}，经验{task.get('reward', {}).get('经验', 0)}\n\n"
-        else:
-            task_text = response.get('message', '操作成功')
-        
-        yield event.plain_result(task_text)
+        yield event.plain_result(await self._run_command("任务", event))
     
-    @filter.command("背包", alias={"背包查看", "背包整理", "使用物品"})
+    @command_filter("背包")
+    @instrumented
     async def backpack(self, event):
         """背包管理系统"""
-        # 自动获取用户的QQ名作为用户名，QQ号作为密码
-        username = event.get_sender_name()  # 获取QQ名作为用户名
-        username = username[:12]  # 确保不超过12位
-        password = str(event.message_obj.sender.user_id)  # 使用QQ号作为密码
-        
-        # 解析背包操作
-        msg = event.message_str.replace("背包", "").replace("背包查看", "").replace("背包整理", "").replace("使用物品", "").strip()
-        parts = msg.split()
-        
-        action_type = "查看"  # 默认查看背包
-        item_name = None
-        
-        if parts:
-            action_type = parts[0]
-            if len(parts) > 1:
-                item_name = " ".join(parts[1:])
-        
-        params = {"username": username, "password": password, "action_type": action_type}
-        if item_name:
-            params["item_name"] = item_name
-        
-        response = await self._call_api("背包", params)
-        
-        if response.get("code") != 200:
-            yield event.plain_result(self._format_response(response))
-            return
-        
-        data = response.get("data", {})
-        if action_type == "查看":
-            # 生成背包物品列表
-            items = data.get("背包物品", {})
-            backpack_text = f"""🎒 背包物品
-
-{response.get('message')}
-
-物品数量：{data.get('物品数量', 0)}
-
-"""
-            for item, count in items.items():
-                backpack_text += f"- {item}: {count}\n"
-        else:
-            backpack_text = response.get('message', '操作成功')
-        
-        yield event.plain_result(backpack_text)
+        yield event.plain_result(await self._run_command("背包", event))
     
-    @filter.command("签到", alias={"每日签到"})
+    @command_filter("签到")
+    @instrumented
     async def sign_in(self, event):
         """每日签到领取奖励"""
-        # 自动获取用户的QQ名作为用户名，QQ号作为密码
-        username = event.get_sender_name()  # 获取QQ名作为用户名
-        username = username[:12]  # 确保不超过12位
-        password = str(event.message_obj.sender.user_id)  # 使用QQ号作为密码
-        
-        response = await self._call_api("签到", {"username": username, "password": password})
-        
-        if response.get("code") != 200:
-            yield event.plain_result(self._format_response(response))
-            return
-        
-        data = response.get("data", {})
-        sign_in_text = f"""📅 签到成功！
-
-{response.get('message')}
-
-签到日期：{data.get('签到日期')}
-连续签到天数：{data.get('连续签到天数')}天
-
-=== 获得奖励 ===
-斗气：{data.get('获得奖励', {}).get('斗气', 0)}
-灵石：{data.get('获得奖励', {}).get('灵石', 0)}
-经验：{data.get('获得奖励', {}).get('经验', 0)}
-
-⏰ 冷却时间：24小时"""
-        yield event.plain_result(sign_in_text)
+        yield event.plain_result(await self._run_command("签到", event))
     
-    @filter.command("日志", alias={"修炼日志", "战斗日志"})
+    @command_filter("日志")
+    @instrumented
     async def log(self, event):
         """查看近期修炼和战斗记录"""
-        # 自动获取用户的QQ名作为用户名，QQ号作为密码
-        username = event.get_sender_name()  # 获取QQ名作为用户名
-        username = username[:12]  # 确保不超过12位
-        password = str(event.message_obj.sender.user_id)  # 使用QQ号作为密码
-        
-        response = await self._call_api("日志", {"username": username, "password": password})
-        
-        if response.get("code") != 200:
-            yield event.plain_result(self._format_response(response))
-            return
-        
-        data = response.get("data", {})
-        log_list = data.get("日志列表", [])
-        log_text = f"""📋 修炼日志
-
-{response.get('message')}
-
-日志数量：{data.get('日志数量', 0)}
-
-"""
-        for log in log_list:
-            log_text += f"⏰ {log.get('时间')} - {log.get('类型')}\n"
-            log_text += f"   {log.get('内容')}\n\n"
-        
-        yield event.plain_result(log_text)
+        yield event.plain_result(await self._run_command("日志", event))
     
-    @filter.command("探索", alias={"探索地点"})
+    @command_filter("探索")
+    @instrumented
     async def explore(self, event):
         """探索地点获取资源"""
-        # 自动获取用户的QQ名作为用户名，QQ号作为密码
-        username = event.get_sender_name()  # 获取QQ名作为用户名
-        username = username[:12]  # 确保不超过12位
-        password = str(event.message_obj.sender.user_id)  # 使用QQ号作为密码
-        
-        # 解析探索地点
-        msg = event.message_str.replace("探索", "").replace("探索地点", "").strip()
-        if not msg:
-            yield event.plain_result("❌ 请输入探索地点！格式：探索 魔兽山脉")
-            return
-        
-        location = msg
-        
-        response = await self._call_api("探索", {"username": username, "password": password, "location": location})
-        
-        if response.get("code") != 200:
-            yield event.plain_result(self._format_response(response))
-            return
-        
-        data = response.get("data", {})
-        explore_text = f"""🗺️ 探索成功！
-
-{response.get('message')}
-
-探索地点：{data.get('探索地点')}
-
-=== 获得奖励 ===
-"""
-        
-        # 处理获得的奖励
-        rewards = data.get('获得奖励', {})
-        for reward_type, amount in rewards.items():
-            explore_text += f"{reward_type}：{amount}\n"
-        
-        explore_text += f"\n消耗体力：{data.get('消耗体力')}\n"
-        explore_text += f"剩余体力：{data.get('剩余体力')}"
-        
-        yield event.plain_result(explore_text)
+        yield event.plain_result(await self._run_command("探索", event))
     
-    @filter.command("副本", alias={"挑战副本"})
+    @command_filter("副本")
+    @instrumented
     async def dungeon(self, event):
         """挑战副本获得奖励"""
-        # 自动获取用户的QQ名作为用户名，QQ号作为密码
-        username = event.get_sender_name()  # 获取QQ名作为用户名
-        username = username[:12]  # 确保不超过12位
-        password = str(event.message_obj.sender.user_id)  # 使用QQ号作为密码
-        
-        # 解析副本名称
-        msg = event.message_str.replace("副本", "").replace("挑战副本", "").strip()
-        if not msg:
-            yield event.plain_result("❌ 请输入副本名称！格式：副本 天焚炼气塔")
-            return
-        
-        dungeon_name = msg
-        
-        response = await self._call_api("副本", {"username": username, "password": password, "dungeon": dungeon_name})
-        
-        if response.get("code") != 200:
-            yield event.plain_result(self._format_response(response))
-            return
-        
-        data = response.get("data", {})
-        dungeon_text = f"""🏰 副本挑战成功！
-
-{response.get('message')}
-
-副本名称：{data.get('副本名称')}
-
-=== 获得奖励 ===
-"""
-        
-        # 处理获得的奖励
-        rewards = data.get('获得奖励', {})
-        for reward_type, amount in rewards.items():
-            dungeon_text += f"{reward_type}：{amount}\n"
-        
-        dungeon_text += f"\n消耗体力：{data.get('消耗体力')}\n"
-        dungeon_text += f"剩余体力：{data.get('剩余体力')}"
-        
-        yield event.plain_result(dungeon_text)
+        yield event.plain_result(await self._run_command("副本", event))
     
-    @filter.command("逃跑", alias={"脱离战斗"})
+    @command_filter("逃跑")
+    @instrumented
     async def escape(self, event):
         """脱离战斗"""
-        # 自动获取用户的QQ名作为用户名，QQ号作为密码
-        username = event.get_sender_name()  # 获取QQ名作为用户名
-        username = username[:12]  # 确保不超过12位
-        password = str(event.message_obj.sender.user_id)  # 使用QQ号作为密码
-        
-        response = await self._call_api("逃跑", {"username": username, "password": password})
-        
-        if response.get("code") != 200:
-            yield event.plain_result(self._format_response(response))
-            return
-        
-        data = response.get("data", {})
-        escape_text = f"""🏃 逃跑结果
-
-{response.get('message')}
-
-逃跑成功率：{data.get('逃跑成功率')}
-结果：{data.get('结果')}"""
-        
-        yield event.plain_result(escape_text)
+        yield event.plain_result(await self._run_command("逃跑", event))
     
-    @filter.command("采集", alias={"采集药材"})
+    @command_filter("采集")
+    @instrumented
     async def collect(self, event):
         """采集药材"""
-        # 自动获取用户的QQ名作为用户名，QQ号作为密码
-        username = event.get_sender_name()  # 获取QQ名作为用户名
-        username = username[:12]  # 确保不超过12位
-        password = str(event.message_obj.sender.user_id)  # 使用QQ号作为密码
-        
-        # 解析采集药材名称
-        msg = event.message_str.replace("采集", "").replace("采集药材", "").strip()
-        if not msg:
-            yield event.plain_result("❌ 请输入要采集的药材名称！格式：采集 凝血草")
+        yield event.plain_result(await self._run_command("采集", event))
+    
+    @command_filter("炼制")
+    @instrumented
+    async def refine(self, event):
+        """炼制丹药"""
+        yield event.plain_result(await self._run_command("炼制", event))
+    
+    
+    @command_filter("丹方")
+    @instrumented
+    async def recipe(self, event):
+        """查看丹药配方"""
+        yield event.plain_result(await self._run_command("丹方", event))
+    
+    @command_filter("学习功法")
+    @instrumented
+    async def learn_skill(self, event):
+        """学习新的功法"""
+        yield event.plain_result(await self._run_command("学习功法", event))
+    
+    @command_filter("升级功法")
+    @instrumented
+    async def upgrade_skill(self, event):
+        """升级已有功法"""
+        yield event.plain_result(await self._run_command("升级功法", event))
+    
+    @command_filter("技能")
+    @instrumented
+    async def skills(self, event):
+        """查看技能列表"""
+        yield event.plain_result(await self._run_command("技能", event))
+    
+    @command_filter("宗门")
+    @instrumented
+    async def sect(self, event):
+        """宗门系统"""
+        yield event.plain_result(await self._run_command("宗门", event))
+    
+    @command_filter("宗门任务")
+    @instrumented
+    async def sect_task(self, event):
+        """宗门任务系统"""
+        yield event.plain_result(await self._run_command("宗门任务", event))
+    
+    @command_filter("拍卖行")
+    @instrumented
+    async def auction(self, event):
+        """拍卖行系统"""
+        yield event.plain_result(await self._run_command("拍卖行", event))
+    
+    @command_filter("自动")
+    @instrumented
+    async def auto_action(self, event):
+        """冷却结束时自动执行打坐、调息、签到"""
+        if not self._schedule_enabled:
+            yield event.plain_result("❌ 自动修炼未开启")
             return
         
-        herb = msg
+        params, _ = COMMAND_SPECS["自动"].parse(event.message_str)
+        username, password = self._credentials(event)
+        operation = params["operation"]
+        self._scheduler.start()
         
-        response = await self._call_api("采集", {"username": username, "password": password, "herb": herb})
+        if operation == "列表":
+            lines = []
+            for action in SCHEDULABLE_ACTIONS:
+                job = self._scheduler.get(password, action)
+                if job is None:
+                    continue
+                line = f"- {action}：下次执行 {_format_schedule_time(job['next_run'])}"
+                if job["last_run"]:
+                    line += f"，上次 {_format_schedule_time(job['last_run'])} {job['last_result']}"
+                lines.append(line)
+            if not lines:
+                yield event.plain_result("⏰ 暂无自动修炼，发送“自动 打坐”开启（可选：打坐、调息、签到）")
+                return
+            yield event.plain_result("⏰ 自动修炼\n\n" + "\n".join(lines) + "\n\n发送“自动 取消 [指令]”关闭")
+            return
         
-        if response.get("code") != 200:
-            yield event.plain_result(self._format_response(response))
+        if operation == "取消":
+            actions = [params["action"]] if params.get("action") else SCHEDULABLE_ACTIONS
+            removed = self._scheduler.remove(password, actions)
+            yield event.plain_result(f"✅ 已关闭{removed}项自动修炼" if removed else "❌ 没有可关闭的自动修炼")
             return
         
-        data = response.get("data", {})
-        collect_text = f"""🌿 采集成功！
+        if operation not in SCHEDULABLE_ACTIONS:
+            yield event.plain_result(f"❌ 仅支持自动执行：{'、'.join(SCHEDULABLE_ACTIONS)}")
+            return
+        
+        # 本地记录仍在冷却时等到冷却结束再执行第一次；身份只在上游登录成功后记录，这里不记录
+        delay = self._cooldowns.remaining(username, operation)
+        if not self._scheduler.add(password, username, operation, delay, event.unified_msg_origin):
+            yield event.plain_result("❌ 自动修炼人数已满，请稍后再试")
+            return
+        job = self._scheduler.get(password, operation)
+        yield event.plain_result(
+            f"✅ 已开启自动{operation}，冷却结束后自动执行\n"
+            f"下次执行：{_format_schedule_time(job['next_run'])}"
+        )
+    
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @command_filter("斗气渲染状态")
+    @instrumented
+    async def render_stats(self, event):
+        """查看图片渲染队列统计（仅管理员）"""
+        stats = self._render_scheduler.stats()
+        stats_text = f"""🖼️ 渲染队列状态
 
-{response.get('message')}
+正在渲染：{stats['running']}
+排队中：{stats['queued']}
+已完成：{stats['completed']}
+队列满被拒：{stats['rejected']}
+超时：{stats['timeouts']}
+失败：{stats['failed']}
+文字降级：{'是' if stats['degraded'] else '否'}（已降级 {stats['degraded_skips']} 次）
 
-采集药材：{data.get('采集药材')}
-获得数量：{data.get('获得数量')}株
+排队耗时 p50/p95：{stats['wait_p50_ms']:.0f}ms / {stats['wait_p95_ms']:.0f}ms
+渲染耗时 p50/p95：{stats['render_p50_ms']:.0f}ms / {stats['render_p95_ms']:.0f}ms
 
-消耗体力：{data.get('消耗体力')}
-剩余体力：{data.get('剩余体力')}"""
-        
-        yield event.plain_result(collect_text)
+图片缓存：{len(self._render_cache)}张，{self._render_cache.total_bytes / 1024 / 1024:.1f}MB / {self._render_cache.max_bytes / 1024 / 1024:.0f}MB（{self._render_cache.policy.upper()}，已淘汰 {self._render_cache.evicted} 张）"""
+        yield event.plain_result(stats_text)
     
-    @filter.command("炼制", alias={"炼制丹药"})
-    async def refine(self, event):
-        """炼制丹药"""
-        # 自动获取用户的QQ名作为用户名，QQ号作为密码
-        username = event.get_sender_name()  # 获取QQ名作为用户名
-        username = username[:12]  # 确保不超过12位
-        password = str(event.message_obj.sender.user_id)  # 使用QQ号作为密码
-        
-        # 解析炼制丹药名称
-        msg = event.message_str.replace("炼制", "").replace("炼制丹药", "").strip()
-        if not msg:
-            yield event.plain_result("❌ 请输入要炼制的丹药名称！格式：炼制 筑基灵液")
-            return
-        
-        pill = msg
-        
-        response = await self._call_api("炼制", {"username": username, "password": password, "pill": pill})
-        
-        if response.get("code") != 200:
-            yield event.plain_result(self._format_response(response))
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @command_filter("斗气存储状态")
+    @instrumented
+    async def storage_stats(self, event):
+        """查看玩家快照存储统计（仅管理员）"""
+        if not self._snapshots:
+            yield event.plain_result("❌ 玩家快照未启用，请在插件配置中开启 storage.enabled")
             return
         
-        data = response.get("data", {})
-        refine_text = f"""⚗️ 炼制结果
-
-{response.get('message')}
+        stats = await self._snapshots.stats()
+        realms = "\n".join(f"  {realm}：{count}人" for realm, count in stats["realms"]) or "  暂无数据"
+        stats_text = f"""💾 玩家快照存储
 
-丹药名称：{data.get('丹药名称')}
-炼制结果：{data.get('炼制结果')}
-获得数量：{data.get('获得数量')}
+玩家数：{stats['players']}
+快照数：{stats['rows']}
+磁盘占用：{stats['disk_bytes'] / 1024 / 1024:.1f}MB / {self._snapshots.max_bytes / 1024 / 1024:.0f}MB
+待写入：{stats['pending']}
+已写入：{stats['written']}
+超限清理：{stats['evicted']}
 
-=== 消耗材料 ===
-"""
+境界分布：
+{realms}"""
+        yield event.plain_result(stats_text)
+    
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @command_filter("斗气性能统计")
+    @instrumented
+    async def metrics_stats(self, event):
+        """查看、导出或重置各指令的分阶段耗时统计（仅管理员）
         
-        # 处理消耗的材料
-        consumed = data.get('消耗材料', {})
-        for material, amount in consumed.items():
-            refine_text += f"{material}：{amount}\n"
+        格式：斗气性能统计 [导出/重置]
+        """
+        if not self._metrics.enabled:
+            yield event.plain_result("❌ 性能统计未启用，请在插件配置中开启 metrics.enabled")
+            return
         
-        refine_text += f"\n消耗体力：{data.get('消耗体力')}\n"
-        refine_text += f"剩余体力：{data.get('剩余体力')}"
+        params, _ = COMMAND_SPECS["斗气性能统计"].parse(event.message_str)
+        option = params.get("option")
+        if option not in (None, "导出", "重置"):
+            yield event.plain_result(f"❌ 格式：{COMMAND_SPECS['斗气性能统计'].usage}")
+            return
+        if option == "重置":
+            self._metrics.reset()
+            yield event.plain_result("✅ 性能统计已重置")
+            return
+        if option == "导出":
+            path = os.path.join(PLUGIN_DATA_DIR, f"metrics_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+            try:
+                self._metrics.dump(path)
+            except OSError as e:
+                yield event.plain_result(f"❌ 导出失败：{e}")
+                return
+            yield event.plain_result(f"✅ 性能统计已导出到 {path}")
+            return
         
-        yield event.plain_result(refine_text)
+        snapshot = self._metrics.snapshot()
+        started = datetime.fromtimestamp(snapshot["started_at"]).strftime("%Y-%m-%d %H:%M:%S")
+        lines = [f"⏱️ 指令性能统计（自 {started}）", ""]
+        for command, stats in sorted(snapshot["commands"].items()):
+            events = stats["events"]
+            lines.append(f"【{command}】调用 {events.get('calls', 0)} 次")
+            for stage, histogram in sorted(stats["stages"].items()):
+                lines.append(
+                    f"  {stage}：{histogram['count']}次 平均{histogram['avg_ms']:.0f}ms "
+                    f"p95≤{histogram['p95_ms']:.0f}ms 最大{histogram['max_ms']:.0f}ms"
+                )
+            other_events = [f"{name}={count}" for name, count in sorted(events.items()) if name != "calls"]
+            if other_events:
+                lines.append(f"  事件：{'，'.join(other_events)}")
+        if len(lines) == 2:
+            lines.append("暂无数据")
+        yield event.plain_result("\n".join(lines))
     
     async def terminate(self):
         """插件被卸载/停用时调用"""
+        if self._load_task is not None:
+            # 载入未完成时保存会覆盖磁盘上的数据
+            await self._load_task
+        if self._catalogue_task:
+            self._catalogue_task.cancel()
+        await self._scheduler.stop()
+        if self._snapshots:
+            await self._snapshots.close()
+        # 保存图片的使用情况，重启后按其继续淘汰
+        await self._render_cache.save()
+        if self._identities.dirty:
+            self._identities.save()
         await self.client.aclose()
         logger.info("文字斗气机器人插件已卸载")
\ No newline at end of file